@@ -0,0 +1,13 @@
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible_collections.community.necsipphonetool.plugins.modules import get_config
+from ansible_collections.community.necsipphonetool.plugins.plugin_utils.nec_action import NecModuleAction
+
+
+class ActionModule(NecModuleAction):
+    # Run get_config in the controller process for local connections
+    moduleArgs = get_config.module_args
+    runTask = staticmethod(get_config.readPhoneConfig)
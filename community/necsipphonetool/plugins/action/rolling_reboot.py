@@ -0,0 +1,13 @@
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible_collections.community.necsipphonetool.plugins.modules import rolling_reboot
+from ansible_collections.community.necsipphonetool.plugins.plugin_utils.nec_action import NecModuleAction
+
+
+class ActionModule(NecModuleAction):
+    # Run rolling_reboot in the controller process for local connections
+    moduleArgs = rolling_reboot.module_args
+    runTask = staticmethod(rolling_reboot.releaseReboots)
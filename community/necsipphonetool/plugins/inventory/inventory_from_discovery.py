@@ -0,0 +1,173 @@
+# Plugin to Create Inventory by discovering phones on voice VLAN subnets
+
+DOCUMENTATION='''
+    name: community.necsipphonetool.inventory_from_discovery
+    plugin_type: inventory
+    author:
+        - Raymond Rizzo
+    short_description: Inventory from a sweep of phone subnets
+    description:
+        - Create inventory by sweeping voice VLAN subnets for NEC phone web UIs, for use with necsipphonetool or other modules
+        - Addresses are probed concurrently from one event loop, with a bounded number of probes in flight and short timeouts.
+        - A phone is recognised by the page its index.cgi answers with, and grouped by the terminal type on that page.
+        - Only sweep networks you are responsible for.
+        - Uses a YAML configuration file that ends with C(discovery.yml) or C(discovery.yaml).
+    extends_documentation_fragment:
+        - inventory_cache
+        - constructed
+    options:
+        plugin:
+            description: Name of the plugin
+            required: True
+            choices: ['community.necsipphonetool.inventory_from_discovery']
+        networks:
+            description: Networks to sweep in CIDR notation, for example the voice VLAN subnets.
+            type: list
+            elements: string
+            required: True
+        exclude:
+            description: Addresses or networks in CIDR notation not to probe.
+            type: list
+            elements: string
+            required: False
+            default: []
+        ports:
+            description: TCP ports to probe on each address, all at once. If more than one answers as a phone, the first in this list is used.
+            type: list
+            elements: integer
+            required: False
+            default: [80, 443]
+        https_ports:
+            description: Ports from ports that are spoken to over https.
+            type: list
+            elements: integer
+            required: False
+            default: [443]
+        concurrency:
+            description:
+                - Probes in flight at the same time, one per port of each address being probed. The open file limit is raised to allow it where possible.
+                - Sweeping mostly empty space takes about addresses * ports / concurrency * connect_timeout seconds, so 1024 covers a /16 on the two default ports in about a minute.
+            type: integer
+            required: False
+            default: 1024
+        connect_timeout:
+            description: Seconds to wait for a connection. A port that does not answer in time is taken to be closed; the address's other ports are probed at the same time, so it does not delay them.
+            type: float
+            required: False
+            default: 0.5
+        read_timeout:
+            description: Seconds to wait for index.cgi to answer once connected.
+            type: float
+            required: False
+            default: 3
+        group:
+            description: Group every phone found is added to
+            type: string
+            required: False
+            default: nec_phones
+        model_group_prefix:
+            description: Prefix of the per-model groups, phones of terminal type C(DT800) are added to C(model_DT800). Phones whose page names no model go to C(<prefix>_unknown).
+            type: string
+            required: False
+            default: model
+'''
+
+EXAMPLES = '''
+# phones.discovery.yml
+plugin: community.necsipphonetool.inventory_from_discovery
+networks:
+  - 10.4.0.0/16
+exclude:
+  - 10.4.0.1
+cache: true
+cache_plugin: ansible.builtin.jsonfile
+cache_connection: ~/.ansible/necsipphonetool/inventory
+cache_timeout: 3600
+'''
+
+from ansible.errors import AnsibleParserError
+from ansible.module_utils.common.text.converters import to_native
+from ansible.plugins.inventory import BaseInventoryPlugin, Constructable, Cacheable
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_discovery import discoverPhones
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import modelFamily
+
+class InventoryModule(BaseInventoryPlugin, Constructable, Cacheable):
+    NAME = 'community.necsipphonetool.inventory_from_discovery'
+
+    def verify_file(self, path):
+        valid = False
+        if super(InventoryModule, self).verify_file(path):
+            if path.endswith(('discovery.yml', 'discovery.yaml')):
+                valid = True
+            else:
+                self.display.vvv('Skipping due to inventory source not ending in "discovery.yml" nor "discovery.yaml"')
+        return valid
+
+    # Sweep the configured networks, returning what is cached
+    def _discover(self):
+        try:
+            phones, probed, sweepSeconds = discoverPhones(
+                self.get_option('networks'), self.get_option('exclude'), self.get_option('ports'), self.get_option('https_ports'),
+                self.get_option('concurrency'), self.get_option('connect_timeout'), self.get_option('read_timeout'))
+        except ValueError as e:
+            raise AnsibleParserError('Invalid network in {}: {}'.format(self.NAME, to_native(e)))
+        return {'phones': phones, 'probed': probed, 'seconds': round(sweepSeconds, 3)}
+
+    # Add one phone found by the sweep
+    def _addPhone(self, phoneInfo):
+        hostName = phoneInfo['address']
+        self.inventory.add_host(hostName, group=self.topGroup)
+        modelGroup = self._sanitize_group_name('{}_{}'.format(self.get_option('model_group_prefix'), phoneInfo['model'] or 'unknown'))
+        if modelGroup not in self.inventory.groups:
+            self.inventory.add_group(modelGroup)
+        self.inventory.add_child(modelGroup, hostName)
+        defaultPort = 443 if phoneInfo['scheme'] == 'https' else 80
+        hostVars = {
+            'nec_model': phoneInfo['model'],
+            'nec_model_family': modelFamily(phoneInfo['model']),
+            'nec_firmware': phoneInfo['firmware'],
+            'nec_scheme': phoneInfo['scheme'],
+            'nec_port': phoneInfo['port'],
+            # Value for the modules' host option
+            'nec_host': hostName if phoneInfo['port'] == defaultPort else '{}:{}'.format(hostName, phoneInfo['port']),
+        }
+        for varName, value in hostVars.items():
+            self.inventory.set_variable(hostName, varName, value)
+        strict = self.get_option('strict')
+        self._set_composite_vars(self.get_option('compose'), hostVars, hostName, strict=strict)
+        self._add_host_to_composed_groups(self.get_option('groups'), hostVars, hostName, strict=strict)
+        self._add_host_to_keyed_groups(self.get_option('keyed_groups'), hostVars, hostName, strict=strict)
+
+    def parse(self, inventory, loader, path, cache=True):
+        super(InventoryModule, self).parse(inventory, loader, path)
+
+        self._read_config_data(path)
+        self.load_cache_plugin()
+        self.cache_key = self.get_cache_key(path)
+        user_cache_setting = self.get_option('cache')
+        attempt_to_read_cache = user_cache_setting and cache
+        cache_needs_update = user_cache_setting and not cache
+
+        self.topGroup = self.inventory.add_group(self.get_option('group'))
+
+        sweep = None
+        if attempt_to_read_cache:
+            try:
+                sweep = self._cache[self.cache_key]
+            except KeyError:
+                cache_needs_update = True
+
+        fromCache = sweep is not None
+        if not fromCache:
+            sweep = self._discover()
+            if cache_needs_update:
+                self._cache[self.cache_key] = sweep
+
+        for phoneInfo in sweep['phones']:
+            self._addPhone(phoneInfo)
+
+        self.display.v('{}: {} phones in {} addresses probed in {}s{}'.format(
+            self.NAME, len(sweep['phones']), sweep['probed'], sweep['seconds'], ' (from cache)' if fromCache else ''))
+        self.inventory.set_variable(self.topGroup, 'discovery_phone_count', len(sweep['phones']))
+        self.inventory.set_variable(self.topGroup, 'discovery_probed_count', sweep['probed'])
+        self.inventory.set_variable(self.topGroup, 'discovery_seconds', sweep['seconds'])
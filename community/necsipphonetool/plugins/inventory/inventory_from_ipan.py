@@ -8,84 +8,328 @@ DOCUMENTATION='''
     short_description: Inventory from IPAN CSV file
     description:
         - Create inventroy from IPAN CSV file for use with necsipphonetool or other modules
+        - The export is read one row at a time and hosts are added as they are read, so exports with hundreds of thousands of phones are parsed in bounded memory.
+        - Row counts and parse time are shown with -v and set as variables on the group from the group option.
+        - With cache enabled the phones are cached as a compact table, used as long as the export and the table options are unchanged. The export is taken as unchanged if its size and modification time match, and is only hashed when they differ or cache_verify_content is set. When the export changed, only rows whose text changed are parsed again.
+        - Uses a YAML configuration file that ends with C(ipan.yml) or C(ipan.yaml).
+    extends_documentation_fragment:
+        - inventory_cache
+        - constructed
     options:
-        cache:
-            description: Toggle to enable/disable the caching of the inventory's source data, requires a cache plugin setup to work.
+        plugin:
+            description: Name of the plugin
+            required: True
+            choices: ['community.necsipphonetool.inventory_from_ipan']
+        ipan_csv_file:
+            description: Path to CSV file
+            type: string
+            required: True
+            env:
+                - name: IPAN_CSV_FILE
+        cache_verify_content:
+            description:
+                - Hash the export even when its size and modification time match the cached table, to catch an export rewritten in place with its old modification time.
+                - Reading the whole export on every run costs as long as the hash takes on large exports.
             type: boolean
             required: False
             default: False
-            env:
-                - name: ANSIBLE_CACHE
-        cache_plugin:
-            description: Cache plugin to use for the inventory's source data.
+        csv_delimiter:
+            description: Field delimiter of the CSV file
             type: string
             required: False
-            default: memory
-            env:
-                - name: ANSIBLE_CACHE_PLUGIN
-        cache_timeout:
-            description: Cache duration in seconds
-            type: integer
+            default: ','
+        group:
+            description: Group every phone in the export is added to
+            type: string
             required: False
-            default: 3600
-            env:
-                - name: ANSIBLE_CACHE_TIMEOUT
-        cache_connection:
-            description: Cache connection data or path, read cache plugin documentation for specifics.
+            default: nec_phones
+        group_columns:
+            description:
+                - Columns whose values put phones in groups. A phone with C(DT800) in column C(Terminal Type) is added to group C(terminal_type_DT800).
+                - Faster than keyed_groups for large exports, as no templates are evaluated per row.
+            type: list
+            elements: string
+            required: False
+            default: []
+        host_column:
+            description: Column holding the address the phone is reached at
             type: string
             required: False
-            default: None
-            env:
-                - name: ANSIBLE_CACHE_CONNECTION
-        ipan_csv_file:
-            description: Path to CSV file
+            default: IP Address
+        hostvar_columns:
+            description:
+                - Columns kept as host variables, named C(ipan_) and the column name in lower case with non-alphanumerics as C(_).
+                - All columns if not given. Keep only the columns you need to save memory on large exports.
+            type: list
+            elements: string
+            required: False
+        name_column:
+            description:
+                - Column used as the inventory host name, with ansible_host set from host_column.
+                - host_column is used as the host name if not given.
             type: string
-            required: True
-            env:
-                - name: IPAN_CSV_FILE
+            required: False
+'''
+
+EXAMPLES = '''
+# phones.ipan.yml
+plugin: community.necsipphonetool.inventory_from_ipan
+ipan_csv_file: /srv/ipan/export.csv
+name_column: Extension
+group_columns:
+  - Terminal Type
+hostvar_columns:
+  - Terminal Type
+  - Firmware Version
 '''
 
 import csv
+import hashlib
+import json
 import os
 import re
-import sys
 import time
-import json
-import logging
 
-from ansible.errors import AnsibleError
+from ansible.errors import AnsibleParserError
+from ansible.module_utils.common.text.converters import to_native
 from ansible.plugins.inventory import BaseInventoryPlugin, Constructable, Cacheable
 
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-logger.addHandler(logging.StreamHandler(sys.stdout))
-logger.propagate = False
+# Layout of the cached table, bump when it changes
+cacheTableVersion = 1
 
 class InventoryModule(BaseInventoryPlugin, Constructable, Cacheable):
     NAME = 'community.necsipphonetool.inventory_from_ipan'
 
+    def verify_file(self, path):
+        valid = False
+        if super(InventoryModule, self).verify_file(path):
+            if path.endswith(('ipan.yml', 'ipan.yaml')):
+                valid = True
+            else:
+                self.display.vvv('Skipping due to inventory source not ending in "ipan.yml" nor "ipan.yaml"')
+        return valid
+
+    # Host variable name for a CSV column
+    def _columnVariable(self, column):
+        return 'ipan_' + re.sub(r'[^0-9a-z]+', '_', column.strip().lower()).strip('_')
+
+    # Identity of the export and of the options that shape the table: a
+    # cached table is used only if all of it matches. The export is hashed
+    # only if its size or mtime differ from cachedFingerprint, or with
+    # cache_verify_content.
+    def _sourceFingerprint(self, csvFile, cachedFingerprint=None):
+        try:
+            fileStat = os.stat(csvFile)
+            if (cachedFingerprint and not self.get_option('cache_verify_content')
+                    and cachedFingerprint.get('size') == fileStat.st_size and cachedFingerprint.get('mtime') == fileStat.st_mtime_ns):
+                contentDigest = cachedFingerprint.get('sha256')
+            else:
+                contentHash = hashlib.sha256()
+                with open(csvFile, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        contentHash.update(chunk)
+                contentDigest = contentHash.hexdigest()
+        except (IOError, OSError) as e:
+            raise AnsibleParserError('Unable to read {}: {}'.format(csvFile, to_native(e)))
+        tableOptions = [self.get_option(option) for option in ('host_column', 'name_column', 'group_columns', 'hostvar_columns', 'csv_delimiter')]
+        return {
+            'size': fileStat.st_size,
+            'mtime': fileStat.st_mtime_ns,
+            'sha256': contentDigest,
+            'options': hashlib.sha256(json.dumps(tableOptions).encode('utf-8')).hexdigest(),
+            'version': cacheTableVersion,
+        }
+
+    # Add one phone and its groups. values line up with self.varNames,
+    # groupIndexes index self.groupNames.
+    def _addPhone(self, hostName, address, values, groupIndexes):
+        self.inventory.add_host(hostName, group=self.topGroup)
+        if address != hostName:
+            self.inventory.set_variable(hostName, 'ansible_host', address)
+        hostVars = dict(zip(self.varNames, values))
+        for varName, value in hostVars.items():
+            self.inventory.set_variable(hostName, varName, value)
+        for groupIndex in groupIndexes:
+            groupName = self.groupNames[groupIndex]
+            if groupName not in self.inventory.groups:
+                self.inventory.add_group(groupName)
+            self.inventory.add_child(groupName, hostName)
+        if self.constructed:
+            strict = self.get_option('strict')
+            self._set_composite_vars(self.get_option('compose'), hostVars, hostName, strict=strict)
+            self._add_host_to_composed_groups(self.get_option('groups'), hostVars, hostName, strict=strict)
+            self._add_host_to_keyed_groups(self.get_option('keyed_groups'), hostVars, hostName, strict=strict)
+
+    # Index of a group from group_columns, adding it on first use
+    def _groupIndex(self, groupName):
+        groupIndex = self.groupIndexes.get(groupName)
+        if groupIndex is None:
+            groupIndex = self.groupIndexes[groupName] = len(self.groupNames)
+            self.groupNames.append(groupName)
+        return groupIndex
+
+    # Rows of the export as (raw text digest, parsed row). Rows whose digest
+    # is in knownDigests are not parsed and come back as None; a row with an
+    # open quote spanning lines is always parsed.
+    def _csvRows(self, f, delimiter, knownDigests):
+        pendingLines = []
+        for line in f:
+            if pendingLines:
+                pendingLines.append(line)
+                if ''.join(pendingLines).count('"') % 2:
+                    continue
+                rawRow = ''.join(pendingLines)
+                pendingLines = []
+            elif line.count('"') % 2:
+                pendingLines.append(line)
+                continue
+            else:
+                rawRow = line
+            rowDigest = hashlib.blake2b(rawRow.encode('utf-8'), digest_size=8).hexdigest()
+            if rowDigest in knownDigests:
+                yield rowDigest, None
+            else:
+                yield rowDigest, next(csv.reader([rawRow], delimiter=delimiter), [])
+        if pendingLines:
+            rawRow = ''.join(pendingLines)
+            yield hashlib.blake2b(rawRow.encode('utf-8'), digest_size=8).hexdigest(), next(csv.reader([rawRow], delimiter=delimiter), [])
+
+    # Stream the export, adding phones row by row. With buildTable the rows
+    # are also collected into the compact table that is cached; rows whose
+    # text is unchanged since previousTable are taken from it without parsing.
+    def _populate(self, buildTable, previousTable=None):
+        csvFile = self.get_option('ipan_csv_file')
+        delimiter = self.get_option('csv_delimiter')
+        hostColumn = self.get_option('host_column')
+        nameColumn = self.get_option('name_column') or hostColumn
+        groupColumns = self.get_option('group_columns')
+        hostvarColumns = self.get_option('hostvar_columns')
+        counts = {'rows': 0, 'hosts': 0, 'skipped': 0, 'duplicates': 0, 'reused': 0}
+        table = None
+        seenHosts = set()
+        try:
+            # utf-8-sig drops the byte order mark spreadsheet exports often start with
+            with open(csvFile, 'r', newline='', encoding='utf-8-sig') as f:
+                columns = next(csv.reader([f.readline()], delimiter=delimiter), [])
+                missingColumns = [column for column in [hostColumn, nameColumn] + groupColumns + (hostvarColumns or []) if column not in columns]
+                if missingColumns:
+                    raise AnsibleParserError('Columns {} not in {}, the file has: {}'.format(
+                        ', '.join(sorted(set(missingColumns))), csvFile, ', '.join(columns)))
+                keptColumns = hostvarColumns if hostvarColumns is not None else columns
+                keptIndexes = [columns.index(column) for column in keptColumns]
+                self.varNames = [self._columnVariable(column) for column in keptColumns]
+                groupSources = [(columns.index(column), self._columnVariable(column)[len('ipan_'):]) for column in groupColumns]
+                hostIndex = columns.index(hostColumn)
+                nameIndex = columns.index(nameColumn)
+
+                previousRecords = {}
+                if previousTable and previousTable.get('columns') == columns:
+                    for groupName in previousTable['groups']:
+                        self._groupIndex(groupName)
+                    for rowDigest, record in zip(previousTable['digests'], previousTable['hosts']):
+                        previousRecords[rowDigest] = record
+                if buildTable:
+                    table = {'columns': columns, 'vars': self.varNames, 'groups': self.groupNames, 'hosts': [], 'digests': []}
+
+                for rowDigest, row in self._csvRows(f, delimiter, previousRecords):
+                    counts['rows'] += 1
+                    if row is None:
+                        record = previousRecords[rowDigest]
+                        counts['reused'] += 1
+                    else:
+                        row += [''] * (len(columns) - len(row))
+                        address = row[hostIndex].strip()
+                        hostName = row[nameIndex].strip()
+                        if not address or not hostName:
+                            counts['skipped'] += 1
+                            continue
+                        groupIndexes = [self._groupIndex(self._sanitize_group_name('{}_{}'.format(groupPrefix, row[columnIndex].strip())))
+                                        for columnIndex, groupPrefix in groupSources if row[columnIndex].strip()]
+                        record = [hostName, address, [row[columnIndex].strip() for columnIndex in keptIndexes], groupIndexes]
+                    if record[0] in seenHosts:
+                        counts['duplicates'] += 1
+                    else:
+                        seenHosts.add(record[0])
+                    self._addPhone(*record)
+                    if table is not None:
+                        table['hosts'].append(record)
+                        table['digests'].append(rowDigest)
+        except (IOError, OSError) as e:
+            raise AnsibleParserError('Unable to read {}: {}'.format(csvFile, to_native(e)))
+        except csv.Error as e:
+            raise AnsibleParserError('Unable to parse {} at row {}: {}'.format(csvFile, counts['rows'] + 1, to_native(e)))
+        counts['hosts'] = len(seenHosts)
+        if table is not None:
+            table['counts'] = counts
+        return counts, table
+
+    # Add every phone from a cached table
+    def _loadTable(self, table):
+        self.varNames = table['vars']
+        for groupName in table['groups']:
+            self._groupIndex(groupName)
+        for record in table['hosts']:
+            self._addPhone(*record)
+
+    # Report row counts and parse time, and keep them on the top group
+    def _reportCounts(self, counts, parseSeconds, source):
+        self.display.v('{}: {} rows, {} hosts, {} skipped, {} duplicates in {:.2f}s ({})'.format(
+            self.NAME, counts['rows'], counts['hosts'], counts['skipped'], counts['duplicates'], parseSeconds, source))
+        self.inventory.set_variable(self.topGroup, 'ipan_row_count', counts['rows'])
+        self.inventory.set_variable(self.topGroup, 'ipan_host_count', counts['hosts'])
+        self.inventory.set_variable(self.topGroup, 'ipan_skipped_rows', counts['skipped'])
+        self.inventory.set_variable(self.topGroup, 'ipan_duplicate_rows', counts['duplicates'])
+        self.inventory.set_variable(self.topGroup, 'ipan_parse_seconds', round(parseSeconds, 3))
+
     def parse(self, inventory, loader, path, cache=True):
         super(InventoryModule, self).parse(inventory, loader, path)
 
-        def _populate():
-            # Read csv file
-            with open(self.ipan_csv_file, 'r') as f:
-                rawCsv = csv.reader(f)
-    
         self._read_config_data(path)
         self.load_cache_plugin()
         self.cache_key = self.get_cache_key(path)
         user_cache_setting = self.get_option('cache')
         attempt_to_read_cache = user_cache_setting and cache
-        cache_needs_update = user_cache_setting and not cache
-        
-        if attempt_to_read_cache:
-            try:
-                cache = self._cache[self.cache_key]
-            except KeyError:
-                cache_needs_update = True
-
-        if not attempt_to_read_cache or cache_needs_update:
-            self.inventory = self._populate()
-            if cache_needs_update:
-                self._cache[self.cache_key] = self.inventory
+
+        self.topGroup = self.inventory.add_group(self.get_option('group'))
+        self.constructed = bool(self.get_option('compose') or self.get_option('groups') or self.get_option('keyed_groups'))
+        self.varNames = []
+        self.groupNames = []
+        self.groupIndexes = {}
+
+        startTime = time.time()
+        if not user_cache_setting:
+            counts, table = self._populate(False)
+            self._reportCounts(counts, time.time() - startTime, 'parsed')
+            return
+
+        # The cache slot is per config file; the table in it is valid for the
+        # export and options in its fingerprint. An outdated table of the same
+        # layout still saves parsing the rows that did not change.
+        try:
+            cachedTable = self._cache[self.cache_key]
+        except KeyError:
+            cachedTable = None
+        if not isinstance(cachedTable, dict) or cachedTable.get('fingerprint', {}).get('version') != cacheTableVersion:
+            cachedTable = None
+        fingerprint = self._sourceFingerprint(self.get_option('ipan_csv_file'), cachedTable['fingerprint'] if attempt_to_read_cache and cachedTable else None)
+
+        # A touched but unchanged export only needs its new mtime recorded,
+        # so the next run can skip the hash. The table is replaced rather
+        # than changed in place, or the cache would not see it as changed.
+        unchangedKeys = ('size', 'sha256', 'options')
+        if attempt_to_read_cache and cachedTable and all(cachedTable['fingerprint'][key] == fingerprint[key] for key in unchangedKeys):
+            if cachedTable['fingerprint'] != fingerprint:
+                cachedTable = dict(cachedTable, fingerprint=fingerprint)
+                self._cache[self.cache_key] = cachedTable
+            self._loadTable(cachedTable)
+            self._reportCounts(cachedTable['counts'], time.time() - startTime, 'from cache')
+            return
+
+        previousTable = None
+        if attempt_to_read_cache and cachedTable and cachedTable['fingerprint']['options'] == fingerprint['options']:
+            previousTable = cachedTable
+        counts, table = self._populate(True, previousTable)
+        table['fingerprint'] = fingerprint
+        self._cache[self.cache_key] = table
+        self._reportCounts(counts, time.time() - startTime,
+                           '{} rows reused from cache'.format(counts['reused']) if previousTable else 'parsed')
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# End-to-end provisioning benchmarks against the local phone emulator.
+# The emulator runs in its own process. Module workloads call each module's
+# task function with the params Ansible would pass it, which needs ansible and
+# this collection importable as ansible_collections.community.necsipphonetool;
+# CLI workloads run nec_cli_tool.py as a subprocess. Results are written as JSON.
+
+import argparse
+import concurrent.futures
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import nec_phone_emulator
+
+# Directories holding an ansible_collections tree: the one this file is
+# installed under, then ANSIBLE_COLLECTIONS_PATH
+def collectionsPaths():
+    paths = []
+    collectionsDir = os.path.dirname(os.path.abspath(__file__))
+    for i in range(4):
+        collectionsDir = os.path.dirname(collectionsDir)
+    if os.path.basename(collectionsDir) == 'ansible_collections':
+        paths.append(os.path.dirname(collectionsDir))
+    for path in os.environ.get('ANSIBLE_COLLECTIONS_PATH', os.environ.get('ANSIBLE_COLLECTIONS_PATHS', '')).split(os.pathsep):
+        if path:
+            paths.append(os.path.expanduser(path))
+    return paths
+
+sys.path.extend(path for path in collectionsPaths() if path not in sys.path)
+try:
+    # The modules' own copy of nec_phone_tool, so the session cache and pool
+    # settings below apply to the modules under test
+    from ansible_collections.community.necsipphonetool.plugins.module_utils import nec_phone_tool
+    from ansible_collections.community.necsipphonetool.plugins.modules import set_factoryvalues, set_lan_port, set_pc_port, set_voip
+    moduleImportError = None
+except ImportError as e:
+    import nec_phone_tool
+    moduleImportError = e
+
+parser = argparse.ArgumentParser(prog='nec_bench_tool.py', description='Benchmark NEC phone provisioning against emulated phones')
+parser.add_argument('--phones', type=int, nargs='+', help='Fleet sizes to run', default=[1, 100, 5000])
+parser.add_argument('--latencies', type=float, nargs='+', help='Injected per-request latencies in seconds', default=[0.0, 0.01, 0.05])
+parser.add_argument('--cpuCost', type=float, help='Emulated phone CPU seconds per request', default=0.0)
+parser.add_argument('--workers', type=int, help='Phones worked on in parallel (Ansible forks or CLI --concurrency)', default=50)
+parser.add_argument('--workloads', type=str, nargs='+', help='Workloads to run, all if not given')
+parser.add_argument('--scheme', type=str, help='Protocol to reach the emulator with', choices=['http', 'https'], default='http')
+parser.add_argument('--rerun', action='store_true', help='Also time a second, converged pass of each module workload')
+parser.add_argument('--output', type=str, help='File to write JSON results to, stdout if not given')
+
+# Module option sets, as a playbook would pass them
+moduleWorkloads = {
+    'set_lan_port': {
+        'default_gateway': '192.168.1.1', 'dhcp_mode': False, 'dns_address': '192.168.1.1', 'ip_address': '192.168.1.10',
+        'lldp_mode': False, 'port_speed': '100full', 'spare_default_gateway': '192.168.2.1', 'spare_dns_address': '192.168.2.1',
+        'spare_ip_address': '192.168.2.10', 'spare_ip_address_mode': 'spare', 'spare_subnet_mask': '255.255.255.0',
+        'subnet_mask': '255.255.255.0', 'vlan_id': 222, 'vlan_mode': True, 'vlan_priority': 5,
+    },
+    'set_pc_port': {
+        'eapol_forwarding': False, 'port_available': True, 'port_security': False, 'port_speed': 'auto',
+        'vlan_id': 333, 'vlan_mode': True, 'vlan_priority': 0,
+    },
+    'set_voip': {
+        'sip_user_id': '2001', 'sip_password': 'secret', 'sip_extension': '2001', 'sip_backup_login': False,
+        'sip_server_one': '10.0.0.10', 'sip_server_two': '10.0.0.11', 'sip_server_one_port': '5060', 'sip_access_mode': 'normal',
+    },
+    'set_factoryvalues': {},
+}
+
+# nec_cli_tool.py action arguments
+cliWorkloads = {
+    'cli_testCreds': ['--testCreds'],
+    'cli_setLLDP': ['--setLLDP', 'enable'],
+    'cli_setSipServer': ['--setSipServer', '10.0.0.10', '10.0.0.11'],
+    'cli_hardReboot': ['--hardReboot'],
+    'cli_factoryValues': ['--factoryValues'],
+}
+
+# Address used to ask the emulator for its counters, outside the phone range
+statsAddress = '127.255.255.254'
+
+# Unused TCP port on this machine
+def freePort():
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+# Start the emulator in its own process so it does not share the GIL with the client
+def startEmulator(latency, cpuCost):
+    httpPort, httpsPort = freePort(), freePort()
+    emulatorScript = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nec_phone_emulator.py')
+    emulatorProcess = subprocess.Popen(
+        [sys.executable, emulatorScript, '--httpPort', str(httpPort), '--httpsPort', str(httpsPort),
+         '--latency', str(latency), '--cpuCost', str(cpuCost)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection((statsAddress, httpsPort), 0.5).close()
+            return emulatorProcess, httpPort, httpsPort
+        except (IOError, OSError):
+            time.sleep(0.1)
+    emulatorProcess.kill()
+    raise RuntimeError('Emulator did not start')
+
+# Emulator counters summed over all phones
+def emulatorTotals(httpPort):
+    statsResponse = nec_phone_tool.requests.get('http://{}:{}/emulator/stats'.format(statsAddress, httpPort))
+    return statsResponse.json()
+
+# Nearest-rank percentile of a sorted list
+def percentile(sortedValues, fraction):
+    if not sortedValues:
+        return None
+    return sortedValues[min(len(sortedValues) - 1, int(fraction * len(sortedValues)))]
+
+def latencySummary(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {}
+    return {
+        'mean': round(sum(latencies) / len(latencies), 4),
+        'p50': round(percentile(latencies, 0.50), 4),
+        'p95': round(percentile(latencies, 0.95), 4),
+        'max': round(latencies[-1], 4),
+    }
+
+# Module and task function behind each module workload
+def moduleTask(workload):
+    return {
+        'set_factoryvalues': (set_factoryvalues, set_factoryvalues.setFactoryValues),
+        'set_lan_port': (set_lan_port, set_lan_port.setLanPort),
+        'set_pc_port': (set_pc_port, set_pc_port.setPcPort),
+        'set_voip': (set_voip, set_voip.setVoip),
+    }[workload]
+
+# Params Ansible would pass the module for one phone: the argument spec's
+# defaults, the connection options and the workload's options
+def moduleParams(module, hostName, options):
+    params = dict((name, spec.get('default')) for name, spec in module.module_args.items())
+    scheme, address = hostName.split('://', 1)
+    params.update(host=address, force_http=scheme == 'http', verify_certs=False, username='ADMIN', password='6633222')
+    params.update(options)
+    return params
+
+# One module run for one phone, True if it succeeded
+def runModuleWorkload(workload, hostName):
+    module, runTask = moduleTask(workload)
+    try:
+        result = nec_phone_tool.runObservedTask(runTask, moduleParams(module, hostName, moduleWorkloads[workload]))
+        return not result['failed'] and 'msg' not in result
+    finally:
+        nec_phone_tool.closePhoneSession(hostName)
+
+# Time one workload pass over every phone on a worker pool
+def timeModulePass(workload, hostNames, workers):
+    def timedRun(hostName):
+        startTime = time.perf_counter()
+        succeeded = runModuleWorkload(workload, hostName)
+        return succeeded, time.perf_counter() - startTime
+    startTime = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        runs = list(executor.map(timedRun, hostNames))
+    wallSeconds = time.perf_counter() - startTime
+    return wallSeconds, [elapsed for succeeded, elapsed in runs], sum(1 for succeeded, elapsed in runs if not succeeded)
+
+# Time nec_cli_tool.py over every phone, per-phone latency from its report lines
+def timeCliPass(workload, hostNames, workers):
+    cliTool = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nec_cli_tool.py')
+    command = [sys.executable, cliTool, '--noProxy', '--noProgress', '--concurrency', str(max(workers, 2)), '--hostName']
+    command += [hostName.split('://', 1)[1] for hostName in hostNames]
+    command += cliWorkloads[workload]
+    if hostNames[0].startswith('http://'):
+        command.append('--insecureAlways')
+    startTime = time.perf_counter()
+    cliRun = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    wallSeconds = time.perf_counter() - startTime
+    latencies = []
+    failures = 0
+    for line in cliRun.stdout.splitlines():
+        # Host lines look like "127.0.0.1:8080 ok (0.12s)"
+        parts = line.split()
+        if len(parts) == 3 and parts[1] in ('ok', 'FAILED') and parts[2].startswith('('):
+            latencies.append(float(parts[2].strip('(s)')))
+            if parts[1] == 'FAILED':
+                failures += 1
+    failures += len(hostNames) - len(latencies)
+    return wallSeconds, latencies, failures
+
+# Run one workload on a fresh emulator and collect its numbers
+def runScenario(workload, phoneCount, latency, options):
+    passes = ['first']
+    if options.rerun and workload in moduleWorkloads:
+        passes.append('rerun')
+    results = []
+    emulatorProcess, httpPort, httpsPort = startEmulator(latency, options.cpuCost)
+    try:
+        hostNames = nec_phone_emulator.emulatedHostNames(phoneCount, httpPort if options.scheme == 'http' else httpsPort, options.scheme)
+        for passName in passes:
+            countersBefore = emulatorTotals(httpPort)
+            if workload in moduleWorkloads:
+                kind = 'module'
+                wallSeconds, latencies, failures = timeModulePass(workload, hostNames, options.workers)
+            else:
+                kind = 'cli'
+                wallSeconds, latencies, failures = timeCliPass(workload, hostNames, options.workers)
+            countersAfter = emulatorTotals(httpPort)
+            counterDelta = dict((key, countersAfter.get(key, 0) - countersBefore.get(key, 0)) for key in countersAfter)
+            results.append({
+                'workload': workload,
+                'kind': kind,
+                'pass': passName,
+                'phones': phoneCount,
+                'latency': latency,
+                'cpuCost': options.cpuCost,
+                'workers': options.workers,
+                'scheme': options.scheme,
+                'wallSeconds': round(wallSeconds, 4),
+                'phonesPerMinute': round(phoneCount * 60 / wallSeconds, 1) if wallSeconds else None,
+                'perPhoneSeconds': latencySummary(latencies),
+                'roundTripsPerPhone': round(counterDelta['requests'] / float(phoneCount), 2),
+                'connectionsPerPhone': round(counterDelta['connections'] / float(phoneCount), 2),
+                'rebootsPerPhone': round(counterDelta['reboots'] / float(phoneCount), 2),
+                'failures': failures,
+            })
+    finally:
+        emulatorProcess.terminate()
+        emulatorProcess.wait()
+    return results
+
+def main():
+    options = parser.parse_args()
+    workloads = options.workloads or list(moduleWorkloads) + list(cliWorkloads)
+    unknownWorkloads = [workload for workload in workloads if workload not in moduleWorkloads and workload not in cliWorkloads]
+    if unknownWorkloads:
+        parser.error('Unknown workloads: {}'.format(', '.join(unknownWorkloads)))
+    if moduleImportError and any(workload in moduleWorkloads for workload in workloads):
+        parser.error('Module workloads need ansible and this collection on ANSIBLE_COLLECTIONS_PATH: {}'.format(moduleImportError))
+    # Keep the benchmark away from the user's session cache
+    nec_phone_tool.phoneVariables['system']['sessionCacheFile'] = os.path.join(tempfile.mkdtemp(prefix='nec_bench_'), 'sessions.json')
+    nec_phone_tool.configurePool(poolMaxSize=1)
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'started': time.strftime(nec_phone_tool.getDateTime('dateTime')),
+        },
+        'results': [],
+    }
+    for phoneCount in options.phones:
+        for latency in options.latencies:
+            for workload in workloads:
+                for result in runScenario(workload, phoneCount, latency, options):
+                    report['results'].append(result)
+                    sys.stderr.write('\t{workload} {pass} phones={phones} latency={latency}: {wallSeconds}s, '
+                                     '{phonesPerMinute} phones/min, {roundTripsPerPhone} round trips/phone\n'.format(**result))
+    reportJson = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(reportJson + '\n')
+    else:
+        print(reportJson)
+
+# run main if not imported
+if __name__ == '__main__':
+    main()
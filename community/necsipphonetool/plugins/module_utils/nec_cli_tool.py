@@ -2,33 +2,65 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import concurrent.futures
 from itertools import product
 import nec_phone_tool
+import nec_rolling_reboot
 import pprint
 import re
 import socket
 import sys
+import threading
 import time
 
 parser = argparse.ArgumentParser(prog='nec_cli_tool.py', description='NEC CLI Tool for')
 # DT750 has TCP 80(http), 81 (hosts2-ns), and 82 (xfer) open by default.
 # DT820 also has TCP 443 (https)
 parser.add_argument('--bruteForce',action='store_true', help='Information on brute forcing')
+parser.add_argument('--connectTimeout', type=float, help='Seconds to wait for a connection to a phone', default=10)
+parser.add_argument('--concurrency', type=int, help='Number of hosts to work on in parallel', default=1)
+parser.add_argument('--circuitThreshold', type=int, help='Failed requests in a row before a host is skipped', default=3)
 parser.add_argument('--logOnName', type=str, help='Logon name', default='ADMIN')
 parser.add_argument('--logOnPassword', type=str, help='Logon password', default='6633222')
+parser.add_argument('--hostDeadline', type=float, help='Seconds allowed for all work on one host, remaining steps are abandoned')
 parser.add_argument('--hostName', type=str, nargs='+', help='Host name', required=True)
 parser.add_argument('--insecureAlways', action='store_true', help='Use http:// instead of https://')
 parser.add_argument('--insecureSecondary', action='store_true', help='Use http:// if https:// fails')
+parser.add_argument('--profile', type=str, nargs='?', const='nec_cli_tool.prof', help='Profile the run with cProfile and save the stats to this file, nec_cli_tool.prof if not given')
+parser.add_argument('--protocolCache', type=str, help='File to remember between runs which hosts needed http://')
 parser.add_argument('--factoryValues', action='store_true', help='Set device to factory values')
 parser.add_argument('--forceReboot', action='store_true', help='Force soft reboot')
 parser.add_argument('--hardReboot', action='store_true', help='Force hard reboot')
+parser.add_argument('--metricsFile', type=str, help='Write request metrics to this file, Prometheus text if it ends in .prom, JSON otherwise')
+parser.add_argument('--maxRetries', type=int, help='Retries of a failed request, with exponential backoff', default=3)
+parser.add_argument('--noProxy', action='store_true', help='Connect to phones directly instead of through the default proxy')
+parser.add_argument('--noProgress', action='store_true', help='Do not show progress when running in parallel')
+parser.add_argument('--noRetry', action='store_true', help='Do not retry failed requests')
+parser.add_argument('--poolMaxSize', type=int, help='Keep-alive connections kept per phone', default=2)
+parser.add_argument('--readyTimeout', type=float, help='Seconds to wait for a rebooted phone to answer again', default=300)
+parser.add_argument('--readTimeout', type=float, help='Seconds to wait for a phone to answer', default=30)
 parser.add_argument('--setLLDP', type=str, help='Enable or disable LLDP', choices=['enable', 'disable'])
+parser.add_argument('--subnetPrefix', type=int, help='Subnet prefix length for --waveBy subnet', default=24)
 parser.add_argument('--setSipServer', type=str, nargs='+', help='Set SIP server(s)')
 parser.add_argument('--testCreds', action='store_true', help='Test credentials')
+parser.add_argument('--traceFile', type=str, help='Write a Chrome trace of the run, with a span per host and per request, to this file')
+parser.add_argument('--waveBy', type=str, help='Form reboot waves by size, or per subnet', choices=['size', 'subnet'], default='size')
+parser.add_argument('--waveSize', type=int, help='Defer reboots to the end of the run and reboot this many phones at a time, 0 for whole subnets')
 parser.add_argument('--v', action='store_true', help='Verbose output')
 parser.add_argument('--vv', action='store_true', help='Very Verbose output')
 args = parser.parse_args()
 
+# Item codes come from the shared registry in nec_phone_tool
+lanPortItems = nec_phone_tool.itemCodeRegistry['lan_port']
+voipItems = nec_phone_tool.itemCodeRegistry['voip']
+passParameterCodes = nec_phone_tool.passParameterCodes
+sipServerOptions = ['sip_server_one', 'sip_server_two', 'sip_server_three', 'sip_server_four']
+
+if args.noProxy:
+    phoneProxies = None
+else:
+    phoneProxies = nec_phone_tool.proxies
+
 if args.insecureAlways:
     httpSchema = 'http://'
 else:
@@ -44,171 +76,339 @@ else:
 #         print('\n\tHost name is not defined.\n')
 #         sys.exit(1)
 
-def logOn(hostName, logOnName, logOnPassword, loopCheck):
+# Output of the host being worked on, buffered per worker thread in parallel mode
+hostOutput = threading.local()
+
+# Print now, or buffer until the host is reported when running in parallel
+def report(message):
+    lines = getattr(hostOutput, 'lines', None)
+    if lines is None:
+        print(message)
+    else:
+        lines.append(str(message))
+
+# Reboots held back with --waveSize, released in waves after the run
+deferredReboots = {}
+deferredRebootsLock = threading.Lock()
+
+# Reboot a phone now, or queue the reboot when rebooting in waves
+def rebootPhone(hostName, sessionId, rebootKind='logoff'):
+    if args.waveSize is None:
+        if rebootKind == 'hard_reset':
+            return passSingleParameter(hostName, sessionId, 'hard_reset', passParameterCodes['hard_reset'])
+        return logOff(hostName, sessionId)
+    with deferredRebootsLock:
+        deferredReboots[hostName] = {'hostName': hostName, 'sessionId': sessionId, 'rebootKind': rebootKind}
+    report('\tReboot deferred')
+    return True
+
+# Report a classified request failure, with the detail when very verbose
+def reportFailure(action, error):
+    if args.vv:
+        report('\t{} failed: {}'.format(action, error))
+    else:
+        report('\t{} failed ({})'.format(action, error.kind))
+
+def logOn(hostName, logOnName, logOnPassword):
     try:
-        logOnResponse, sessionId = nec_phone_tool.logOnPhone(hostName, logOnName, logOnPassword, False, False)
-        if logOnResponse.status_code == 200 and sessionId:
+        logOnResponse, sessionId = nec_phone_tool.logOnPhone(hostName, logOnName, logOnPassword, False, False, phoneProxies)
+        nec_phone_tool.requireSession(hostName, logOnResponse, sessionId)
+        if logOnResponse.status_code == 200:
             if args.vv:
-                  print('\tLogon successful for session {} on host {}'.format(sessionId, hostName))
+                  report('\tLogon successful for session {} on host {}'.format(sessionId, hostName))
             elif args.v:
-                print('\tLogon successful')
+                report('\tLogon successful')
+            if nec_phone_tool.negotiatedHostName(hostName) != hostName:
+                report('\tDegrading protocol to http://')
             return True, sessionId
         else:
             if args.vv:
-                print('\tLogoff failed for session {} on host {}'.format(sessionId, hostName))
+                report('\tLogon failed for session {} on host {}'.format(sessionId, hostName))
             else:
-                print('\tLogoff failed')
-            return False, 'null'
-    except:
-        if args.insecureSecondary and loopCheck == 0:
-            # Replace https:// with http:// and try again
-            print('\tDegrading protocol to http://')
-            hostName = hostName.replace('https://', 'http://')
-            return logOn(hostName, logOnName, logOnPassword, 1)
-        else:
-            print('\tLogon failed')
+                report('\tLogon failed')
             return False, 'null'
+    except nec_phone_tool.PhoneRequestError as e:
+        reportFailure('Logon', e)
+        return False, 'null'
 
-def logOff(hostName, sessionId, loopCheck):
+def logOff(hostName, sessionId):
     try:
-        logOffResponse = nec_phone_tool.logOffPhone(hostName, sessionId, False, False)
+        logOffResponse = nec_phone_tool.logOffPhone(hostName, sessionId, False, False, phoneProxies)
         if logOffResponse.status_code == 200:
             if args.vv:
-                print('\tLogoff successful for session {} on host {}'.format(sessionId, hostName))
+                report('\tLogoff successful for session {} on host {}'.format(sessionId, hostName))
             elif args.v:
-                print('\tLogoff successful')
+                report('\tLogoff successful')
+            return True
         else:
             if args.vv:
-                print('\tLogoff failed for session {} on host {}'.format(sessionId, hostName))
-                print(logOffResponse.status_code)
-                print(logOffResponse.text)
+                report('\tLogoff failed for session {} on host {}'.format(sessionId, hostName))
+                report(logOffResponse.status_code)
+                report(logOffResponse.text)
             else:
-                print('\tLogoff failed')
-    except:
-        if args.insecureSecondary and loopCheck == 0:
-            # Replace https:// with http:// and try again
-            print('\tDegrading protocol to http://')
-            hostName = hostName.replace('https://', 'http://')
-            logOff(hostName, sessionId, 1)
-        else:
-            print('\tLogoff failed')
+                report('\tLogoff failed')
+            return False
+    except nec_phone_tool.PhoneRequestError as e:
+        reportFailure('Logoff', e)
+        return False
 
 
-def setSingleParameter(hostName, sessionId, paramItem, paramValue, loopCheck):
+def setSingleParameter(hostName, sessionId, paramItem, paramValue):
     if paramValue == 'enable':
         paramValue = '1'
     elif paramValue == 'disable':
         paramValue = '0'
     try:
-        setSingleParamItemResponse = nec_phone_tool.setSingleItem(hostName, sessionId, paramItem, paramValue, False, False)
+        setSingleParamItemResponse = nec_phone_tool.setSingleItem(hostName, sessionId, paramItem, paramValue, False, False, phoneProxies)
         if setSingleParamItemResponse.status_code == 200:
             if args.vv:
-                print('\tSet single param item successful for session {} on host {}'.format(sessionId, hostName))
-                print('\tParam: {} Value: {}'.format(paramItem, paramValue))
+                report('\tSet single param item successful for session {} on host {}'.format(sessionId, hostName))
+                report('\tParam: {} Value: {}'.format(paramItem, paramValue))
             elif args.v:
-                print('\tSet single param item successful')
+                report('\tSet single param item successful')
+            return True
         else:
             if args.vv:
-                print('\tSet single param item failed for session {} on host {}'.format(sessionId, hostName))
-                print('\tParam: {} Value: {}'.format(paramItem, paramValue))
-                print(setSingleParamItemResponse.status_code)
-                print(setSingleParamItemResponse.text)
+                report('\tSet single param item failed for session {} on host {}'.format(sessionId, hostName))
+                report('\tParam: {} Value: {}'.format(paramItem, paramValue))
+                report(setSingleParamItemResponse.status_code)
+                report(setSingleParamItemResponse.text)
             else:
-                print('\tSet single param item failed')
-    except:
-        if args.insecureSecondary and loopCheck == 0:
-            # Replace https:// with http:// and try again
-            print('\tDegrading protocol to http://')
-            hostName = hostName.replace('https://', 'http://')
-            setSingleParameter(hostName, sessionId, paramItem, paramValue, 1)
-        else:
-            print('\tSet single param item failed')
+                report('\tSet single param item failed')
+            return False
+    except nec_phone_tool.PhoneRequestError as e:
+        reportFailure('Set single param item', e)
+        return False
 
-def setTwoParameters(hostName, sessionId, paramItem, paramValue, pramTwoKey, paramTwoValue, loopCheck):
+def setTwoParameters(hostName, sessionId, paramItem, paramValue, pramTwoKey, paramTwoValue):
     if paramValue == 'enable':
         paramValue = '1'
     elif paramValue == 'disable':
         paramValue = '0'
     try:
-        setTwoParamItemResponse = nec_phone_tool.setTwoParameters(hostName, sessionId, paramItem, paramValue, pramTwoKey, paramTwoValue, False, False)
+        setTwoParamItemResponse = nec_phone_tool.setTwoParameters(hostName, sessionId, paramItem, paramValue, pramTwoKey, paramTwoValue, False, False, phoneProxies)
         if setTwoParamItemResponse.status_code == 200:
             if args.vv:
-                print('\tSet single param item successful for session {} on host {}'.format(sessionId, hostName))
-                print('\tParam: {} Value: {}'.format(paramItem, paramValue))
+                report('\tSet single param item successful for session {} on host {}'.format(sessionId, hostName))
+                report('\tParam: {} Value: {}'.format(paramItem, paramValue))
+            elif args.v:
+                report('\tSet single param item successful')
+            return True
+        else:
+            if args.vv:
+                report('\tSet single param item failed for session {} on host {}'.format(sessionId, hostName))
+                report('\tParam: {} Value: {}'.format(paramItem, paramValue))
+                report(setTwoParamItemResponse.status_code)
+                report(setTwoParamItemResponse.text)
+            else:
+                report('\tSet single param item failed')
+            return False
+    except nec_phone_tool.PhoneRequestError as e:
+        reportFailure('Set single param item', e)
+        return False
+
+def passSingleParameter(hostName, sessionId, paramKey, paramValue):
+    if paramValue == 'enable':
+        paramValue = '1'
+    elif paramValue == 'disable':
+        paramValue = '0'
+    try:
+        passSingleParamItemResponse = nec_phone_tool.passSingleParameter(hostName, sessionId, paramKey, paramValue, False, False, phoneProxies)
+        if passSingleParamItemResponse.status_code == 200:
+            if args.vv:
+                report('\tSet single param item successful for session {} on host {}'.format(sessionId, hostName))
+                report('\tParam: {} Value: {}'.format(paramKey, paramValue))
             elif args.v:
-                print('\tSet single param item successful')
+                report('\tSet single param item successful')
+            return True
         else:
             if args.vv:
-                print('\tSet single param item failed for session {} on host {}'.format(sessionId, hostName))
-                print('\tParam: {} Value: {}'.format(paramItem, paramValue))
-                print(setTwoParamItemResponse.status_code)
-                print(setTwoParamItemResponse.text)
+                report('\tSet single param item failed for session {} on host {}'.format(sessionId, hostName))
+                report('\tParam: {} Value: {}'.format(paramKey, paramValue))
+                report(passSingleParamItemResponse.status_code)
+                report(passSingleParamItemResponse.text)
             else:
-                print('\tSet single param item failed')
-    except:
-        if args.insecureSecondary and loopCheck == 0:
-            # Replace https:// with http:// and try again
-            print('\tDegrading protocol to http://')
-            hostName = hostName.replace('https://', 'http://')
-            setTwoParameters(hostName, sessionId, paramItem, paramValue, pramTwoKey, paramTwoValue, 1)
+                report('\tSet single param item failed')
+            return False
+    except nec_phone_tool.PhoneRequestError as e:
+        reportFailure('Set single param item', e)
+        return False
+
+# Run the selected action against one host, True if every step succeeded
+def processHost(host):
+    hostName = httpSchema + host
+    succeeded = False
+    nec_phone_tool.setHostDeadline(hostName, args.hostDeadline)
+    if args.factoryValues:
+        if args.v or args.vv:
+            report('\tFactory Value Settings')
+        logonGood, sessionId = logOn(hostName, args.logOnName, args.logOnPassword)                
+        if logonGood:
+            succeeded = passSingleParameter(hostName, sessionId, 'data_clear', passParameterCodes['data_clear'])
+            succeeded = rebootPhone(hostName, sessionId, 'hard_reset') and succeeded
+    elif args.forceReboot:
+        if args.v or args.vv:
+            report('\tForce reboot')
+        succeeded = rebootPhone(hostName, 'null')
+    elif args.hardReboot:
+        if args.v or args.vv:
+            report('\tHard reboot')
+        logonGood, sessionId = logOn(hostName, args.logOnName, args.logOnPassword)                
+        if logonGood:
+            succeeded = rebootPhone(hostName, sessionId, 'hard_reset')
+    elif args.testCreds:
+        if args.v or args.vv:
+            report('\tTest credentials') 
+        logonGood, sessionId = logOn(hostName, args.logOnName, args.logOnPassword)
+        if logonGood:
+            succeeded = logOff(hostName, sessionId)
+    elif args.setLLDP:
+        if args.v or args.vv:
+            report('\tSet LLDP') 
+        logonGood, sessionId = logOn(hostName, args.logOnName, args.logOnPassword)
+        if logonGood:
+            succeeded = setSingleParameter(hostName, sessionId, lanPortItems['lldp_mode'].itemCode, args.setLLDP)
+            succeeded = rebootPhone(hostName, sessionId) and succeeded
+    elif args.setSipServer:
+        if args.v or args.vv:
+            report('\tSet SIP Server')
+        logonGood, sessionId = logOn(hostName, args.logOnName, args.logOnPassword)
+        if logonGood:
+            succeeded = True
+            for sipServerOption, sipServer in zip(sipServerOptions, args.setSipServer):
+                sipServerItem = voipItems[sipServerOption]
+                if nec_phone_tool.deadlineExceeded(hostName):
+                    report('\tAbandoned {} at host deadline'.format(sipServerItem.label))
+                    succeeded = False
+                    continue
+                succeeded = setTwoParameters(hostName, sessionId, sipServerItem.itemCode, sipServer, sipServerItem.paramTwoKey, sipServerItem.paramTwoValue) and succeeded
+            succeeded = rebootPhone(hostName, sessionId) and succeeded
+    else:
+        report('\n\tNo actions selected\n')
+    nec_phone_tool.clearHostDeadline(hostName)
+    # Release keep-alive connections, including any degraded to http://
+    nec_phone_tool.closePhoneSession(hostName)
+    nec_phone_tool.closePhoneSession(hostName.replace('https://', 'http://'))
+    return succeeded
+
+# Worker pool entry point: buffer the host's output and time it
+def processHostBuffered(host):
+    hostOutput.lines = []
+    startTime = time.time()
+    try:
+        # Before Python 3.12 the main thread's profiler does not see worker
+        # threads; from 3.12 it does and a second profiler cannot be started
+        if args.profile and sys.version_info < (3, 12):
+            succeeded = nec_phone_tool.profiledCall(tracedProcessHost, host)
         else:
-            print('\tSet single param item failed')
+            succeeded = tracedProcessHost(host)
+    except Exception as e:
+        report('\tUnexpected error: {}'.format(e))
+        succeeded = False
+    finally:
+        lines = hostOutput.lines
+        hostOutput.lines = None
+    return succeeded, lines, time.time() - startTime
+
+# Print a host's buffered output
+def reportHost(host, succeeded, lines, elapsed):
+    print('{} {} ({:.2f}s)'.format(host, 'ok' if succeeded else 'FAILED', elapsed))
+    for line in lines:
+        print(line)
+
+# processHost inside a trace span for the host
+def tracedProcessHost(host):
+    with nec_phone_tool.traceSpan('host', host):
+        return processHost(host)
+
+# Run hosts on a worker pool, reporting results in the order hosts were given
+def runParallel(hosts):
+    startTime = time.time()
+    results = {}
+    nextToReport = 0
+    failedCount = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = {executor.submit(processHostBuffered, host): index for index, host in enumerate(hosts)}
+        for doneCount, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            while nextToReport in results:
+                succeeded, lines, elapsed = results.pop(nextToReport)
+                if not succeeded:
+                    failedCount += 1
+                reportHost(hosts[nextToReport], succeeded, lines, elapsed)
+                nextToReport += 1
+            if not args.noProgress:
+                elapsedTotal = time.time() - startTime
+                sys.stderr.write('\r\t[{}/{}] {:.1f} hosts/s, {} elapsed '.format(
+                    doneCount, len(hosts), doneCount / elapsedTotal if elapsedTotal else 0.0, nec_phone_tool.msToMinSec(elapsedTotal * 1000)))
+                sys.stderr.flush()
+    elapsedTotal = time.time() - startTime
+    if not args.noProgress:
+        sys.stderr.write('\n')
+    print('\n\t{} hosts, {} failed in {:.2f}s ({:.1f} hosts/min)'.format(
+        len(hosts), failedCount, elapsedTotal, len(hosts) * 60 / elapsedTotal if elapsedTotal else 0.0))
+    openCircuits = nec_phone_tool.openCircuits()
+    if openCircuits:
+        print('\t{} hosts marked down after repeated failures: {}'.format(len(openCircuits), ', '.join(openCircuits)))
+
+# Release deferred reboots wave by wave, waiting for each wave to come back
+def releaseDeferredReboots():
+    print('\n\tRebooting {} phones in waves'.format(len(deferredReboots)))
+    def reportWave(waveResult):
+        groupText = ' ({})'.format(waveResult['group']) if waveResult['group'] else ''
+        slowestText = ', slowest {}s'.format(waveResult['slowest_ready_seconds']) if waveResult['slowest_ready_seconds'] is not None else ''
+        print('\tWave {}{}: {} of {} phones ready in {}s{}'.format(
+            waveResult['wave'], groupText, len(waveResult['ready']), len(waveResult['hosts']), waveResult['seconds'], slowestText))
+        for host in waveResult['not_ready'] + waveResult['failed']:
+            print('\t\t{} not ready'.format(host))
+            if args.vv and host in waveResult['errors']:
+                print('\t\t{}'.format(waveResult['errors'][host]))
+    waveResults = nec_rolling_reboot.rollingReboot(
+        deferredReboots, args.waveSize, args.waveBy, args.subnetPrefix, args.readyTimeout,
+        verifyCerts=False, proxies=phoneProxies, report=reportWave)
+    if waveResults and waveResults[-1].get('halted'):
+        releasedHosts = set(host for waveResult in waveResults for host in waveResult['hosts'])
+        print('\tHalted, not rebooted: {}'.format(', '.join(sorted(set(deferredReboots) - releasedHosts))))
+
+# Work through the hosts, then release any deferred reboots
+def runHosts():
+    if args.concurrency > 1:
+        runParallel(args.hostName)
+    else:
+        for host in args.hostName:
+            tracedProcessHost(host)
+            time.sleep(0.5)
+    if deferredReboots:
+        with nec_phone_tool.traceSpan('rolling_reboot', category='reboot'):
+            releaseDeferredReboots()
 
 def main():
     if httpSchema == 'http://':
         print('\n\tWARNING: Using http://. This is not secure. Use https:// if possible.')
-    for host in args.hostName:
-        hostName = httpSchema + host
-        if args.factoryValues:
-            if args.v or args.vv:
-                print('\tFactory Value Settings')
-            logonGood, sessionId = logOn(hostName, args.logOnName, args.logOnPassword, 0)                
-            if logonGood:
-                passSingleParameter(hostName, sessionId, 'data_clear', '4110430', 0)
-                passSingleParameter(hostName, sessionId, 'hard_reset', '4040408', 0)
-        elif args.forceReboot:
-            if args.v or args.vv:
-                print('\tForce reboot')
-            logOff(hostName, 'null', 0)
-        elif args.hardReboot:
-            if args.v or args.vv:
-                print('\tHard reboot')
-            logonGood, sessionId = logOn(hostName, args.logOnName, args.logOnPassword, 0)                
-            if logonGood:
-                passSingleParameter(hostName, sessionId, 'hard_reset', '4040408', 0)
-        elif args.testCreds:
-            if args.v or args.vv:
-                print('\tTest credentials') 
-            logonGood, sessionId = logOn(hostName, args.logOnName, args.logOnPassword, 0)
-            if logonGood:
-                logOff(hostName, sessionId, 0)
-        elif args.setLLDP:
-            if args.v or args.vv:
-                print('\tSet LLDP') 
-            logonGood, sessionId = logOn(hostName, args.logOnName, args.logOnPassword, 0)
-            if logonGood:
-                setSingleParameter(hostName, sessionId, '44604f3', args.setLLDP, 0)
-                logOff(hostName, sessionId, 0)
-        elif args.setSipServer:
-            if args.v or args.vv:
-                print('\tSet SIP Server')
-            logonGood, sessionId = logOn(hostName, args.logOnName, args.logOnPassword, 0)
-            if logonGood:
-                for i in range(0, len(args.setSipServer)):
-                    if i == 0:
-                        setTwoParameters(hostName, sessionId, '40b041b', args.setSipServer[i], 'type', 'ip', 0)
-                    elif i == 1:
-                        setTwoParameters(hostName, sessionId, '40b041c', args.setSipServer[i], 'type', 'ip', 0)
-                    elif i == 2:
-                        setTwoParameters(hostName, sessionId, '40b041d', args.setSipServer[i], 'type', 'ip', 0)
-                    elif i == 3:
-                        setTwoParameters(hostName, sessionId, '40b041e', args.setSipServer[i], 'type', 'ip', 0)
-                logOff(hostName, sessionId, 0)                    
-        else:
-            print('\n\tNo actions selected\n')
-        time.sleep(0.5)
+    nec_phone_tool.configurePool(poolMaxSize=args.poolMaxSize)
+    nec_phone_tool.configureProtocolFallback(args.insecureSecondary, bool(args.protocolCache), args.protocolCache)
+    nec_phone_tool.configureTimeouts(args.connectTimeout, args.readTimeout)
+    nec_phone_tool.configureRetries(not args.noRetry, args.maxRetries, circuitFailureThreshold=args.circuitThreshold)
+    if args.metricsFile:
+        nec_phone_tool.configureMetrics(True)
+    if args.traceFile:
+        nec_phone_tool.configureTracing(True)
+    if args.profile:
+        nec_phone_tool.profiledCall(runHosts)
+    else:
+        runHosts()
+    if args.metricsFile:
+        nec_phone_tool.writeMetrics(args.metricsFile)
+    if args.traceFile:
+        nec_phone_tool.writeTrace(args.traceFile)
+        print('\tTrace written to {}'.format(args.traceFile))
+    if args.profile:
+        profileStats = nec_phone_tool.writeProfile(args.profile)
+        print('\tProfile written to {}'.format(args.profile))
+        if args.v or args.vv:
+            profileStats.sort_stats('cumulative').print_stats(20)
 
 
 # Do the thing!
 if __name__ == '__main__':
-    main()    
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Phone discovery: sweep voice VLAN subnets for NEC web UIs. Addresses are
+# probed from one event loop by a fixed number of workers pulling from the
+# address ranges, so a /16 is held as ranges rather than 65k tasks. A phone
+# is recognised by the page its index.cgi answers with, which also names
+# its terminal type.
+
+import asyncio
+import ipaddress
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_async import AsyncPhoneClient
+    from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import identifyPhonePage
+except ImportError:
+    from nec_phone_async import AsyncPhoneClient
+    from nec_phone_tool import identifyPhonePage
+
+# DT750 answers on TCP 80 (and 81/82 for other services), DT820 also on 443
+defaultPorts = [80, 443]
+defaultHttpsPorts = [443]
+
+# Addresses in the networks, without network and broadcast addresses and
+# without anything in excludes. Yielded lazily.
+def sweepAddresses(networks, excludes=()):
+    excludedNetworks = [ipaddress.ip_network(exclude, strict=False) for exclude in excludes]
+    seenNetworks = []
+    for network in networks:
+        network = ipaddress.ip_network(network, strict=False)
+        if any(network.subnet_of(seenNetwork) for seenNetwork in seenNetworks if seenNetwork.version == network.version):
+            continue
+        seenNetworks.append(network)
+        for address in network.hosts():
+            if not any(address in excludedNetwork for excludedNetwork in excludedNetworks):
+                yield str(address)
+
+# Raise the open file limit towards what concurrency probes need and return
+# the concurrency the limit allows, so sockets do not fail with EMFILE and
+# hide phones
+def usableConcurrency(concurrency, spareFiles=64):
+    if resource is None:
+        return concurrency
+    softLimit, hardLimit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wantedLimit = concurrency + spareFiles
+    if softLimit != resource.RLIM_INFINITY and softLimit < wantedLimit:
+        if hardLimit == resource.RLIM_INFINITY or hardLimit >= wantedLimit:
+            softLimit = wantedLimit
+        else:
+            softLimit = hardLimit
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (softLimit, hardLimit))
+        except (ValueError, OSError):
+            softLimit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if softLimit == resource.RLIM_INFINITY:
+        return concurrency
+    return max(1, min(concurrency, softLimit - spareFiles))
+
+# Probe one port of an address, returning the phone's details if its
+# index.cgi names a phone
+async def probePort(client, address, port, httpsPorts):
+    scheme = 'https' if port in httpsPorts else 'http'
+    hostName = '{}://{}:{}'.format(scheme, address, port)
+    try:
+        probeResponse = await client.get(hostName, '')
+    except (asyncio.TimeoutError, OSError, ValueError, asyncio.IncompleteReadError):
+        return None
+    finally:
+        client.releaseHost(hostName)
+    if probeResponse.status_code != 200:
+        return None
+    phoneInfo = identifyPhonePage(probeResponse.text)
+    if phoneInfo:
+        phoneInfo.update(address=address, port=port, scheme=scheme)
+    return phoneInfo
+
+# Probe all ports of one address at once, so a port that times out (a
+# filtered 80 in front of a DT820's 443) does not hide the others or add its
+# timeout to theirs. The first port in ports order that answers as a phone
+# wins. A sweep of mostly empty addresses takes about
+# addresses * ports / concurrency * connect timeout.
+async def probeAddress(client, address, ports, httpsPorts):
+    for phoneInfo in await asyncio.gather(*[probePort(client, address, port, httpsPorts) for port in ports]):
+        if phoneInfo:
+            return phoneInfo
+    return None
+
+# Sweep networks with at most concurrency probes in flight. Returns the
+# phones found, in address order, and the number of addresses probed.
+async def discoverPhonesAsync(networks, excludes=(), ports=None, httpsPorts=None, concurrency=1024, connectTimeout=0.5, readTimeout=3):
+    concurrency = usableConcurrency(concurrency)
+    ports = ports or defaultPorts
+    httpsPorts = defaultHttpsPorts if httpsPorts is None else httpsPorts
+    addresses = sweepAddresses(networks, excludes)
+    phones = []
+    probed = [0]
+    async with AsyncPhoneClient(maxConcurrency=concurrency, connectTimeout=connectTimeout, readTimeout=readTimeout) as client:
+        async def worker():
+            for address in addresses:
+                probed[0] += 1
+                phoneInfo = await probeAddress(client, address, ports, httpsPorts)
+                if phoneInfo:
+                    phones.append(phoneInfo)
+        await asyncio.gather(*[worker() for i in range(concurrency)])
+    phones.sort(key=lambda phoneInfo: ipaddress.ip_address(phoneInfo['address']))
+    return phones, probed[0]
+
+# Blocking entry point for discoverPhonesAsync, also returning the seconds taken
+def discoverPhones(networks, excludes=(), ports=None, httpsPorts=None, concurrency=1024, connectTimeout=0.5, readTimeout=3):
+    startTime = time.time()
+    phones, probed = asyncio.run(discoverPhonesAsync(networks, excludes, ports, httpsPorts, concurrency, connectTimeout, readTimeout))
+    return phones, probed, time.time() - startTime
+
+def main():
+    print('\n\tDo not run me.\n\tImport me.\n')
+
+# run main if not imported
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Asyncio counterpart of the nec_phone_tool calls. One event loop can drive
+# thousands of phones, bounded by a global and a per-host concurrency limit.
+# Connections are kept alive per phone and reused between calls.
+#
+# The phone calls go through phoneRequestAsync, which shares nec_phone_tool's
+# request layer: retries with backoff, the per-host circuit breaker, host
+# deadlines, https:// to http:// fallback with the protocol cache, and the
+# request metrics and trace. The async path does not use the proxies, the
+# session cache or the pending reboot store, and reads whole pages rather
+# than streaming them. AsyncPhoneClient.get on its own is a single attempt
+# with none of this, as a discovery sweep wants.
+
+import asyncio
+import ssl
+import time
+from urllib.parse import urlsplit
+
+try:
+    from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import (
+        PhoneRequestError,
+        checkCircuit,
+        failedAttempt,
+        logOffQuery,
+        logOnQuery,
+        negotiatedHostName,
+        observeRequest,
+        parseSessionId,
+        passSingleParameterQuery,
+        phoneVariables,
+        recordEvent,
+        recordSuccess,
+        recordTraceInstant,
+        rememberProtocol,
+        requestAttempts,
+        requestTimeout,
+        retryBackoff,
+        setSingleItemQuery,
+        setTwoParametersQuery,
+        splitHostName,
+    )
+except ImportError:
+    from nec_phone_tool import (
+        PhoneRequestError,
+        checkCircuit,
+        failedAttempt,
+        logOffQuery,
+        logOnQuery,
+        negotiatedHostName,
+        observeRequest,
+        parseSessionId,
+        passSingleParameterQuery,
+        phoneVariables,
+        recordEvent,
+        recordSuccess,
+        recordTraceInstant,
+        rememberProtocol,
+        requestAttempts,
+        requestTimeout,
+        retryBackoff,
+        setSingleItemQuery,
+        setTwoParametersQuery,
+        splitHostName,
+    )
+
+# Exceptions a failed request to a phone can raise: connection and TLS
+# errors, timeouts, a reply cut short or garbled, or a PhoneRequestError
+asyncRequestErrors = (PhoneRequestError, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError)
+
+
+class AsyncPhoneResponse(object):
+    # Minimal response object with the attributes the sync callers use
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+
+class AsyncPhoneClient(object):
+    # Keep-alive HTTP/1.1 client for index.cgi with bounded concurrency.
+    # Create it inside a running event loop and close it when done. The
+    # timeouts are the configured ones from nec_phone_tool unless given.
+    def __init__(self, maxConcurrency=512, maxPerHost=1, verifyCerts=False, connectTimeout=None, readTimeout=None):
+        self.maxPerHost = maxPerHost
+        self.connectTimeout = connectTimeout or phoneVariables['system']['connectTimeout']
+        self.readTimeout = readTimeout or phoneVariables['system']['readTimeout']
+        self.globalLimit = asyncio.Semaphore(maxConcurrency)
+        self.hostLimits = {}
+        self.idleConnections = {}
+        self.sslContext = ssl.create_default_context()
+        if not verifyCerts:
+            self.sslContext.check_hostname = False
+            self.sslContext.verify_mode = ssl.CERT_NONE
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *excInfo):
+        await self.close()
+
+    # Send a GET to index.cgi on hostName (scheme://host[:port]), once.
+    # timeout is (connect, read), the client's timeouts if not given.
+    async def get(self, hostName, query, timeout=None):
+        connectTimeout, readTimeout = timeout or (self.connectTimeout, self.readTimeout)
+        hostLimit = self.hostLimits.get(hostName)
+        if hostLimit is None:
+            hostLimit = self.hostLimits[hostName] = asyncio.Semaphore(self.maxPerHost)
+        async with self.globalLimit:
+            async with hostLimit:
+                return await self._request(hostName, '/index.cgi?' + query, connectTimeout, readTimeout)
+
+    async def _request(self, hostName, path, connectTimeout, readTimeout):
+        url = urlsplit(hostName)
+        idle = self.idleConnections.get(hostName)
+        if idle:
+            reader, writer = idle.pop()
+            try:
+                return await self._roundTrip(hostName, url, reader, writer, path, readTimeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # Phone dropped the idle connection, fall through to a fresh one
+                writer.close()
+            except BaseException:
+                # Timeout, cancellation or a garbled reply: the connection is
+                # in an unknown state and must not be left open
+                writer.close()
+                raise
+        reader, writer = await self._connect(url, connectTimeout)
+        try:
+            return await self._roundTrip(hostName, url, reader, writer, path, readTimeout)
+        except BaseException:
+            writer.close()
+            raise
+
+    async def _connect(self, url, connectTimeout):
+        if url.scheme == 'https':
+            port = url.port or 443
+            sslContext = self.sslContext
+        else:
+            port = url.port or 80
+            sslContext = None
+        return await asyncio.wait_for(
+            asyncio.open_connection(url.hostname, port, ssl=sslContext, server_hostname=url.hostname if sslContext else None),
+            connectTimeout
+        )
+
+    async def _roundTrip(self, hostName, url, reader, writer, path, readTimeout):
+        request = 'GET {} HTTP/1.1\r\nHost: {}\r\nConnection: keep-alive\r\nAccept: */*\r\n\r\n'.format(path, url.netloc)
+        writer.write(request.encode('ascii'))
+        await writer.drain()
+        response, keepAlive = await asyncio.wait_for(self._readResponse(reader), readTimeout)
+        if keepAlive:
+            self.idleConnections.setdefault(hostName, []).append((reader, writer))
+        else:
+            writer.close()
+        return response
+
+    async def _readResponse(self, reader):
+        statusLine = await reader.readline()
+        if not statusLine:
+            raise ConnectionResetError('Connection closed before response')
+        version, statusCode = statusLine.decode('latin-1').split(None, 2)[:2]
+        headers = {}
+        while True:
+            headerLine = await reader.readline()
+            if headerLine in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = headerLine.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        connectionHeader = headers.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            keepAlive = connectionHeader == 'keep-alive'
+        else:
+            keepAlive = connectionHeader != 'close'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                chunkSize = int((await reader.readline()).split(b';')[0], 16)
+                if chunkSize == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(chunkSize))
+                await reader.readline()
+            content = b''.join(chunks)
+        elif 'content-length' in headers:
+            content = await reader.readexactly(int(headers['content-length']))
+        else:
+            content = await reader.read()
+            keepAlive = False
+        return AsyncPhoneResponse(int(statusCode), headers, content), keepAlive
+
+    # Close idle connections to one phone and forget its limiter
+    def releaseHost(self, hostName):
+        for reader, writer in self.idleConnections.pop(hostName, []):
+            writer.close()
+        hostLimit = self.hostLimits.get(hostName)
+        if hostLimit is not None and not hostLimit.locked():
+            del self.hostLimits[hostName]
+
+    async def close(self):
+        for hostName in list(self.idleConnections):
+            self.releaseHost(hostName)
+
+
+# Classify an exception raised by AsyncPhoneClient as classifyRequestError does
+def classifyAsyncError(error):
+    if isinstance(error, PhoneRequestError):
+        return error.kind
+    if isinstance(error, ssl.SSLError):
+        return 'tls'
+    if isinstance(error, asyncio.TimeoutError):
+        return 'timeout'
+    if isinstance(error, ConnectionRefusedError):
+        return 'refused'
+    return 'connection'
+
+# sendPhoneRequest over the async client: with insecureSecondary a failed
+# https:// connection is tried once more over http:// and the working scheme
+# remembered. A timeout is not taken as a failed connection, as it cannot be
+# told apart from a slow read here.
+async def sendPhoneRequestAsync(client, hostName, query, timeout):
+    hostName = negotiatedHostName(hostName)
+    try:
+        response = await client.get(hostName, query, timeout)
+    except OSError as e:
+        if isinstance(e, asyncio.TimeoutError) or not (phoneVariables['system']['insecureSecondary'] and hostName.startswith('https://')):
+            raise
+        hostName = 'http://' + splitHostName(hostName)[1]
+        if phoneVariables['system']['metrics']:
+            recordEvent(splitHostName(hostName)[1], 'protocol_fallback')
+        if phoneVariables['system']['trace']:
+            recordTraceInstant('protocol_fallback', splitHostName(hostName)[1])
+        response = await client.get(hostName, query, timeout)
+    if phoneVariables['system']['insecureSecondary']:
+        rememberProtocol(hostName)
+    return response
+
+# retryPhoneRequest over the async client, waiting out the backoff without
+# blocking the loop
+async def retryPhoneRequestAsync(client, hostName, query, rebootRequest=False):
+    host = splitHostName(hostName)[1]
+    checkCircuit(host)
+    attempts = requestAttempts(rebootRequest)
+    for attempt in range(attempts):
+        if attempt:
+            await asyncio.sleep(retryBackoff(host, attempt))
+        timeout = requestTimeout(host, client.connectTimeout, client.readTimeout)
+        try:
+            response = await sendPhoneRequestAsync(client, hostName, query, timeout)
+            if response.status_code >= 500:
+                raise PhoneRequestError('http5xx', host, 'HTTP {}'.format(response.status_code), attempt + 1)
+            recordSuccess(host)
+            response.attempts = attempt + 1
+            return response
+        except asyncRequestErrors as e:
+            droppedResponse, attempts = failedAttempt(host, e, classifyAsyncError(e), attempt, attempts, rebootRequest)
+            if droppedResponse is not None:
+                return droppedResponse
+
+# phoneRequest over the async client: retried, and recorded in the request
+# metrics and the trace when they are on
+async def phoneRequestAsync(client, hostName, query, rebootRequest=False):
+    systemSettings = phoneVariables['system']
+    if not (systemSettings['metrics'] or systemSettings['trace']):
+        return await retryPhoneRequestAsync(client, hostName, query, rebootRequest)
+    host = splitHostName(hostName)[1]
+    startTime = time.time()
+    startCounter = time.perf_counter()
+    try:
+        response = await retryPhoneRequestAsync(client, hostName, query, rebootRequest)
+    except PhoneRequestError as e:
+        observeRequest(host, query, startTime, time.perf_counter() - startCounter, None, 0, e.attempts, e.kind)
+        raise
+    observeRequest(host, query, startTime, time.perf_counter() - startCounter, response.status_code, len(response.content), response.attempts)
+    return response
+
+# Logon to phone
+async def logOnPhoneAsync(client, hostName, logOnName, logOnPassword):
+    logOnResponse = await phoneRequestAsync(client, hostName, logOnQuery(logOnName, logOnPassword))
+    return logOnResponse, parseSessionId(logOnResponse.text)
+
+# Log off phone, which saves and reboots it
+async def logOffPhoneAsync(client, hostName, sessionId):
+    return await phoneRequestAsync(client, hostName, logOffQuery(sessionId), rebootRequest=True)
+
+# Pass single parameter to phone
+async def passSingleParameterAsync(client, hostName, sessionId, paramKey, paramValue):
+    return await phoneRequestAsync(client, hostName, passSingleParameterQuery(sessionId, paramKey, paramValue), rebootRequest=paramKey == 'hard_reset')
+
+# Set single paramater on phone
+async def setSingleItemAsync(client, hostName, sessionId, parameter, value):
+    return await phoneRequestAsync(client, hostName, setSingleItemQuery(sessionId, parameter, value))
+
+# Set item with a second parameter on phone
+async def setTwoParametersAsync(client, hostName, sessionId, parameter, value, paramTwoKey, paramTwoValue):
+    return await phoneRequestAsync(client, hostName, setTwoParametersQuery(sessionId, parameter, value, paramTwoKey, paramTwoValue))
+
+# Run hostTask(client, hostName) for every host, results in host order.
+# Exceptions are returned in place of results so one bad phone does not stop
+# the run. Calls made with the functions above are retried, circuit broken
+# and observed as the sync calls are. No host deadline is set: every host's
+# task starts at once and would spend its budget waiting for a slot, so a
+# hostTask that wants one calls setHostDeadline when it starts sending.
+async def runFleet(hostNames, hostTask, maxConcurrency=512, maxPerHost=1, verifyCerts=False, connectTimeout=None, readTimeout=None):
+    async with AsyncPhoneClient(maxConcurrency, maxPerHost, verifyCerts, connectTimeout, readTimeout) as client:
+        async def runHost(hostName):
+            try:
+                return await hostTask(client, hostName)
+            finally:
+                client.releaseHost(hostName)
+        return await asyncio.gather(*[runHost(hostName) for hostName in hostNames], return_exceptions=True)
+
+# Blocking entry point for runFleet
+def runFleetSync(hostNames, hostTask, **clientOptions):
+    return asyncio.run(runFleet(hostNames, hostTask, **clientOptions))
+
+def main():
+    print('\n\tDo not run me.\n\tImport me.\n')
+
+# run main if not imported
+if __name__ == '__main__':
+    main()
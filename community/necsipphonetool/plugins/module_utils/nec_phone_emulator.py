@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Emulator of the NEC-SIP phone web UI (index.cgi) for tests and benchmarks.
+# Every local address a listener is reached on is its own phone, so binding
+# to 0.0.0.0 and connecting to 127.0.x.y gives thousands of phones from one
+# process on Linux. Bound to a single address it emulates a single phone.
+
+import argparse
+import http.server
+import json
+import os
+import random
+import ssl
+import string
+import subprocess
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+logOnPage = '''<html><head><title>{model} Web Setting</title></head><body>
+<p>Terminal Type: {model}</p><p>Firmware Version: {firmware}</p><p>MAC Address: {mac}</p>
+<a href="index.cgi?session={sessionId}">Menu</a>
+<a href="index.cgi?session={sessionId}&set=all">Save</a>
+</body></html>'''
+
+logInFormPage = '''<html><head><title>{model} Web Setting</title></head><body>
+<form action="index.cgi" method="get">
+<input type="text" name="username" value=""><input type="password" name="password" value="">
+<input type="submit" value="OK"></form>
+</body></html>'''
+
+itemPage = '''<html><body><form action="index.cgi">
+<input type="text" name="{itemCode}" value="{value}">
+</form></body></html>'''
+
+okPage = '<html><body>OK</body></html>'
+
+
+class EmulatedPhone(object):
+    # State of one emulated phone
+    def __init__(self, address, model, firmware):
+        self.address = address
+        self.model = model
+        self.firmware = firmware
+        # NEC prefix and the last three bytes of the address, unique per phone
+        self.mac = '00:60:b9:' + ':'.join('{:02x}'.format(int(addressByte)) for addressByte in address.split('.')[-3:]) if address.count('.') == 3 else '00:60:b9:00:00:01'
+        self.items = {}
+        self.sessionId = None
+        self.rebootUntil = 0.0
+        self.counters = {'requests': 0, 'connections': 0, 'logons': 0, 'writes': 0, 'reads': 0, 'reboots': 0}
+        self.lock = threading.Lock()
+
+    def rebooting(self):
+        return time.time() < self.rebootUntil
+
+    def reboot(self, rebootDelay):
+        self.sessionId = None
+        self.rebootUntil = time.time() + rebootDelay
+        self.counters['reboots'] += 1
+
+
+class PhoneEmulator(object):
+    # Emulated phones behind one HTTP and/or HTTPS listener.
+    # latency and cpuCost are seconds per request, rebootDelay seconds offline after a reboot.
+    def __init__(self, bindAddress='0.0.0.0', httpPort=0, httpsPort=None, certFile=None, keyFile=None,
+                 logOnName='ADMIN', logOnPassword='6633222', latency=0.0, cpuCost=0.0, rebootDelay=0.0,
+                 model='DT800', firmware='5.2.3.0'):
+        self.bindAddress = bindAddress
+        self.httpPort = httpPort
+        self.httpsPort = httpsPort
+        self.certFile = certFile
+        self.keyFile = keyFile
+        self.logOnName = logOnName
+        self.logOnPassword = logOnPassword
+        self.latency = latency
+        self.cpuCost = cpuCost
+        self.rebootDelay = rebootDelay
+        self.model = model
+        self.firmware = firmware
+        self.phones = {}
+        self.phonesLock = threading.Lock()
+        self.servers = []
+        self.threads = []
+
+    # Phone for a local address, created on first contact
+    def phone(self, address):
+        phone = self.phones.get(address)
+        if phone is None:
+            with self.phonesLock:
+                phone = self.phones.get(address)
+                if phone is None:
+                    phone = self.phones[address] = EmulatedPhone(address, self.model, self.firmware)
+        return phone
+
+    # Base URLs for count phones, for scheme 'http' or 'https'
+    def hostNames(self, count, scheme='http'):
+        port = self.httpPort if scheme == 'http' else self.httpsPort
+        if self.bindAddress not in ('', '0.0.0.0'):
+            return ['{}://{}:{}'.format(scheme, self.bindAddress, port)] * count
+        return emulatedHostNames(count, port, scheme)
+
+    # Sum of all phones' counters
+    def totals(self):
+        totals = {}
+        totals['phones'] = 0
+        for phone in list(self.phones.values()):
+            for key, value in phone.counters.items():
+                totals[key] = totals.get(key, 0) + value
+            if phone.counters['requests']:
+                totals['phones'] += 1
+        return totals
+
+    def start(self):
+        handler = self.makeHandler()
+        if self.httpPort is not None:
+            server = self.makeServer(self.httpPort, handler)
+            self.httpPort = server.server_address[1]
+        if self.httpsPort is not None:
+            if not self.certFile:
+                self.certFile, self.keyFile = generateCertificate()
+            server = self.makeServer(self.httpsPort, handler)
+            sslContext = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            sslContext.load_cert_chain(self.certFile, self.keyFile)
+            # Handshake in the handler thread, not in the accept loop
+            server.socket = sslContext.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+            self.httpsPort = server.server_address[1]
+        for server in self.servers:
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *excInfo):
+        self.stop()
+
+    def makeServer(self, port, handler):
+        server = http.server.ThreadingHTTPServer((self.bindAddress, port), handler, bind_and_activate=False)
+        server.daemon_threads = True
+        server.request_queue_size = 4096
+        server.allow_reuse_address = True
+        server.server_bind()
+        server.server_activate()
+        self.servers.append(server)
+        return server
+
+    def makeHandler(self):
+        emulator = self
+
+        class PhoneRequestHandler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            server_version = 'NEC-Phone-Emulator'
+            # Headers and body go out as separate writes; without this the
+            # client's delayed ACK adds ~40 ms to every request
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                http.server.BaseHTTPRequestHandler.setup(self)
+                self.phone = emulator.phone(self.connection.getsockname()[0])
+                with self.phone.lock:
+                    self.phone.counters['connections'] += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                phone = self.phone
+                url = urlsplit(self.path)
+                if url.path == '/emulator/stats':
+                    # Counters for benchmarks running the emulator out of process
+                    return self.reply(200, json.dumps(emulator.totals()), 'application/json')
+                if phone.rebooting():
+                    # Phone is down: drop the connection without answering
+                    self.close_connection = True
+                    return
+                if emulator.latency:
+                    time.sleep(emulator.latency)
+                if emulator.cpuCost:
+                    spinUntil = time.perf_counter() + emulator.cpuCost
+                    while time.perf_counter() < spinUntil:
+                        pass
+                if url.path not in ('/index.cgi', '/'):
+                    return self.reply(404, '<html><body>Not Found</body></html>')
+                query = dict((key, values[-1]) for key, values in parse_qs(url.query, keep_blank_values=True).items())
+                with phone.lock:
+                    statusCode, page = emulator.handleQuery(phone, query)
+                self.reply(statusCode, page)
+
+            def reply(self, statusCode, page, contentType='text/html'):
+                body = page.encode('utf-8')
+                self.send_response(statusCode)
+                self.send_header('Content-Type', contentType)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client gave up waiting, as a timed out request does
+                    self.close_connection = True
+
+        return PhoneRequestHandler
+
+    # Apply one index.cgi query to a phone, returning status code and page
+    def handleQuery(self, phone, query):
+        phone.counters['requests'] += 1
+        if 'username' in query:
+            if query.get('username') != self.logOnName or query.get('password') != self.logOnPassword:
+                return 200, logInFormPage.format(model=phone.model)
+            phone.counters['logons'] += 1
+            phone.sessionId = ''.join(random.choice(string.ascii_uppercase + string.digits) for i in range(4))
+            return 200, logOnPage.format(model=phone.model, firmware=phone.firmware, mac=phone.mac, sessionId=phone.sessionId)
+        sessionId = query.get('session')
+        if query.get('set') == 'all':
+            # Logoff saves and reboots, with or without a valid session
+            phone.reboot(self.rebootDelay)
+            return 200, okPage
+        if not sessionId or sessionId != phone.sessionId:
+            return 200, logInFormPage.format(model=phone.model)
+        if 'data_clear' in query:
+            phone.items = {}
+            return 200, okPage
+        if 'hard_reset' in query:
+            phone.reboot(self.rebootDelay)
+            return 200, okPage
+        # get=<item code> is this emulator's own read call, standing in for
+        # one the real web UI is assumed to have (see getSingleItemQuery)
+        if 'get' in query:
+            phone.counters['reads'] += 1
+            itemCode = query['get']
+            return 200, itemPage.format(itemCode=itemCode, value=phone.items.get(itemCode, ''))
+        if 'set' in query and 'item' in query:
+            phone.counters['writes'] += 1
+            phone.items[query['set']] = query['item']
+            return 200, okPage
+        return 200, logOnPage.format(model=phone.model, firmware=phone.firmware, mac=phone.mac, sessionId=phone.sessionId)
+
+
+# Base URLs for count phones on 127.x.y.z of a listener bound to 0.0.0.0
+def emulatedHostNames(count, port, scheme='http'):
+    return ['{}://127.{}.{}.{}:{}'.format(scheme, (i + 1) // 65536, ((i + 1) // 256) % 256, (i + 1) % 256, port) for i in range(count)]
+
+# Create a throwaway self-signed certificate with openssl, returns (certFile, keyFile)
+def generateCertificate():
+    certDir = tempfile.mkdtemp(prefix='nec_phone_emulator_')
+    certFile = os.path.join(certDir, 'cert.pem')
+    keyFile = os.path.join(certDir, 'key.pem')
+    subprocess.check_call(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '2',
+         '-subj', '/CN=nec-phone-emulator', '-keyout', keyFile, '-out', certFile],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return certFile, keyFile
+
+def main():
+    parser = argparse.ArgumentParser(prog='nec_phone_emulator.py', description='Emulate NEC-SIP phone web UIs')
+    parser.add_argument('--bindAddress', type=str, help='Address to listen on, 0.0.0.0 for one phone per 127.0.x.y', default='0.0.0.0')
+    parser.add_argument('--httpPort', type=int, help='HTTP port, 0 picks a free port', default=8080)
+    parser.add_argument('--httpsPort', type=int, help='HTTPS port, off if not given')
+    parser.add_argument('--certFile', type=str, help='TLS certificate, self-signed if not given')
+    parser.add_argument('--keyFile', type=str, help='TLS private key')
+    parser.add_argument('--logOnName', type=str, help='Logon name', default='ADMIN')
+    parser.add_argument('--logOnPassword', type=str, help='Logon password', default='6633222')
+    parser.add_argument('--latency', type=float, help='Seconds of delay per request', default=0.0)
+    parser.add_argument('--cpuCost', type=float, help='Seconds of CPU spent per request', default=0.0)
+    parser.add_argument('--rebootDelay', type=float, help='Seconds a phone is offline after a reboot', default=0.0)
+    parser.add_argument('--model', type=str, help='Terminal type to report', default='DT800')
+    parser.add_argument('--firmware', type=str, help='Firmware version to report', default='5.2.3.0')
+    args = parser.parse_args()
+    emulator = PhoneEmulator(args.bindAddress, args.httpPort, args.httpsPort, args.certFile, args.keyFile,
+                             args.logOnName, args.logOnPassword, args.latency, args.cpuCost, args.rebootDelay,
+                             args.model, args.firmware).start()
+    print('\n\tEmulating phones on {} http:{} https:{}'.format(args.bindAddress, emulator.httpPort, emulator.httpsPort))
+    print('\tConnect to 127.0.x.y on these ports for separate phones. Ctrl-C to stop.\n')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+        print('\t{}'.format(emulator.totals()))
+
+# run main if not imported
+if __name__ == '__main__':
+    main()
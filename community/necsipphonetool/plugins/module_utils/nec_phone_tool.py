@@ -1,6 +1,19 @@
+import bisect
+import concurrent.futures
+import contextlib
+import cProfile
+import fcntl
+import json
+import os
+import pstats
+import random
 import re
 import requests
 import sys
+import threading
+import time
+from collections import namedtuple
+from requests.adapters import HTTPAdapter
 
 # Ignore bad ssl certs in requests
 requests.packages.urllib3.disable_warnings()
@@ -50,21 +63,41 @@ phoneVariables =  {
 	'sipServerPort': {},
 	'spareIPSettings': {},
 	'system': {
+		'circuitFailureThreshold': 3,
+		'circuitResetTimeout': 60,
 		'certificateState': {
 			'rootCert' : [],
 			'clientCert' : []
 		},
+		'connectTimeout': 10,
 		'downloadProtocol': '',
+		'fingerprintCacheFile': '~/.ansible/necsipphonetool/fingerprints.json',
+		'fingerprintCacheTtl': 86400,
 		'downloadHttps': False,
 		'forceInsecure': False,
+		'hostDeadline': None,
+		'insecureSecondary': False,
 		'listArray': [],
 		'loop': True,
 		'loopTimer': 30000,
 		'maxRetries': 3,
+		'metrics': False,
+		'poolConnections': 1,
+		'poolMaxSize': 2,
+		'pendingRebootFile': '~/.ansible/necsipphonetool/reboots.json',
+		'persistProtocols': False,
 		'processCounter': 0,
+		'protocolCacheFile': '~/.ansible/necsipphonetool/protocols.json',
+		'protocolCacheTtl': 86400,
 		'protocolType': 'https',
+		'readTimeout': 30,
 		'retry': True,
-		'retryCounter': 0
+		'retryBackoff': 0.5,
+		'retryBackoffMax': 8,
+		'retryCounter': 0,
+		'sessionCacheFile': '~/.ansible/necsipphonetool/sessions.json',
+		'sessionCacheTtl': 300,
+		'trace': False
 	},
 	'upgradedDevices': [],
 	'voiceRecSettings': {},
@@ -94,77 +127,1538 @@ def msToMinSec(ms):
     seconds = int((ms % 60000) / 1000)
     return '{}:{}'.format(padDigits(str(minutes)), padDigits(str(seconds)))
 
-def passSingleParameter(hostName, sessionId, paramKey, paramValue, loopCheck):
-    if paramValue == 'enable':
-        paramValue = '1'
-    elif paramValue == 'disable':
-        paramValue = '0'
+# Pooled keep-alive sessions, one per phone base URL (scheme + host)
+phoneSessions = {}
+phoneSessionsLock = threading.Lock()
+
+# Set pool sizes used for sessions created from now on
+def configurePool(poolConnections=None, poolMaxSize=None):
+    if poolConnections:
+        phoneVariables['system']['poolConnections'] = int(poolConnections)
+    if poolMaxSize:
+        phoneVariables['system']['poolMaxSize'] = int(poolMaxSize)
+
+# Return the pooled session for a phone, creating it on first use
+def getPhoneSession(hostName):
+    phoneSession = phoneSessions.get(hostName)
+    if phoneSession is None:
+        with phoneSessionsLock:
+            phoneSession = phoneSessions.get(hostName)
+            if phoneSession is None:
+                phoneSession = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=phoneVariables['system']['poolConnections'],
+                    pool_maxsize=phoneVariables['system']['poolMaxSize'],
+                    max_retries=0
+                )
+                phoneSession.mount('http://', adapter)
+                phoneSession.mount('https://', adapter)
+                phoneSessions[hostName] = phoneSession
+    return phoneSession
+
+# Close and forget the pooled session for a phone
+def closePhoneSession(hostName):
+    with phoneSessionsLock:
+        phoneSession = phoneSessions.pop(hostName, None)
+    if phoneSession is not None:
+        phoneSession.close()
+
+# Close all pooled sessions
+def closePhoneSessions():
+    with phoneSessionsLock:
+        hostNames = list(phoneSessions)
+    for hostName in hostNames:
+        closePhoneSession(hostName)
+
+# Scheme that last worked per host, used when degrading https:// to http://
+protocolCache = {}
+protocolCacheLoaded = []
+
+# Turn https:// -> http:// fallback on or off, optionally remembered between runs
+def configureProtocolFallback(insecureSecondary, persistProtocols=False, protocolCacheFile=None):
+    phoneVariables['system']['insecureSecondary'] = insecureSecondary
+    phoneVariables['system']['persistProtocols'] = persistProtocols
+    if protocolCacheFile:
+        phoneVariables['system']['protocolCacheFile'] = protocolCacheFile
+    del protocolCacheLoaded[:]
+
+# Split a base URL into scheme and host, defaulting to https
+def splitHostName(hostName):
+    if '://' in hostName:
+        return hostName.split('://', 1)
+    return 'https', hostName
+
+# Scheme remembered for a host, None if unknown or expired
+def cachedProtocol(host):
+    if phoneVariables['system']['persistProtocols'] and not protocolCacheLoaded:
+        protocolCache.update(readJsonStore(phoneVariables['system']['protocolCacheFile']))
+        protocolCacheLoaded.append(True)
+    cachedEntry = protocolCache.get(host)
+    if cachedEntry and time.time() - cachedEntry['learned'] < phoneVariables['system']['protocolCacheTtl']:
+        return cachedEntry['scheme']
+    return None
+
+# Remember the scheme a request to the host succeeded with
+def rememberProtocol(hostName):
+    scheme, host = splitHostName(hostName)
+    if cachedProtocol(host) == scheme:
+        return
+    protocolEntry = {'scheme': scheme, 'learned': time.time()}
+    protocolCache[host] = protocolEntry
+    if phoneVariables['system']['persistProtocols']:
+        updateJsonStore(phoneVariables['system']['protocolCacheFile'], lambda store: store.__setitem__(host, protocolEntry))
+
+# Base URL to use for a host: the remembered scheme when fallback is on
+def negotiatedHostName(hostName):
+    if not phoneVariables['system']['insecureSecondary']:
+        return hostName
+    scheme, host = splitHostName(hostName)
+    cachedScheme = cachedProtocol(host)
+    if cachedScheme:
+        return cachedScheme + '://' + host
+    return hostName
+
+# Failed phone request, classified so callers can report and react to it.
+# kind is one of timeout, refused, tls, http5xx, nosession, bad_credentials,
+# connection, circuit_open or deadline. Subclasses RequestException so existing handlers still apply.
+class PhoneRequestError(requests.exceptions.RequestException):
+    def __init__(self, kind, hostName, message, attempts=1, response=None):
+        requests.exceptions.RequestException.__init__(self, '{} ({}): {}'.format(hostName, kind, message), response=response)
+        self.kind = kind
+        self.hostName = hostName
+        self.attempts = attempts
+
+# Error kinds worth another attempt; tls, nosession, bad_credentials, circuit_open and deadline are not
+retryableKinds = ('timeout', 'refused', 'connection', 'http5xx')
+
+# Classify a requests exception raised while talking to a phone
+def classifyRequestError(error):
+    if isinstance(error, PhoneRequestError):
+        return error.kind
+    if isinstance(error, requests.exceptions.SSLError):
+        return 'tls'
+    if isinstance(error, requests.exceptions.Timeout):
+        return 'timeout'
+    if isinstance(error, requests.exceptions.ConnectionError):
+        if 'refused' in str(error).lower():
+            return 'refused'
+        return 'connection'
+    return 'connection'
+
+# Set the retry policy and circuit breaker for requests from now on
+def configureRetries(retry=None, maxRetries=None, retryBackoff=None, circuitFailureThreshold=None, circuitResetTimeout=None):
+    settings = {
+        'retry': retry,
+        'maxRetries': maxRetries,
+        'retryBackoff': retryBackoff,
+        'circuitFailureThreshold': circuitFailureThreshold,
+        'circuitResetTimeout': circuitResetTimeout,
+    }
+    for key, value in settings.items():
+        if value is not None:
+            phoneVariables['system'][key] = value
+
+# Seconds to wait before retry number attempt (0 based): exponential backoff
+# capped at retryBackoffMax, with full jitter so a fleet does not retry in step
+def retryDelay(attempt):
+    backoffCap = min(phoneVariables['system']['retryBackoffMax'], phoneVariables['system']['retryBackoff'] * 2 ** attempt)
+    return random.uniform(0, backoffCap)
+
+# Per-host circuit breaker: after circuitFailureThreshold failed attempts in a
+# row the host is skipped for circuitResetTimeout seconds, then one request
+# is let through to probe it again
+circuitStates = {}
+circuitStatesLock = threading.Lock()
+
+# Raise circuit_open if the host is failing fast, otherwise let the request through
+def checkCircuit(host):
+    with circuitStatesLock:
+        circuitState = circuitStates.get(host)
+        if not circuitState or circuitState['openedAt'] is None:
+            return
+        if time.time() - circuitState['openedAt'] < phoneVariables['system']['circuitResetTimeout']:
+            raise PhoneRequestError('circuit_open', host, 'skipped after {} failed attempts'.format(circuitState['failures']), 0)
+        # Half open: allow this probe, a failure opens the circuit again
+        circuitState['openedAt'] = None
+        circuitState['failures'] = phoneVariables['system']['circuitFailureThreshold'] - 1
+
+def recordSuccess(host):
+    if host in circuitStates:
+        with circuitStatesLock:
+            circuitStates.pop(host, None)
+
+# Count a failed attempt, True if it opened the host's circuit
+def recordFailure(host):
+    with circuitStatesLock:
+        circuitState = circuitStates.setdefault(host, {'failures': 0, 'openedAt': None})
+        circuitState['failures'] += 1
+        if circuitState['failures'] >= phoneVariables['system']['circuitFailureThreshold']:
+            circuitState['openedAt'] = time.time()
+            return True
+        return False
+
+# Hosts whose circuit is currently open
+def openCircuits():
+    with circuitStatesLock:
+        return sorted(host for host, circuitState in circuitStates.items() if circuitState['openedAt'] is not None)
+
+# Set the connect and read timeouts, in seconds, for requests from now on
+def configureTimeouts(connectTimeout=None, readTimeout=None):
+    if connectTimeout:
+        phoneVariables['system']['connectTimeout'] = connectTimeout
+    if readTimeout:
+        phoneVariables['system']['readTimeout'] = readTimeout
+
+# Absolute time by which all work on a host must be done, per host
+hostDeadlines = {}
+
+# Give a host a budget of seconds for everything still to be sent to it,
+# hostDeadline from the system settings if not given, none if that is unset
+def setHostDeadline(hostName, seconds=None):
+    if seconds is None:
+        seconds = phoneVariables['system']['hostDeadline']
+    host = splitHostName(hostName)[1]
+    if seconds:
+        hostDeadlines[host] = time.time() + seconds
+    else:
+        hostDeadlines.pop(host, None)
+
+def clearHostDeadline(hostName):
+    hostDeadlines.pop(splitHostName(hostName)[1], None)
+
+# Seconds left in a host's budget, None if it has no deadline
+def deadlineRemaining(host):
+    deadline = hostDeadlines.get(host)
+    if deadline is None:
+        return None
+    return deadline - time.time()
+
+def deadlineExceeded(hostName):
+    remaining = deadlineRemaining(splitHostName(hostName)[1])
+    return remaining is not None and remaining <= 0
+
+# (connect, read) timeout for the next request to a host, the configured
+# ones unless given, cut to what is left of its deadline. Raises deadline
+# once the budget is spent.
+def requestTimeout(host, connectTimeout=None, readTimeout=None):
+    connectTimeout = connectTimeout or phoneVariables['system']['connectTimeout']
+    readTimeout = readTimeout or phoneVariables['system']['readTimeout']
+    remaining = deadlineRemaining(host)
+    if remaining is None:
+        return (connectTimeout, readTimeout)
+    if remaining <= 0:
+        raise PhoneRequestError('deadline', host, 'host deadline exceeded', 0)
+    return (min(connectTimeout, remaining), min(readTimeout, remaining))
+
+# Request metrics per (host, operation, item code): a latency histogram,
+# bytes, status codes, retries and error kinds. Off by default; while off
+# phoneRequest does a single settings lookup and records nothing.
+metricBuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+phoneMetrics = {}
+phoneEvents = {}
+phoneMetricsLock = threading.Lock()
+
+def configureMetrics(enabled):
+    phoneVariables['system']['metrics'] = enabled
+
+def resetMetrics():
+    with phoneMetricsLock:
+        phoneMetrics.clear()
+        phoneEvents.clear()
+
+# Operation and item code of an index.cgi query
+def requestOperation(query):
+    queryParams = dict(param.partition('=')[::2] for param in query.split('&') if param)
+    if 'username' in queryParams:
+        return 'logon', ''
+    if queryParams.get('set') == 'all':
+        return 'logoff', ''
+    if 'set' in queryParams:
+        return 'write', queryParams['set']
+    if 'get' in queryParams:
+        return 'read', queryParams['get']
+    for paramKey in passParameterCodes:
+        if paramKey in queryParams:
+            return 'command', paramKey
+    if 'session' in queryParams:
+        return 'session_check', ''
+    return 'probe', ''
+
+def recordRequestMetric(host, query, seconds, statusCode=None, bytesIn=0, retries=0, errorKind=None):
+    operation, itemCode = requestOperation(query)
+    with phoneMetricsLock:
+        series = phoneMetrics.get((host, operation, itemCode))
+        if series is None:
+            series = phoneMetrics[(host, operation, itemCode)] = {
+                'count': 0, 'seconds': 0.0, 'buckets': [0] * (len(metricBuckets) + 1),
+                'bytesIn': 0, 'bytesOut': 0, 'statusCodes': {}, 'retries': 0, 'errors': {},
+            }
+        series['count'] += 1
+        series['seconds'] += seconds
+        series['buckets'][bisect.bisect_left(metricBuckets, seconds)] += 1
+        series['bytesIn'] += bytesIn
+        # Request line as sent, the headers are the same for every request
+        series['bytesOut'] += len(query) + len('GET /index.cgi? HTTP/1.1\r\n')
+        series['retries'] += retries
+        if statusCode is not None:
+            series['statusCodes'][str(statusCode)] = series['statusCodes'].get(str(statusCode), 0) + 1
+        if errorKind:
+            series['errors'][errorKind] = series['errors'].get(errorKind, 0) + 1
+
+# Count a per-host event such as an https:// to http:// fallback
+def recordEvent(host, event):
+    with phoneMetricsLock:
+        hostEvents = phoneEvents.setdefault(host, {})
+        hostEvents[event] = hostEvents.get(event, 0) + 1
+
+# Metrics recorded so far, in the JSON export layout
+def metricsSnapshot():
+    with phoneMetricsLock:
+        series = [dict(seriesValues, host=host, operation=operation, item=itemCode, buckets=list(seriesValues['buckets']),
+                       statusCodes=dict(seriesValues['statusCodes']), errors=dict(seriesValues['errors']))
+                  for (host, operation, itemCode), seriesValues in sorted(phoneMetrics.items())]
+        events = dict((host, dict(hostEvents)) for host, hostEvents in phoneEvents.items())
+    return {'buckets': list(metricBuckets), 'series': series, 'events': events}
+
+# Add the counts of one snapshot into another, returning the sum
+def mergeMetrics(totals, snapshot):
+    if not totals or totals.get('buckets') != snapshot['buckets']:
+        totals = {'buckets': snapshot['buckets'], 'series': [], 'events': {}}
+    seriesIndex = dict(((series['host'], series['operation'], series['item']), series) for series in totals['series'])
+    for series in snapshot['series']:
+        total = seriesIndex.get((series['host'], series['operation'], series['item']))
+        if total is None:
+            totals['series'].append(dict(series))
+            continue
+        for key in ('count', 'seconds', 'bytesIn', 'bytesOut', 'retries'):
+            total[key] += series[key]
+        total['buckets'] = [a + b for a, b in zip(total['buckets'], series['buckets'])]
+        for key in ('statusCodes', 'errors'):
+            for name, count in series[key].items():
+                total[key][name] = total[key].get(name, 0) + count
+    for host, hostEvents in snapshot['events'].items():
+        totalEvents = totals['events'].setdefault(host, {})
+        for event, count in hostEvents.items():
+            totalEvents[event] = totalEvents.get(event, 0) + count
+    totals['series'].sort(key=lambda series: (series['host'], series['operation'], series['item']))
+    return totals
+
+# Escape a Prometheus label value
+def prometheusLabel(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Metrics in the Prometheus text exposition format
+def metricsPrometheus(snapshot):
+    lines = []
+    def family(name, metricType, help):
+        lines.append('# HELP {} {}'.format(name, help))
+        lines.append('# TYPE {} {}'.format(name, metricType))
+    seriesLabels = [('host="{}",operation="{}",item="{}"'.format(prometheusLabel(series['host']), series['operation'], prometheusLabel(series['item'])), series)
+                    for series in snapshot['series']]
+    family('nec_phone_request_seconds', 'histogram', 'Seconds per request to a phone, including retries')
+    for labels, series in seriesLabels:
+        cumulative = 0
+        for bound, count in zip(list(snapshot['buckets']) + ['+Inf'], series['buckets']):
+            cumulative += count
+            lines.append('nec_phone_request_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, cumulative))
+        lines.append('nec_phone_request_seconds_sum{{{}}} {}'.format(labels, round(series['seconds'], 6)))
+        lines.append('nec_phone_request_seconds_count{{{}}} {}'.format(labels, series['count']))
+    for name, key, help in (('nec_phone_response_bytes_total', 'bytesIn', 'Response body bytes received from phones'),
+                            ('nec_phone_request_bytes_total', 'bytesOut', 'Request line bytes sent to phones'),
+                            ('nec_phone_retries_total', 'retries', 'Retried attempts of requests to phones')):
+        family(name, 'counter', help)
+        for labels, series in seriesLabels:
+            lines.append('{}{{{}}} {}'.format(name, labels, series[key]))
+    for name, key, labelName, help in (('nec_phone_responses_total', 'statusCodes', 'code', 'Responses from phones by HTTP status code'),
+                                       ('nec_phone_request_errors_total', 'errors', 'kind', 'Failed requests to phones by error kind')):
+        family(name, 'counter', help)
+        for labels, series in seriesLabels:
+            for labelValue, count in sorted(series[key].items()):
+                lines.append('{}{{{},{}="{}"}} {}'.format(name, labels, labelName, labelValue, count))
+    family('nec_phone_events_total', 'counter', 'Per-phone events such as protocol fallbacks')
+    for host, hostEvents in sorted(snapshot['events'].items()):
+        for event, count in sorted(hostEvents.items()):
+            lines.append('nec_phone_events_total{{host="{}",event="{}"}} {}'.format(prometheusLabel(host), event, count))
+    return '\n'.join(lines) + '\n'
+
+# Replace a file whole with text, so a reader never sees it half written
+def replaceFile(filePath, text):
+    fileDir = os.path.dirname(filePath)
+    if fileDir and not os.path.isdir(fileDir):
+        os.makedirs(fileDir, exist_ok=True)
+    temporaryFile = '{}.{}.tmp'.format(filePath, os.getpid())
     try:
-        passSingleParamItemResponse = nec_phone_tool.passSingleParameter(hostName, sessionId, paramKey, paramValue, False, False)
-        if passSingleParamItemResponse.status_code == 200:
-            if args.vv:
-                print('\tSet single param item successful for session {} on host {}'.format(sessionId, hostName))
-                print('\tParam: {} Value: {}'.format(paramKey, paramValue))
-            elif args.v:
-                print('\tSet single param item successful')
-        else:
-            if args.vv:
-                print('\tSet single param item failed for session {} on host {}'.format(sessionId, hostName))
-                print('\tParam: {} Value: {}'.format(paramKey, paramValue))
-                print(passSingleParamItemResponse.status_code)
-                print(passSingleParamItemResponse.text)
-            else:
-                print('\tSet single param item failed')
-    except:
-        if args.insecureSecondary and loopCheck == 0:
-            # Replace https:// with http:// and try again
-            print('\tDegrading protocol to http://')
-            hostName = hostName.replace('https://', 'http://')
-            passSingleParameter(hostName, sessionId, paramKey, paramValue, 1)
-        else:
-            print('\tSet single param item failed')
+        with open(temporaryFile, 'w') as f:
+            f.write(text)
+        os.replace(temporaryFile, filePath)
+    except BaseException:
+        if os.path.exists(temporaryFile):
+            os.remove(temporaryFile)
+        raise
+
+# Write the metrics recorded so far: Prometheus text if the file name ends
+# in .prom, JSON otherwise. With merge the counts are added to what earlier
+# runs left, kept in the JSON file itself or in a .json file beside a .prom
+# file, and the recorded metrics are reset so they are not added twice.
+def writeMetrics(metricsFile, merge=False):
+    metricsFile = os.path.expanduser(metricsFile)
+    prometheusFormat = metricsFile.endswith('.prom')
+    snapshot = metricsSnapshot()
+    if merge:
+        totalsFile = metricsFile + '.json' if prometheusFormat else metricsFile
+        def update(store):
+            totals = mergeMetrics(dict(store), snapshot)
+            store.clear()
+            store.update(totals)
+        snapshot = updateJsonStore(totalsFile, update)
+        resetMetrics()
+        if not prometheusFormat:
+            return
+    if prometheusFormat:
+        replaceFile(metricsFile, metricsPrometheus(snapshot))
+    else:
+        replaceFile(metricsFile, json.dumps(snapshot, indent=1))
+
+# Trace of a run in the Chrome trace event format, viewable in
+# chrome://tracing or Perfetto: a span per request to a phone, named after
+# its operation and item code, inside spans for each host or task. Off by
+# default, like the metrics.
+traceEvents = []
+phoneProfiles = []
+
+def configureTracing(enabled):
+    phoneVariables['system']['trace'] = enabled
+
+# Record a finished span. Timestamps are wall clock so spans written by
+# separate processes, such as forked Ansible workers, line up.
+def recordSpan(name, category, startTime, seconds, host=None, spanArgs=None):
+    event = {
+        'name': name, 'cat': category, 'ph': 'X', 'ts': int(startTime * 1000000), 'dur': int(seconds * 1000000),
+        'pid': os.getpid(), 'tid': threading.get_native_id(),
+        'args': dict(spanArgs or {}, host=host) if host else dict(spanArgs or {}),
+    }
+    with phoneMetricsLock:
+        traceEvents.append(event)
+
+# Record a point in time, such as a protocol fallback
+def recordTraceInstant(name, host=None):
+    event = {
+        'name': name, 'cat': 'event', 'ph': 'i', 's': 't', 'ts': int(time.time() * 1000000),
+        'pid': os.getpid(), 'tid': threading.get_native_id(), 'args': {'host': host} if host else {},
+    }
+    with phoneMetricsLock:
+        traceEvents.append(event)
+
+# Span around a block of work, recorded only while tracing is on
+@contextlib.contextmanager
+def traceSpan(name, host=None, category='task', **spanArgs):
+    if not phoneVariables['system']['trace']:
+        yield
+        return
+    startTime = time.time()
+    startCounter = time.perf_counter()
+    try:
+        yield
+    finally:
+        recordSpan(name, category, startTime, time.perf_counter() - startCounter, host, spanArgs)
+
+# Write the spans recorded so far and forget them. With merge they are
+# added to the events already in the file, so every task of a playbook run
+# ends up on one timeline.
+def writeTrace(traceFile, merge=False):
+    traceFile = os.path.expanduser(traceFile)
+    with phoneMetricsLock:
+        events = list(traceEvents)
+        del traceEvents[:]
+    if merge:
+        def update(store):
+            store.setdefault('traceEvents', []).extend(events)
+            store['displayTimeUnit'] = 'ms'
+        updateJsonStore(traceFile, update)
+        return
+    replaceFile(traceFile, json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}))
+
+# Call function under cProfile, keeping the profile for writeProfile. Each
+# thread needs its own profiler, so workers of a pool call this themselves.
+def profiledCall(function, *args):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return function(*args)
+    finally:
+        profiler.disable()
+        with phoneMetricsLock:
+            phoneProfiles.append(profiler)
+
+# Save the profiles kept by profiledCall as one pstats file and forget them.
+# With merge the stats already in the file are added in.
+def writeProfile(profileFile, merge=False):
+    profileFile = os.path.expanduser(profileFile)
+    with phoneMetricsLock:
+        profilers = list(phoneProfiles)
+        del phoneProfiles[:]
+    if not profilers:
+        return None
+    profileStats = pstats.Stats(profilers[0])
+    for profiler in profilers[1:]:
+        profileStats.add(profiler)
+    profileDir = os.path.dirname(profileFile)
+    if profileDir and not os.path.isdir(profileDir):
+        os.makedirs(profileDir, exist_ok=True)
+    # Tasks on other workers may be saving their profiles at the same time
+    with open(profileFile + '.lock', 'w') as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        if merge and os.path.exists(profileFile):
+            try:
+                profileStats.add(profileFile)
+            except (EOFError, TypeError, ValueError):
+                pass
+        temporaryFile = '{}.{}.tmp'.format(profileFile, os.getpid())
+        profileStats.dump_stats(temporaryFile)
+        os.replace(temporaryFile, profileFile)
+    return profileStats
+
+# Run a module's task function, tracing and profiling it as the task's
+# trace_file and profile_file options ask. The files collect every task of
+# a playbook run.
+def runObservedTask(runTask, params):
+    traceFile = params.get('trace_file')
+    profileFile = params.get('profile_file')
+    if traceFile:
+        configureTracing(True)
+    try:
+        with traceSpan(runTask.__name__, params.get('host')):
+            if profileFile:
+                return profiledCall(runTask, params)
+            return runTask(params)
+    finally:
+        if profileFile:
+            writeProfile(profileFile, merge=True)
+        if traceFile:
+            writeTrace(traceFile, merge=True)
+
+# One GET to index.cgi over the pooled session for the host. With
+# insecureSecondary a failed https:// connection is retried once over
+# http:// and the working scheme is reused for every later call to the host.
+def sendPhoneRequest(hostName, query, verifyCerts, proxies=None, timeout=None, stream=False):
+    hostName = negotiatedHostName(hostName)
+    try:
+        response = getPhoneSession(hostName).get(hostName + '/index.cgi?' + query, verify=verifyCerts, proxies=proxies, timeout=timeout, stream=stream)
+    except requests.exceptions.ConnectionError:
+        if not (phoneVariables['system']['insecureSecondary'] and hostName.startswith('https://')):
+            raise
+        hostName = 'http://' + splitHostName(hostName)[1]
+        if phoneVariables['system']['metrics']:
+            recordEvent(splitHostName(hostName)[1], 'protocol_fallback')
+        if phoneVariables['system']['trace']:
+            recordTraceInstant('protocol_fallback', splitHostName(hostName)[1])
+        response = getPhoneSession(hostName).get(hostName + '/index.cgi?' + query, verify=verifyCerts, proxies=proxies, timeout=timeout, stream=stream)
+    if phoneVariables['system']['insecureSecondary']:
+        rememberProtocol(hostName)
+    return response
+
+# Send a GET to index.cgi, retrying transient failures with backoff. Raises
+# PhoneRequestError once retries are used up, the host's circuit is open or
+# its deadline has passed. Recorded in the request metrics and the trace
+# when they are on. With readBody the response is streamed and
+# readBody(response), which returns the bytes it read, consumes the body as
+# part of the attempt. rebootRequest marks a logoff or hard reset, see
+# retryPhoneRequest.
+def phoneRequest(hostName, query, verifyCerts, proxies=None, readBody=None, rebootRequest=False):
+    systemSettings = phoneVariables['system']
+    if not (systemSettings['metrics'] or systemSettings['trace']):
+        return retryPhoneRequest(hostName, query, verifyCerts, proxies, readBody, rebootRequest)
+    host = splitHostName(hostName)[1]
+    startTime = time.time()
+    startCounter = time.perf_counter()
+    try:
+        response = retryPhoneRequest(hostName, query, verifyCerts, proxies, readBody, rebootRequest)
+    except PhoneRequestError as e:
+        observeRequest(host, query, startTime, time.perf_counter() - startCounter, None, 0, e.attempts, e.kind)
+        raise
+    bytesIn = response.bodyBytes if readBody else len(response.content)
+    observeRequest(host, query, startTime, time.perf_counter() - startCounter, response.status_code, bytesIn, response.attempts)
+    return response
+
+# Add a finished request to the metrics and the trace, whichever are on
+def observeRequest(host, query, startTime, seconds, statusCode, bytesIn, attempts, errorKind=None):
+    if phoneVariables['system']['metrics']:
+        recordRequestMetric(host, query, seconds, statusCode, bytesIn, max(0, attempts - 1), errorKind)
+    if phoneVariables['system']['trace']:
+        operation, itemCode = requestOperation(query)
+        spanArgs = {'status': statusCode, 'attempts': attempts}
+        if errorKind:
+            spanArgs['error'] = errorKind
+        recordSpan('{} {}'.format(operation, itemCode).strip(), 'request', startTime, seconds, host, spanArgs)
+
+# Transport failures expected when the phone reboots on a request: it drops
+# the connection or stops answering while it goes down
+rebootDropKinds = ('timeout', 'refused', 'connection')
+
+# Stand-in response for a reboot request the phone dropped while going down.
+# Reads as HTTP 200 to callers; rebootDropped holds the error kind.
+def droppedRebootResponse(errorKind, attempts):
+    response = requests.models.Response()
+    response.status_code = 200
+    response._content = b''
+    response.rebootDropped = errorKind
+    response.bodyBytes = 0
+    response.attempts = attempts
+    return response
+
+# Attempts allowed for a request. A rebootRequest (logoff or hard reset) is
+# sent once, as a repeat could reach the phone after it came back.
+def requestAttempts(rebootRequest=False):
+    if phoneVariables['system']['retry'] and not rebootRequest:
+        return 1 + phoneVariables['system']['maxRetries']
+    return 1
+
+# Seconds to wait before retry number attempt (1 based) to a host, cut to
+# what is left of its deadline, counted in retryCounter
+def retryBackoff(host, attempt):
+    phoneVariables['system']['retryCounter'] += 1
+    backoff = retryDelay(attempt - 1)
+    remaining = deadlineRemaining(host)
+    if remaining is not None:
+        backoff = max(0, min(backoff, remaining))
+    return backoff
+
+# Account for a failed attempt (0 based) of attempts, errorKind as
+# classified. Returns a dropped-reboot response to hand back instead and the
+# attempts now allowed: a transport failure that opens the host's circuit
+# ends the retries. Raises PhoneRequestError once no retry is left. A
+# dropped connection or timeout on a rebootRequest is taken as the phone
+# going down rather than as a failure, so it does not count towards the
+# circuit.
+def failedAttempt(host, error, errorKind, attempt, attempts, rebootRequest=False):
+    if rebootRequest and errorKind in rebootDropKinds:
+        return droppedRebootResponse(errorKind, attempt + 1), attempts
+    # A phone answering 5xx is up, only transport failures trip the circuit
+    if errorKind != 'http5xx' and recordFailure(host):
+        # Host is now known to be down, stop retrying it
+        attempts = attempt + 1
+    if errorKind not in retryableKinds or attempt == attempts - 1:
+        if isinstance(error, PhoneRequestError):
+            raise error
+        # Leave the query, which can hold credentials, out of the message
+        raise PhoneRequestError(errorKind, host, re.sub(r'index\.cgi\?\S*', 'index.cgi', str(error) or type(error).__name__), attempt + 1)
+    return None, attempts
+
+# phoneRequest without the metrics and trace
+def retryPhoneRequest(hostName, query, verifyCerts, proxies=None, readBody=None, rebootRequest=False):
+    host = splitHostName(hostName)[1]
+    checkCircuit(host)
+    attempts = requestAttempts(rebootRequest)
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(retryBackoff(host, attempt))
+        timeout = requestTimeout(host)
+        try:
+            response = sendPhoneRequest(hostName, query, verifyCerts, proxies, timeout, readBody is not None)
+            if response.status_code >= 500:
+                if readBody:
+                    response.close()
+                raise PhoneRequestError('http5xx', host, 'HTTP {}'.format(response.status_code), attempt + 1, response)
+            if readBody:
+                response.bodyBytes = readBody(response)
+            recordSuccess(host)
+            response.attempts = attempt + 1
+            return response
+        except requests.exceptions.RequestException as e:
+            droppedResponse, attempts = failedAttempt(host, e, classifyRequestError(e), attempt, attempts, rebootRequest)
+            if droppedResponse is not None:
+                return droppedResponse
+
+# Session id as it appears in links on the logon page
+sessionPattern = re.compile(r'session=(.{4})"')
+
+# Extract session id from logon page text, empty string if missing
+def parseSessionId(logOnText):
+    sessionMatch = sessionPattern.search(logOnText)
+    if sessionMatch:
+        return sessionMatch.group(1)
+    return ''
+
+# Raise when a logon page came back without a session id: bad_credentials
+# if the phone showed its logon form again, nosession for any other page
+def requireSession(hostName, logOnResponse, sessionId):
+    if not sessionId:
+        if getattr(logOnResponse, 'logOnOutcome', None) == 'bad_credentials':
+            raise PhoneRequestError('bad_credentials', splitHostName(hostName)[1], 'logon form shown again, username or password rejected', response=logOnResponse)
+        raise PhoneRequestError('nosession', splitHostName(hostName)[1], 'no session id in logon page (HTTP {})'.format(logOnResponse.status_code), response=logOnResponse)
+    return sessionId
+
+# Raise bad_credentials before any request when a logon is needed but the
+# task was given no username or password, rather than sending an empty logon
+def requireCredentials(hostName, logOnName, logOnPassword):
+    if not logOnName or not logOnPassword:
+        raise PhoneRequestError('bad_credentials', splitHostName(hostName)[1], 'no session to reuse and no username and password given, give username and password or session_id')
+
+# Outcome of a logon: ok with a session id, bad_credentials when the phone
+# shows its logon form again, or unexpected_page for anything else. pageText
+# is the whole page, unless what followed the session link was too long to
+# drain.
+LogOnResult = namedtuple('LogOnResult', ['outcome', 'sessionId', 'response', 'pageText'])
+
+# Streamed pages are read in chunks of streamChunkBytes. Once what is wanted
+# has been found the rest of a page is only drained, so the connection can
+# go back to the pool, if at most streamDrainBytes are left; a longer rest
+# is dropped with the connection.
+streamChunkBytes = 1024
+streamDrainBytes = 16384
+
+# Drain what is left of a streamed page if it is short, returning the bytes
+# drained. Drained chunks are added to keptChunks if given. The caller
+# closes the response.
+def drainStreamedPage(response, chunks, bytesRead, keptChunks=None):
+    contentLength = response.headers.get('Content-Length', '')
+    if contentLength.isdigit() and int(contentLength) - bytesRead > streamDrainBytes:
+        return 0
+    drainedBytes = 0
+    for chunk in chunks:
+        drainedBytes += len(chunk)
+        if keptChunks is not None:
+            keptChunks.append(chunk)
+        if drainedBytes > streamDrainBytes:
+            break
+    return drainedBytes
+
+# Logon pages are scanned as they arrive for the session id, or for the
+# logon form a phone shows again when the credentials are wrong
+logOnPagePattern = re.compile(br'session=(.{4})"|name="(?:username|password)"')
+logOnPatternOverlap = len(b'name="username"') - 1
+
+# readBody for a logon: scan the streamed page, keeping the outcome, session
+# id and page read on the response. Returns the bytes read.
+def scanLogOnPage(response):
+    pageChunks = []
+    bytesRead = 0
+    carriedBytes = b''
+    sessionId = ''
+    formSeen = False
+    try:
+        chunks = response.iter_content(chunk_size=streamChunkBytes)
+        for chunk in chunks:
+            pageChunks.append(chunk)
+            bytesRead += len(chunk)
+            scanBytes = carriedBytes + chunk
+            for pageMatch in logOnPagePattern.finditer(scanBytes):
+                if pageMatch.group(1) is not None:
+                    sessionId = pageMatch.group(1).decode('latin-1')
+                    break
+                formSeen = True
+            if sessionId:
+                break
+            carriedBytes = scanBytes[-logOnPatternOverlap:]
+        if sessionId:
+            # Model, firmware and MAC may follow the session link
+            bytesRead += drainStreamedPage(response, chunks, bytesRead, pageChunks)
+    finally:
+        response.close()
+    if sessionId:
+        response.logOnOutcome = 'ok'
+    elif formSeen and response.status_code == 200:
+        response.logOnOutcome = 'bad_credentials'
+    else:
+        response.logOnOutcome = 'unexpected_page'
+    response.logOnSessionId = sessionId
+    response.logOnPageText = b''.join(pageChunks).decode(response.encoding or 'utf-8', 'replace')
+    return bytesRead
+
+# index.cgi query strings, shared by the sync and async clients
+def logOnQuery(logOnName, logOnPassword):
+    return 'username={}&password={}'.format(logOnName, logOnPassword)
+
+def logOffQuery(sessionId):
+    return 'session={}&set=all'.format(sessionId)
+
+def passSingleParameterQuery(sessionId, paramKey, paramValue):
+    return 'session={}&{}={}'.format(sessionId, paramKey, paramValue)
+
+def setSingleItemQuery(sessionId, parameter, value):
+    return 'session={}&set={}&item={}'.format(sessionId, parameter, value)
+
+def setTwoParametersQuery(sessionId, parameter, value, paramTwoKey, paramTwoValue):
+    return 'session={}&set={}&item={}&{}={}'.format(sessionId, parameter, value, paramTwoKey, paramTwoValue)
+
+# The web UI has no documented call to read a single item. get=<item code>
+# is assumed to answer with the settings page holding the item, as the
+# emulator in nec_phone_emulator does; this is not confirmed on a real
+# phone. Reads before writes (read_before_write), get_config and
+# check_drift all depend on it.
+def getSingleItemQuery(sessionId, parameter):
+    return 'session={}&get={}'.format(sessionId, parameter)
+
+# Item inputs on a settings page: <input ... name="41d044f" ... value="222">
+itemValuePattern = re.compile(r'<input[^>]*?name="([0-9a-fA-F]{7})"[^>]*?value="([^"]*)"')
+
+# Map item code -> current value for every item input on a page
+def parseItemValues(pageText):
+    return dict(itemValuePattern.findall(pageText))
+
+# itemValuePattern for scanning streamed pages. An input tag cut off at the
+# end of a chunk, up to maxCarriedTagBytes of it, is scanned again with the
+# next chunk.
+itemValueBytesPattern = re.compile(br'<input[^>]*?name="([0-9a-fA-F]{7})"[^>]*?value="([^"]*)"')
+maxCarriedTagBytes = 4096
+
+# readBody for item pages: parse item inputs as the page arrives, keeping
+# item code -> value on the response as itemValues, and stop reading once
+# every code in wantedCodes has been seen. Item codes are lower case.
+def itemPageReader(wantedCodes):
+    def scanItemPage(response):
+        itemValues = {}
+        missingCodes = set(itemCode.lower() for itemCode in wantedCodes)
+        encoding = response.encoding or 'utf-8'
+        bytesRead = 0
+        carriedBytes = b''
+        try:
+            chunks = response.iter_content(chunk_size=streamChunkBytes)
+            for chunk in chunks:
+                bytesRead += len(chunk)
+                scanBytes = carriedBytes + chunk
+                for itemCode, value in itemValueBytesPattern.findall(scanBytes):
+                    itemCode = itemCode.decode('ascii').lower()
+                    itemValues[itemCode] = value.decode(encoding, 'replace')
+                    missingCodes.discard(itemCode)
+                if not missingCodes:
+                    bytesRead += drainStreamedPage(response, chunks, bytesRead)
+                    break
+                tagStart = scanBytes.rfind(b'<')
+                if tagStart > scanBytes.rfind(b'>') and len(scanBytes) - tagStart <= maxCarriedTagBytes:
+                    carriedBytes = scanBytes[tagStart:]
+                else:
+                    carriedBytes = b''
+        finally:
+            response.close()
+        response.itemValues = itemValues
+        return bytesRead
+    return scanItemPage
+
+# Read a JSON store from disk, empty dict if missing or unreadable
+def readJsonStore(storePath):
+    try:
+        with open(os.path.expanduser(storePath), 'r') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+# Update a JSON store in place under an exclusive lock, readable by owner only
+def updateJsonStore(storePath, updateStore):
+    storePath = os.path.expanduser(storePath)
+    storeDir = os.path.dirname(storePath)
+    if storeDir and not os.path.isdir(storeDir):
+        os.makedirs(storeDir, 0o700, exist_ok=True)
+    fd = os.open(storePath, os.O_RDWR | os.O_CREAT, 0o600)
+    with os.fdopen(fd, 'r+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            store = json.load(f)
+        except ValueError:
+            store = {}
+        updateStore(store)
+        f.seek(0)
+        f.truncate()
+        json.dump(store, f)
+    return store
+
+# Sessions are cached per phone regardless of scheme
+def sessionCacheKey(hostName):
+    return hostName.split('://', 1)[-1]
+
+# Remember a session id for a phone
+def storeSession(hostName, sessionId):
+    def update(store):
+        store[sessionCacheKey(hostName)] = {'sessionId': sessionId, 'lastUsed': time.time()}
+    updateJsonStore(phoneVariables['system']['sessionCacheFile'], update)
+
+# Forget the cached session for a phone, called on logoff and reboot
+def invalidateSession(hostName):
+    cacheFile = phoneVariables['system']['sessionCacheFile']
+    if not os.path.exists(os.path.expanduser(cacheFile)):
+        return
+    def update(store):
+        store.pop(sessionCacheKey(hostName), None)
+    updateJsonStore(cacheFile, update)
+
+# Hold a phone's reboot back for a rolling reboot to release later. The
+# session stays open with its writes unsaved until then. A pending hard
+# reset is kept over a later plain logoff.
+def queueReboot(hostName, sessionId, rebootKind='logoff'):
+    def update(store):
+        pendingReboot = store.get(sessionCacheKey(hostName)) or {}
+        queuedKind = rebootKind
+        if pendingReboot.get('rebootKind') == 'hard_reset':
+            queuedKind = 'hard_reset'
+        # Keep the scheme the phone answered on, the release may run in another process
+        store[sessionCacheKey(hostName)] = {'hostName': negotiatedHostName(hostName), 'sessionId': sessionId, 'rebootKind': queuedKind, 'queued': time.time()}
+    updateJsonStore(phoneVariables['system']['pendingRebootFile'], update)
+
+# Reboots waiting to be released, host -> hostName, sessionId, rebootKind, queued
+def pendingReboots():
+    return readJsonStore(phoneVariables['system']['pendingRebootFile'])
+
+# Forget a pending reboot, called once the phone has been rebooted
+def clearPendingReboot(hostName):
+    rebootFile = phoneVariables['system']['pendingRebootFile']
+    if not os.path.exists(os.path.expanduser(rebootFile)):
+        return
+    def update(store):
+        store.pop(sessionCacheKey(hostName), None)
+    updateJsonStore(rebootFile, update)
+
+# Model and firmware shown by the web UI: the logon form's title names the
+# terminal type, the page behind the logon also shows the firmware
+modelPatterns = [
+    re.compile(r'Terminal Type:\s*([A-Za-z0-9_.-]+)'),
+    re.compile(r'<title>\s*([A-Za-z0-9_.-]+)\s+Web Setting', re.IGNORECASE),
+]
+firmwarePattern = re.compile(r'Firmware Version:\s*([0-9A-Za-z_.-]+)')
+macPattern = re.compile(r'MAC Address:\s*([0-9A-Fa-f]{2}(?:[:-]?[0-9A-Fa-f]{2}){5})')
+
+# MAC address in lower case with colons, as stored and compared
+def normalizeMac(macAddress):
+    hexDigits = re.sub(r'[^0-9a-f]', '', macAddress.lower())
+    return ':'.join(hexDigits[i:i + 2] for i in range(0, 12, 2))
+
+# Model, firmware and MAC address from an index.cgi page, None if it is not
+# an NEC web UI
+def identifyPhonePage(pageText):
+    lowerText = pageText.lower()
+    if 'web setting' not in lowerText and not ('index.cgi' in lowerText and 'name="username"' in lowerText):
+        return None
+    phoneInfo = {'model': None, 'firmware': None, 'mac': None}
+    for modelPattern in modelPatterns:
+        modelMatch = modelPattern.search(pageText)
+        if modelMatch:
+            phoneInfo['model'] = modelMatch.group(1)
+            break
+    firmwareMatch = firmwarePattern.search(pageText)
+    if firmwareMatch:
+        phoneInfo['firmware'] = firmwareMatch.group(1)
+    macMatch = macPattern.search(pageText)
+    if macMatch:
+        phoneInfo['mac'] = normalizeMac(macMatch.group(1))
+    return phoneInfo
+
+# configFiles family of a model, DT820 -> DT800, None if not a known family
+def modelFamily(model):
+    familyMatch = re.match(r'(DT\d)\d\d', model or '', re.IGNORECASE)
+    if familyMatch and familyMatch.group(1).upper() + '00' in phoneVariables['configFiles']:
+        return familyMatch.group(1).upper() + '00'
+    return None
+
+# Fingerprint remembered for a phone, None if unknown or older than maxAge seconds
+def cachedFingerprint(hostName, maxAge=None):
+    if maxAge is None:
+        maxAge = phoneVariables['system']['fingerprintCacheTtl']
+    fingerprint = readJsonStore(phoneVariables['system']['fingerprintCacheFile']).get(sessionCacheKey(hostName))
+    if not fingerprint or time.time() - fingerprint['learned'] > maxAge:
+        return None
+    phoneVariables['phoneFirmware'][sessionCacheKey(hostName)] = fingerprint
+    return fingerprint
+
+# Remember a phone's model and firmware on the controller
+def storeFingerprint(hostName, phoneInfo):
+    fingerprint = {'model': phoneInfo['model'], 'firmware': phoneInfo['firmware'], 'family': modelFamily(phoneInfo['model']), 'learned': time.time()}
+    phoneVariables['phoneFirmware'][sessionCacheKey(hostName)] = fingerprint
+    updateJsonStore(phoneVariables['system']['fingerprintCacheFile'], lambda store: store.__setitem__(sessionCacheKey(hostName), fingerprint))
+    return fingerprint
+
+# Read model and firmware from the phone's web UI: the logon form without a
+# session, the page behind the logon with one. None if it is not an NEC phone.
+def fingerprintPhone(hostName, verifyCerts, proxies=None, sessionId=None):
+    query = 'session={}'.format(sessionId) if sessionId else ''
+    fingerprintResponse = phoneRequest(hostName, query, verifyCerts, proxies)
+    if fingerprintResponse.status_code != 200:
+        return None
+    return identifyPhonePage(fingerprintResponse.text)
+
+# MAC address the phone shows, from the logon page if it was read and shows
+# it, otherwise from the landing page of the session. None if not shown.
+def readPhoneMac(hostName, sessionId, verifyCerts, proxies=None, logOnPageText=None):
+    phoneInfo = identifyPhonePage(logOnPageText) if logOnPageText else None
+    if not phoneInfo or not phoneInfo['mac']:
+        phoneInfo = fingerprintPhone(hostName, verifyCerts, proxies, sessionId)
+    return phoneInfo['mac'] if phoneInfo else None
+
+# Check a session is still accepted: the landing page links back to the same session
+def sessionIsValid(hostName, sessionId, verifyCerts, proxies=None):
+    try:
+        checkResponse = phoneRequest(hostName, 'session={}'.format(sessionId), verifyCerts, proxies)
+    except requests.exceptions.RequestException:
+        return False
+    return checkResponse.status_code == 200 and parseSessionId(checkResponse.text) == sessionId
+
+# Return a cached, still valid session id for a phone, empty string if none
+def getCachedSession(hostName, verifyCerts, sessionTtl=None, proxies=None):
+    if sessionTtl is None:
+        sessionTtl = phoneVariables['system']['sessionCacheTtl']
+    cachedSession = readJsonStore(phoneVariables['system']['sessionCacheFile']).get(sessionCacheKey(hostName))
+    if not cachedSession or time.time() - cachedSession['lastUsed'] > sessionTtl:
+        return ''
+    if not sessionIsValid(hostName, cachedSession['sessionId'], verifyCerts, proxies):
+        invalidateSession(hostName)
+        return ''
+    return cachedSession['sessionId']
+
+# Logon to phone, streaming the logon page only as far as the session id
+def logOnPhoneResult(hostName, logOnName, logOnPassword, verifyCerts, proxies=None):
+    logOnResponse = phoneRequest(hostName, logOnQuery(logOnName, logOnPassword), verifyCerts, proxies, scanLogOnPage)
+    return LogOnResult(logOnResponse.logOnOutcome, logOnResponse.logOnSessionId, logOnResponse, logOnResponse.logOnPageText)
 
 # Logon to phone
 def logOnPhone(hostName, logOnName, logOnPassword, bypassProxy, verifyCerts, proxies=proxies):
     #if (bypassProxy):
     #    pass
-    logOnResponse = requests.get(hostName + '/index.cgi?username={}&password={}'.format(logOnName, logOnPassword), verify=verifyCerts)
-    # Extract session id from logon response with regex and return it
-    try:
-        sessionId = re.search(r'session=(.{4})"', logOnResponse.text).group(1)
-    except:
-        sessionId = ''
-    finally:
-        return logOnResponse, sessionId
+    logOnResult = logOnPhoneResult(hostName, logOnName, logOnPassword, verifyCerts)
+    # Return the response with the session id extracted from it
+    return logOnResult.response, logOnResult.sessionId
        
 # Log off phone
 def logOffPhone(hostName, sessionId, bypassProxy, verifyCerts, proxies=proxies):
     if (bypassProxy):
         pass
-    logOffResponse = requests.get(hostName + '/index.cgi?session={}&set=all'.format(sessionId), verify=verifyCerts, proxies=proxies)
+    logOffResponse = phoneRequest(hostName, logOffQuery(sessionId), verifyCerts, proxies, rebootRequest=True)
+    # Phone reboots on logoff, any cached session or pending reboot is gone
+    invalidateSession(hostName)
+    clearPendingReboot(hostName)
     return logOffResponse
 	
 # Pass single parameter to phone
 def passSingleParameter(hostName, sessionId, paramKey, paramValue, bypassProxy, verifyCerts, proxies=proxies):
 	if (bypassProxy):
 		pass
-	passParameterResponse = requests.get(hostName + '/index.cgi?session={}&{}={}'.format(sessionId, paramKey, paramValue), verify=verifyCerts, proxies=proxies)
+	passParameterResponse = phoneRequest(hostName, passSingleParameterQuery(sessionId, paramKey, paramValue), verifyCerts, proxies, rebootRequest=paramKey == 'hard_reset')
+	if paramKey in ('data_clear', 'hard_reset'):
+		invalidateSession(hostName)
+	if paramKey == 'hard_reset':
+		clearPendingReboot(hostName)
 	return passParameterResponse
 
+# Read the current value of a single item, None if the phone does not show
+# it. Relies on the assumed get= read, see getSingleItemQuery.
+def getSingleItem(hostName, sessionId, parameter, verifyCerts, proxies=None):
+    getItemResponse = phoneRequest(hostName, getSingleItemQuery(sessionId, parameter), verifyCerts, proxies, itemPageReader([parameter]))
+    if getItemResponse.status_code != 200:
+        return None
+    return getItemResponse.itemValues.get(parameter.lower())
+
+# Read items over one session with up to concurrency pages in flight.
+# Returns item code -> value, None for items the phone does not show, and
+# item code -> error kind for reads that failed. A page can hold other items
+# of its menu ahead of the one asked for, so codes already seen on an
+# earlier page are not fetched again. Reads stop at the host deadline.
+# Pages are fetched with the assumed get= read, see getSingleItemQuery.
+def readItems(hostName, sessionId, itemCodes, verifyCerts, proxies=None, concurrency=2):
+    wantedCodes = list(dict.fromkeys(itemCode.lower() for itemCode in itemCodes))
+    wantedSet = set(wantedCodes)
+    itemValues = {}
+    itemErrors = {}
+    fetchedCodes = set()
+    pendingCodes = iter(wantedCodes)
+    readLock = threading.Lock()
+    def nextCode():
+        with readLock:
+            for itemCode in pendingCodes:
+                if itemCode not in itemValues:
+                    fetchedCodes.add(itemCode)
+                    return itemCode
+        return None
+    def readWorker():
+        itemCode = nextCode()
+        while itemCode is not None:
+            if deadlineExceeded(hostName):
+                itemErrors[itemCode] = 'deadline'
+            else:
+                try:
+                    getItemResponse = phoneRequest(hostName, getSingleItemQuery(sessionId, itemCode), verifyCerts, proxies, itemPageReader([itemCode]))
+                    if getItemResponse.status_code == 200:
+                        with readLock:
+                            for pageCode, value in getItemResponse.itemValues.items():
+                                if pageCode in wantedSet:
+                                    itemValues.setdefault(pageCode, value)
+                except requests.exceptions.RequestException as e:
+                    itemErrors[itemCode] = classifyRequestError(e)
+            itemCode = nextCode()
+    workers = max(1, min(concurrency, len(wantedCodes)))
+    if workers == 1:
+        readWorker()
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for readFuture in [executor.submit(readWorker) for i in range(workers)]:
+                readFuture.result()
+    return dict((itemCode, itemValues.get(itemCode)) for itemCode in wantedCodes), itemErrors
+
+# Read every readable setting of the given registry sections, and any extra
+# item codes. Returns section -> option -> value decoded to the module
+# option's type, item code -> raw value for the extra codes, item code ->
+# error kind for failed reads and the item codes the phone did not show.
+# Secrets and settings sharing another's item code are never shown by the
+# phone, so they are not read. Values come from the assumed get= read, see
+# getSingleItemQuery.
+def readSettings(hostName, sessionId, sections, itemCodes, verifyCerts, proxies=None, concurrency=2):
+    sectionItems = [(section, option, registryItem) for section in sections
+                    for option, registryItem in sorted(itemCodeRegistry[section].items()) if readableItem(registryItem)]
+    itemValues, itemErrors = readItems(hostName, sessionId, [registryItem.itemCode for section, option, registryItem in sectionItems] + list(itemCodes),
+                                       verifyCerts, proxies, concurrency)
+    settings = dict((section, {}) for section in sections)
+    for section, option, registryItem in sectionItems:
+        value = itemValues.get(registryItem.itemCode)
+        settings[section][option] = None if value is None else valueDecoders[registryItem.valueType](value)
+    rawItems = dict((itemCode.lower(), itemValues.get(itemCode.lower())) for itemCode in itemCodes)
+    missingCodes = [itemCode for itemCode, value in itemValues.items() if value is None and itemCode not in itemErrors]
+    return settings, rawItems, itemErrors, missingCodes
+
 # Set single paramater on phone
 def setSingleItem(hostName, sessionId, parameter, value, bypassProxy, verifyCerts, proxies=proxies):
 	if (bypassProxy):
 		pass
-	setParameterResponse = requests.get(hostName + '/index.cgi?session={}&set={}&item={}'.format(sessionId, parameter, value), verify=verifyCerts, proxies=proxies)
+	setParameterResponse = phoneRequest(hostName, setSingleItemQuery(sessionId, parameter, value), verifyCerts, proxies)
 	return setParameterResponse
 
 # Set single paramater on phone
 def setTwoParameters(hostName, sessionId, parameter, value, paramTwoKey, paramTwoValue, bypassProxy, verifyCerts, proxies=proxies):
 	if (bypassProxy):
 		pass
-	setTwoParameters = requests.get(hostName + '/index.cgi?session={}&set={}&item={}&{}={}'.format(sessionId, parameter, value, paramTwoKey, paramTwoValue), verify=verifyCerts, proxies=proxies)
+	setTwoParameters = phoneRequest(hostName, setTwoParametersQuery(sessionId, parameter, value, paramTwoKey, paramTwoValue), verifyCerts, proxies)
 	return setTwoParameters
 
+# One item write in a write plan. paramTwoKey/paramTwoValue add a companion
+# parameter such as type=ip. Secret values are left out of messages.
+# sharedCode items cannot be read back, the phone shows another item's
+# value under their code.
+WriteItem = namedtuple('WriteItem', ['itemCode', 'value', 'paramTwoKey', 'paramTwoValue', 'label', 'secret', 'sharedCode'], defaults=(None, None, None, False, False))
+
+# Encoders from module option values to the values the phone stores
+def encodeBool(value):
+    return '1' if value else '0'
+
+def encodeInvertedBool(value):
+    return '0' if value else '1'
+
+def enumEncoder(enumValues, defaultValue):
+    return lambda value: enumValues.get(value, defaultValue)
+
+portSpeeds = {'auto': '0', '100full': '1', '100half': '2', '10full': '3', '10half': '4'}
+spareIpModes = {'disable': '0', 'spare': '1', 'backup': '2'}
+sipAccessModes = {'normal': '0', 'remote': '1'}
+
+# Decoders from values the phone stores back to module option values, None
+# for a value that does not decode, such as an empty input
+def decodeBool(value):
+    return {'1': True, '0': False}.get(value)
+
+def decodeInvertedBool(value):
+    return {'0': True, '1': False}.get(value)
+
+def decodeInt(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+def enumDecoder(enumValues):
+    optionValues = dict((storedValue, optionValue) for optionValue, storedValue in enumValues.items())
+    return lambda value: optionValues.get(value)
+
+# Value type -> (encoder, companion parameter key, companion parameter value)
+valueTypes = {
+    'bool': (encodeBool, None, None),
+    'bool_inverted': (encodeInvertedBool, None, None),
+    'int': (str, None, None),
+    'ip': (str, 'type', 'ip'),
+    'port': (str, 'port', 'int'),
+    'port_speed': (enumEncoder(portSpeeds, '0'), None, None),
+    'secret': (str, None, None),
+    'sip_access_mode': (enumEncoder(sipAccessModes, '0'), None, None),
+    'spare_ip_mode': (enumEncoder(spareIpModes, '0'), None, None),
+    'str': (str, None, None),
+}
+
+# Value type -> decoder, for reading settings back
+valueDecoders = {
+    'bool': decodeBool,
+    'bool_inverted': decodeInvertedBool,
+    'int': decodeInt,
+    'ip': str,
+    'port': str,
+    'port_speed': enumDecoder(portSpeeds),
+    'secret': str,
+    'sip_access_mode': enumDecoder(sipAccessModes),
+    'spare_ip_mode': enumDecoder(spareIpModes),
+    'str': str,
+}
+
+# Every setting the modules know about: section, module option, item code, value type, label
+itemCodeTable = (
+    ('lan_port', 'default_gateway', '4020403', 'ip', 'Default gateway'),
+    ('lan_port', 'dhcp_mode', '4020401', 'bool', 'DHCP mode'),
+    ('lan_port', 'dns_address', '4020405', 'ip', 'DNS address'),
+    ('lan_port', 'ip_address', '4020402', 'ip', 'IP address'),
+    ('lan_port', 'lldp_mode', '44604f3', 'bool', 'LLDP mode'),
+    ('lan_port', 'port_speed', '41d044d', 'port_speed', 'Port speed'),
+    ('lan_port', 'spare_default_gateway', '4442002', 'ip', 'Spare default gateway'),
+    ('lan_port', 'spare_dns_address', '4442004', 'ip', 'Spare DNS address'),
+    ('lan_port', 'spare_ip_address', '4442001', 'ip', 'Spare IP address'),
+    ('lan_port', 'spare_ip_address_mode', '44304f2', 'spare_ip_mode', 'Spare IP address mode'),
+    ('lan_port', 'spare_subnet_mask', '4442003', 'ip', 'Spare subnet mask'),
+    ('lan_port', 'subnet_mask', '4020404', 'ip', 'Subnet mask'),
+    ('lan_port', 'vlan_id', '41d044f', 'int', 'VLAN ID'),
+    ('lan_port', 'vlan_mode', '41d044e', 'bool', 'VLAN mode'),
+    ('lan_port', 'vlan_priority', '41d0450', 'int', 'VLAN priority'),
+    ('pc_port', 'eapol_forwarding', '41e0456', 'bool', 'EAPOL forwarding'),
+    # The phone stores this inverted: 1 disables the PC port
+    ('pc_port', 'port_available', '41e0455', 'bool_inverted', 'Port available'),
+    ('pc_port', 'port_security', '41e0415', 'bool', 'Port security'),
+    ('pc_port', 'port_speed', '41e0451', 'port_speed', 'Port speed'),
+    ('pc_port', 'vlan_id', '41e0453', 'int', 'VLAN ID'),
+    ('pc_port', 'vlan_mode', '41e0452', 'bool', 'VLAN mode'),
+    ('pc_port', 'vlan_priority', '41e0454', 'int', 'VLAN priority'),
+    ('voip', 'encryption_auth_mode', '40d0427', 'bool', 'Encryption auth mode'),
+    ('voip', 'encryption_otp', '40d0428', 'secret', 'Encryption OTP'),
+    ('voip', 'sip_access_mode', '4030406', 'sip_access_mode', 'SIP access mode'),
+    ('voip', 'sip_backup_login', '40a04ca', 'bool', 'SIP backup login'),
+    ('voip', 'sip_extension', '40a041a', 'str', 'SIP extension'),
+    ('voip', 'sip_password', '40a0419', 'secret', 'SIP password'),
+    ('voip', 'sip_server_one', '40b041b', 'ip', 'SIP server one'),
+    ('voip', 'sip_server_two', '40b041c', 'ip', 'SIP server two'),
+    ('voip', 'sip_server_three', '40b041d', 'ip', 'SIP server three'),
+    ('voip', 'sip_server_four', '40b041e', 'ip', 'SIP server four'),
+    ('voip', 'sip_server_one_port', '40c0423', 'port', 'SIP server one port'),
+    # The phone takes the ports of SIP servers two to four on the server's own
+    # item code with a port=int companion parameter. Its item page shows only
+    # the server under the code, so these are marked sharedCode and not read.
+    ('voip', 'sip_server_two_port', '40b041c', 'port', 'SIP server two port'),
+    ('voip', 'sip_server_three_port', '40b041d', 'port', 'SIP server three port'),
+    ('voip', 'sip_server_four_port', '40b041e', 'port', 'SIP server four port'),
+    ('voip', 'sip_user_id', '40a0418', 'str', 'SIP user ID'),
+)
+
+# Parameters passed with passSingleParameter rather than set/item
+passParameterCodes = {
+    'data_clear': '4110430',
+    'hard_reset': '4040408',
+}
+
+# A registry entry with its encoder resolved. sharedCode marks an entry
+# whose item code an earlier entry already uses with another companion
+# parameter; the phone shows the earlier entry's value under the code.
+ItemCode = namedtuple('ItemCode', ['itemCode', 'valueType', 'encode', 'paramTwoKey', 'paramTwoValue', 'label', 'secret', 'sharedCode'])
+
+# Build section -> option -> ItemCode once at import
+def buildItemCodeRegistry(itemCodeRows):
+    registry = {}
+    seenCodes = set()
+    for section, option, itemCode, valueType, label in itemCodeRows:
+        encode, paramTwoKey, paramTwoValue = valueTypes[valueType]
+        registry.setdefault(section, {})[option] = ItemCode(itemCode, valueType, encode, paramTwoKey, paramTwoValue, label, valueType == 'secret', itemCode in seenCodes)
+        seenCodes.add(itemCode)
+    return registry
+
+# Whether the phone shows a registry entry's own value on its item page
+def readableItem(registryItem):
+    return not registryItem.secret and not registryItem.sharedCode
+
+itemCodeRegistry = buildItemCodeRegistry(itemCodeTable)
+phoneVariables['configurationItemCodes'] = itemCodeRegistry
+
+# Module argument spec for each value type, used for per-section suboptions
+valueTypeArguments = {
+    'bool': dict(type='bool'),
+    'bool_inverted': dict(type='bool'),
+    'int': dict(type='int'),
+    'ip': dict(type='str'),
+    'port': dict(type='str'),
+    'port_speed': dict(type='str', choices=list(portSpeeds)),
+    'secret': dict(type='str', no_log=True),
+    'sip_access_mode': dict(type='str', choices=list(sipAccessModes)),
+    'spare_ip_mode': dict(type='str', choices=list(spareIpModes)),
+    'str': dict(type='str'),
+}
+
+# Options whose valid values are narrower than their value type
+optionChoices = {
+    'vlan_priority': [0, 1, 2, 3, 4, 5, 6, 7],
+}
+
+# Argument spec for one registry section, every option optional
+def sectionArgumentSpec(section):
+    argumentSpec = {}
+    for option, itemCode in itemCodeRegistry[section].items():
+        argumentSpec[option] = dict(valueTypeArguments[itemCode.valueType], required=False)
+        if option in optionChoices:
+            argumentSpec[option]['choices'] = optionChoices[option]
+    return argumentSpec
+
+# Names used for registry sections in labels and summaries
+sectionTitles = {
+    'lan_port': 'LAN port',
+    'pc_port': 'PC port',
+    'voip': 'VoIP',
+}
+
+# Write item for one setting value
+def encodeSetting(section, option, value):
+    registryItem = itemCodeRegistry[section][option]
+    return WriteItem(registryItem.itemCode, registryItem.encode(value), registryItem.paramTwoKey, registryItem.paramTwoValue, registryItem.label, registryItem.secret, registryItem.sharedCode)
+
+# Write items for every registry setting of a section present in options
+def writeItemsFromOptions(section, options):
+    writeItems = []
+    for option in itemCodeRegistry[section]:
+        value = options.get(option)
+        if value is not None and value != '':
+            writeItems.append(encodeSetting(section, option, value))
+    return writeItems
+
+# Order and de-duplicate write items. Items are grouped by item code, which
+# keeps each web UI menu together; a later write to the same item and
+# companion parameter replaces an earlier one.
+def buildWritePlan(writeItems):
+    planItems = {}
+    for writeItem in writeItems:
+        planItems[(writeItem.itemCode, writeItem.paramTwoKey)] = writeItem
+    return [planItems[key] for key in sorted(planItems, key=lambda key: (key[0], key[1] or ''))]
+
+# Labels of plan items written to the same item code with different
+# companion parameters, such as a SIP server and its port. Both are sent;
+# the item page shows only one value per code, so whether the phone kept
+# both cannot be checked.
+def sharedCodeConflicts(writePlan):
+    codeItems = {}
+    for writeItem in writePlan:
+        codeItems.setdefault(writeItem.itemCode, []).append(writeItem)
+    return [[writeItem.label or writeItem.itemCode for writeItem in sorted(writeItems, key=lambda writeItem: writeItem.sharedCode)]
+            for itemCode, writeItems in sorted(codeItems.items()) if len(writeItems) > 1]
+
+# Read current values for the items in a plan, (item code, companion
+# parameter key) -> value or None, over readItems so pages are read in
+# parallel and items a page already showed are not asked for again. Items
+# the phone does not show back (secrets, items sharing another's code) are
+# not read. If a phone does not answer the assumed get= read (see
+# getSingleItemQuery) every item reads as None and is sent.
+def readPlanValues(hostName, sessionId, writePlan, verifyCerts, proxies=False, concurrency=2):
+    readablePlan = [writeItem for writeItem in writePlan if not writeItem.secret and not writeItem.sharedCode]
+    itemValues, itemErrors = readItems(hostName, sessionId, [writeItem.itemCode for writeItem in readablePlan], verifyCerts, proxies, concurrency)
+    return dict(((writeItem.itemCode, writeItem.paramTwoKey), itemValues.get(writeItem.itemCode.lower())) for writeItem in readablePlan)
+
+# Split a plan into items to send, items already set and items left out
+# unverified. Readable items are sent if they differ or could not be read.
+# Items the phone does not show back cannot be compared, so they are sent
+# along with readable changes, which cost the save and reboot anyway, but
+# alone only with writeUnreadable; otherwise they are left out unverified.
+def diffWritePlan(writePlan, currentValues, writeUnreadable=False):
+    changedItems = []
+    unchangedItems = []
+    unreadableItems = []
+    for writeItem in writePlan:
+        if writeItem.secret or writeItem.sharedCode:
+            unreadableItems.append(writeItem)
+            continue
+        currentValue = currentValues.get((writeItem.itemCode, writeItem.paramTwoKey))
+        if currentValue is not None and currentValue == writeItem.value:
+            unchangedItems.append(writeItem)
+        else:
+            changedItems.append(writeItem)
+    if not changedItems and not writeUnreadable:
+        return [], unchangedItems, unreadableItems
+    return [writeItem for writeItem in writePlan if writeItem not in unchangedItems], unchangedItems, []
+
+# Read before write: keep only the plan items to send, see diffWritePlan
+def planChanges(hostName, sessionId, writePlan, verifyCerts, proxies=False, writeUnreadable=False):
+    return diffWritePlan(writePlan, readPlanValues(hostName, sessionId, writePlan, verifyCerts, proxies), writeUnreadable)
+
+# Send one write plan item
+def applyWriteItem(hostName, sessionId, writeItem, verifyCerts, proxies=False):
+    if writeItem.paramTwoKey:
+        return setTwoParameters(hostName, sessionId, writeItem.itemCode, writeItem.value, writeItem.paramTwoKey, writeItem.paramTwoValue, False, verifyCerts, proxies)
+    return setSingleItem(hostName, sessionId, writeItem.itemCode, writeItem.value, False, verifyCerts, proxies)
+
+# Result entry for one write plan item, before it is sent
+def writeItemResult(writeItem):
+    return {
+        'item': writeItem.itemCode,
+        'label': writeItem.label or writeItem.itemCode,
+        'value': '********' if writeItem.secret else writeItem.value,
+        'ok': False,
+        'status_code': None,
+    }
+
+# Apply a write plan over an open session, returning one result per item
+def applyWritePlan(hostName, sessionId, writePlan, verifyCerts, proxies=False):
+    itemResults = []
+    for writeItem in writePlan:
+        itemResult = writeItemResult(writeItem)
+        if deadlineExceeded(hostName):
+            # Out of time for this host: abandon the rest of the plan unsent
+            itemResult['error'] = 'host deadline exceeded'
+            itemResult['error_kind'] = 'deadline'
+            itemResult['abandoned'] = True
+            itemResults.append(itemResult)
+            continue
+        startTime = time.time()
+        try:
+            writeResponse = applyWriteItem(hostName, sessionId, writeItem, verifyCerts, proxies)
+            itemResult['status_code'] = writeResponse.status_code
+            itemResult['ok'] = writeResponse.status_code == 200
+        except requests.exceptions.RequestException as e:
+            itemResult['error'] = str(e)
+            itemResult['error_kind'] = classifyRequestError(e)
+        itemResult['elapsed'] = round(time.time() - startTime, 4)
+        itemResults.append(itemResult)
+    return itemResults
+
+# Message lines for write plan results, in the style of the modules' messages
+def writePlanMessages(itemResults):
+    messages = []
+    for itemResult in itemResults:
+        if itemResult.get('check_mode'):
+            messages.append('Would set {} to {}'.format(itemResult['label'], itemResult['value']))
+        elif itemResult['ok']:
+            messages.append('{} set to {}'.format(itemResult['label'], itemResult['value']))
+        elif itemResult.get('abandoned'):
+            messages.append('Abandoned {} at host deadline'.format(itemResult['label']))
+        else:
+            messages.append('Failed to set {}'.format(itemResult['label']))
+    return messages
+
+# Log on (unless a session is given or cached), apply the plan and log off
+# once, which reboots the phone a single time for the whole plan. With
+# readBeforeWrite only changed items are sent and the phone is not rebooted
+# if none are; items the phone does not show back only count as changed
+# with writeUnreadable. With deferReboot the session and its unsaved writes are left
+# for rolling_reboot to log off instead. In checkMode nothing is written: the
+# items that would be sent are reported, marked check_mode, and the session is
+# left open as when nothing changed. Returns the plan result, the items sent
+# and the items left out as already set.
+def runWritePlan(hostName, logOnName, logOnPassword, writePlan, verifyCerts, sessionId='', keepSession=False, proxies=False, readBeforeWrite=False,
+                 sessionCache=False, sessionTtl=300, deferReboot=False, writeUnreadable=False, checkMode=False):
+    planResult = {'changed': False, 'failed': True, 'items': [], 'unchanged': [], 'unverified': [], 'rebooted': False}
+    unchangedItems = []
+    try:
+        if not sessionId and sessionCache:
+            # Reuse a session left open by an earlier task against this phone
+            sessionId = getCachedSession(hostName, verifyCerts, sessionTtl, proxies)
+        if not sessionId:
+            requireCredentials(hostName, logOnName, logOnPassword)
+            logOnResponse, sessionId = logOnPhone(hostName, logOnName, logOnPassword, False, verifyCerts, proxies)
+            requireSession(hostName, logOnResponse, sessionId)
+            if logOnResponse.status_code != 200:
+                return planResult, [], unchangedItems
+        if readBeforeWrite:
+            # Only send items whose value on the phone differs
+            writePlan, unchangedItems, unverifiedItems = planChanges(hostName, sessionId, writePlan, verifyCerts, proxies, writeUnreadable)
+            planResult['unchanged'] = [writeItem.label or writeItem.itemCode for writeItem in unchangedItems]
+            planResult['unverified'] = [writeItem.label or writeItem.itemCode for writeItem in unverifiedItems]
+        if checkMode:
+            planResult['items'] = [dict(writeItemResult(writeItem), ok=True, check_mode=True) for writeItem in writePlan]
+            planResult['failed'] = False
+            planResult['changed'] = bool(writePlan)
+            if keepSession:
+                planResult['session_id'] = sessionId
+            if sessionCache:
+                storeSession(hostName, sessionId)
+            return planResult, writePlan, unchangedItems
+        planResult['items'] = applyWritePlan(hostName, sessionId, writePlan, verifyCerts, proxies)
+        planResult['failed'] = not all(itemResult['ok'] for itemResult in planResult['items'])
+        planResult['changed'] = any(not itemResult.get('abandoned') for itemResult in planResult['items'])
+        planResult['abandoned'] = [itemResult['label'] for itemResult in planResult['items'] if itemResult.get('abandoned')]
+        if deferReboot and not keepSession and planResult['changed']:
+            # Keep the session and its unsaved writes for rolling_reboot to log off
+            queueReboot(hostName, sessionId)
+            if sessionCache:
+                storeSession(hostName, sessionId)
+            planResult['reboot_deferred'] = True
+        elif not keepSession and (planResult['changed'] or not readBeforeWrite):
+            # Save what was written even if the deadline has passed, the logoff
+            # is still bounded by the request timeouts
+            clearHostDeadline(hostName)
+            logOffResponse = logOffPhone(hostName, sessionId, False, verifyCerts, proxies)
+            planResult['rebooted'] = True
+            if logOffResponse.status_code != 200:
+                planResult['failed'] = True
+        else:
+            # Nothing changed or session kept: leave the session open, no reboot
+            if keepSession:
+                planResult['session_id'] = sessionId
+            if sessionCache:
+                storeSession(hostName, sessionId)
+    except PhoneRequestError as e:
+        # Classified failure after retries, or the phone's circuit is open
+        planResult['failed'] = True
+        planResult['msg'] = str(e)
+        planResult['error_kind'] = e.kind
+    return planResult, writePlan, unchangedItems
+
+# Apply the connection, timeout, metrics and deadline options the modules
+# share to a task against params['host'], and return the host name with its
+# scheme. poolSize raises the connection pool for reads run in parallel.
+def configureHostTask(params, poolSize=None):
+    if params['force_http']:
+        hostName = 'http://' + params['host']
+    else:
+        hostName = 'https://' + params['host']
+    # Remember per phone whether HTTPS works so later tasks skip the failed handshake
+    configureProtocolFallback(params['insecure_secondary'] and not params['force_http'], True)
+    # Bound each request and the task as a whole
+    configureTimeouts(params['connect_timeout'], params['read_timeout'])
+    if poolSize:
+        configurePool(poolMaxSize=max(phoneVariables['system']['poolMaxSize'], poolSize))
+    if params['metrics_file']:
+        configureMetrics(True)
+    setHostDeadline(hostName, params['host_deadline'])
+    return hostName
+
+# Session for a reading module's task: session_id, a cached session or a new
+# logon. Returns the session id and the logon page text, None if no logon
+# was made. Raises PhoneRequestError if the phone cannot be logged on.
+def openReadSession(hostName, params):
+    sessionId = params['session_id']
+    if not sessionId and params['session_cache']:
+        sessionId = getCachedSession(hostName, params['verify_certs'], params['session_ttl'], False)
+    if sessionId:
+        return sessionId, None
+    requireCredentials(hostName, params['username'], params['password'])
+    logOnResult = logOnPhoneResult(hostName, params['username'], params['password'], params['verify_certs'], False)
+    return requireSession(hostName, logOnResult.response, logOnResult.sessionId), logOnResult.pageText
+
+# Run the write items of a settings module's task against its phone, with
+# the connection, session and reboot options the set modules share, and
+# return the task result with the items sent and the items already set. A
+# failed request leaves its message in result['msg']. params['check_mode'],
+# set by run_module or the action plugin rather than by the user, runs the
+# task in check mode.
+def runModuleWriteTask(params, writeItems):
+    result = dict(
+        original_message = params['host'],
+        message = []
+    )
+
+    hostName = configureHostTask(params)
+    writePlan = buildWritePlan(writeItems)
+    conflicts = sharedCodeConflicts(writePlan)
+    if conflicts:
+        result['warnings'] = ['{} are written to the same item code on the phone, check that it kept both'.format(
+            ' and '.join(labels)) for labels in conflicts]
+
+    planResult, writePlan, unchangedItems = runWritePlan(
+        hostName, params['username'], params['password'], writePlan, params['verify_certs'],
+        params['session_id'], params['keep_session'], False, params['read_before_write'],
+        params['session_cache'], params['session_ttl'], params['defer_reboot'], params.get('write_unreadable', False),
+        params.get('check_mode', False))
+    result.update(planResult)
+    result['message'].extend(writePlanMessages(planResult['items']))
+    if not params['read_before_write']:
+        del result['unchanged']
+        del result['unverified']
+
+    if params['metrics_file']:
+        writeMetrics(params['metrics_file'], merge=True)
+
+    return result, writePlan, unchangedItems
+
 def main():
     print('\n\tDo not run me.\n\tImport me.\n')
 
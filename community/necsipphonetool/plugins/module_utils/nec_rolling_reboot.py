@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Rolling reboots: release deferred phone reboots in waves, N phones at a
+# time or per subnet. Every phone in a wave is rebooted together, then the
+# wave waits until each phone has gone down and answers index.cgi again
+# before the next wave starts, so PoE, DHCP and the SIP registrar see one
+# wave of phones come back at a time.
+
+import concurrent.futures
+import ipaddress
+import time
+
+try:
+    from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import (
+        PhoneRequestError,
+        clearPendingReboot,
+        closePhoneSession,
+        invalidateSession,
+        logOffPhone,
+        passParameterCodes,
+        passSingleParameter,
+        recordSuccess,
+        requests,
+        sendPhoneRequest,
+        sessionIsValid,
+        splitHostName,
+        traceSpan,
+    )
+except ImportError:
+    from nec_phone_tool import (
+        PhoneRequestError,
+        clearPendingReboot,
+        closePhoneSession,
+        invalidateSession,
+        logOffPhone,
+        passParameterCodes,
+        passSingleParameter,
+        recordSuccess,
+        requests,
+        sendPhoneRequest,
+        sessionIsValid,
+        splitHostName,
+        traceSpan,
+    )
+
+# Most phones rebooted and probed at once within a wave
+maxWaveWorkers = 64
+
+# Seconds between probes until a rebooted phone has been seen down, short so
+# a quick reboot is not missed between probes
+downPollInterval = 1
+
+# Subnet of a host, None for names that are not IP addresses
+def hostSubnet(host, subnetPrefix):
+    host = splitHostName(host)[1]
+    address = host.rsplit(':', 1)[0] if host.count(':') == 1 else host
+    try:
+        return str(ipaddress.ip_network('{}/{}'.format(address, subnetPrefix), strict=False))
+    except ValueError:
+        return None
+
+# Split hosts into waves: runs of waveSize, or one group per subnet split
+# into runs of waveSize. A waveSize of 0 puts a whole group in one wave.
+def rebootWaves(hosts, waveSize=10, waveBy='size', subnetPrefix=24):
+    groups = {}
+    for host in sorted(hosts):
+        group = hostSubnet(host, subnetPrefix) if waveBy == 'subnet' else None
+        groups.setdefault(group, []).append(host)
+    waves = []
+    for group in sorted(groups, key=lambda group: (group is None, group or '')):
+        groupHosts = groups[group]
+        step = waveSize or len(groupHosts)
+        for start in range(0, len(groupHosts), step):
+            waves.append((group, groupHosts[start:start + step]))
+    return waves
+
+# Send a pending reboot: logoff saves and reboots, hard_reset resets. The
+# deferred writes live in the queued session, so it is checked first: once
+# it has expired the phone would only show its logon form and save nothing,
+# and nosession is raised instead. The reboot is no longer pending either way.
+def sendReboot(pendingReboot, verifyCerts, proxies=None):
+    hostName = pendingReboot['hostName']
+    sessionId = pendingReboot.get('sessionId') or 'null'
+    if pendingReboot.get('sessionId') and not sessionIsValid(hostName, sessionId, verifyCerts, proxies):
+        clearPendingReboot(hostName)
+        invalidateSession(hostName)
+        raise PhoneRequestError('nosession', splitHostName(hostName)[1],
+                                'queued session expired before the reboot, its unsaved changes are lost; run the task that queued it again')
+    if pendingReboot.get('rebootKind') == 'hard_reset':
+        rebootResponse = passSingleParameter(hostName, sessionId, 'hard_reset', passParameterCodes['hard_reset'], False, verifyCerts, proxies)
+    else:
+        rebootResponse = logOffPhone(hostName, sessionId, False, verifyCerts, proxies)
+    clearPendingReboot(hostName)
+    return rebootResponse.status_code == 200
+
+# True if index.cgi answers, without retries so a rebooting phone shows as down
+def probePhone(hostName, verifyCerts, proxies=None, probeTimeout=3):
+    try:
+        probeResponse = sendPhoneRequest(hostName, '', verifyCerts, proxies, (probeTimeout, probeTimeout))
+        return probeResponse.status_code == 200
+    except requests.exceptions.RequestException:
+        return False
+    finally:
+        # A rebooting phone leaves dead keep-alive connections behind
+        closePhoneSession(hostName)
+
+# Wait for a phone to go down and answer again. Returns the seconds taken
+# and None, or None and why the phone is not known to be ready: a phone not
+# seen down within downTimeout may not have rebooted, and so may not have
+# saved its changes.
+def waitForPhone(hostName, verifyCerts, proxies=None, readyTimeout=300, pollInterval=5, downTimeout=15):
+    startTime = time.time()
+    wentDown = False
+    while time.time() - startTime < readyTimeout:
+        if not probePhone(hostName, verifyCerts, proxies):
+            wentDown = True
+        elif wentDown:
+            return time.time() - startTime, None
+        elif time.time() - startTime >= downTimeout:
+            return None, 'still answering {}s after the reboot was sent, not seen going down'.format(downTimeout)
+        interval = pollInterval if wentDown else min(pollInterval, downPollInterval)
+        time.sleep(max(0, min(interval, readyTimeout - (time.time() - startTime))))
+    if wentDown:
+        return None, 'did not answer again within {}s'.format(readyTimeout)
+    return None, 'not seen going down within {}s'.format(readyTimeout)
+
+# Reboot one phone and wait for it, returning its part of the wave result
+def rebootAndWait(pendingReboot, verifyCerts, proxies, readyTimeout, pollInterval, downTimeout):
+    hostResult = {'rebooted': False, 'ready': False, 'ready_seconds': None, 'error': None}
+    try:
+        hostResult['rebooted'] = sendReboot(pendingReboot, verifyCerts, proxies)
+    except requests.exceptions.RequestException as e:
+        hostResult['error'] = str(e)
+        return hostResult
+    if not hostResult['rebooted']:
+        return hostResult
+    with traceSpan('wait_ready', splitHostName(pendingReboot['hostName'])[1], 'reboot'):
+        readySeconds, hostResult['error'] = waitForPhone(pendingReboot['hostName'], verifyCerts, proxies, readyTimeout, pollInterval, downTimeout)
+    if readySeconds is not None:
+        hostResult['ready'] = True
+        hostResult['ready_seconds'] = round(readySeconds, 2)
+        # The phone is back, forget failures seen while it was down
+        recordSuccess(splitHostName(pendingReboot['hostName'])[1])
+    return hostResult
+
+# Release pending reboots (host -> hostName, sessionId, rebootKind) wave by
+# wave. report, if given, is called with each wave result as it finishes.
+# With haltOnNotReady a wave with phones that failed or did not come back
+# stops the run; the remaining reboots stay pending.
+def rollingReboot(pendingRebootsByHost, waveSize=10, waveBy='size', subnetPrefix=24, readyTimeout=300, pollInterval=5,
+                  downTimeout=15, verifyCerts=False, proxies=None, haltOnNotReady=True, report=None):
+    waveResults = []
+    waves = rebootWaves(list(pendingRebootsByHost), waveSize, waveBy, subnetPrefix)
+    for waveNumber, (group, waveHosts) in enumerate(waves, 1):
+        startTime = time.time()
+        with traceSpan('wave {}'.format(waveNumber), category='reboot', group=group, hosts=len(waveHosts)):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(waveHosts), maxWaveWorkers)) as executor:
+                hostResults = list(executor.map(
+                    lambda host: rebootAndWait(pendingRebootsByHost[host], verifyCerts, proxies, readyTimeout, pollInterval, downTimeout),
+                    waveHosts))
+        readySeconds = [hostResult['ready_seconds'] for hostResult in hostResults if hostResult['ready']]
+        waveResult = {
+            'wave': waveNumber,
+            'group': group,
+            'hosts': waveHosts,
+            'ready': [host for host, hostResult in zip(waveHosts, hostResults) if hostResult['ready']],
+            'not_ready': [host for host, hostResult in zip(waveHosts, hostResults) if hostResult['rebooted'] and not hostResult['ready']],
+            'failed': [host for host, hostResult in zip(waveHosts, hostResults) if not hostResult['rebooted']],
+            'errors': dict((host, hostResult['error']) for host, hostResult in zip(waveHosts, hostResults) if hostResult['error']),
+            'seconds': round(time.time() - startTime, 2),
+            'slowest_ready_seconds': max(readySeconds) if readySeconds else None,
+        }
+        waveResults.append(waveResult)
+        if report:
+            report(waveResult)
+        if haltOnNotReady and (waveResult['not_ready'] or waveResult['failed']) and waveNumber < len(waves):
+            waveResult['halted'] = True
+            break
+    return waveResults
+
+def main():
+    print('\n\tDo not run me.\n\tImport me.\n')
+
+# run main if not imported
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# On-disk store of phone configuration snapshots, in SQLite. A config is a
+# dict of section -> key -> value, as read by readSettings. Storage is
+# content addressed at two levels: each distinct section content is stored
+# once, as the ids of its (key, value) settings, and each distinct config
+# is stored once as the ids of its sections. Phones of a site differ in a
+# few settings such as their address, so a section is stored as the
+# settings that differ from a base section of the same name when that is
+# at most half of them. A phone's history keeps a row only when its config
+# changed. Indexes from settings to sections to configs to hosts answer
+# "which phones have X" without reading any config. The last drift check of
+# each host is kept with the hashes it was made against, so a host whose
+# config and desired state have not changed need not be checked again.
+#
+# A phone is known by its MAC address when one is given and by host name
+# otherwise. A phone seen at a new address keeps its history, and a phone
+# whose address another phone has taken is kept with no host name.
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+# Schema version, kept in the file's user_version
+storeVersion = 2
+
+storeSchema = '''
+CREATE TABLE IF NOT EXISTS settings (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    UNIQUE (key, value)
+);
+CREATE TABLE IF NOT EXISTS sections (
+    id INTEGER PRIMARY KEY,
+    hash BLOB NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    base_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS sections_base ON sections (base_id);
+CREATE TABLE IF NOT EXISTS section_settings (
+    section_id INTEGER NOT NULL,
+    setting_id INTEGER NOT NULL,
+    PRIMARY KEY (section_id, setting_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS section_settings_setting ON section_settings (setting_id);
+CREATE TABLE IF NOT EXISTS configs (
+    id INTEGER PRIMARY KEY,
+    hash BLOB NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS config_sections (
+    config_id INTEGER NOT NULL,
+    section_id INTEGER NOT NULL,
+    PRIMARY KEY (config_id, section_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS config_sections_section ON config_sections (section_id);
+CREATE TABLE IF NOT EXISTS hosts (
+    id INTEGER PRIMARY KEY,
+    host TEXT UNIQUE,
+    mac TEXT,
+    config_id INTEGER,
+    first_seen REAL,
+    last_seen REAL
+);
+CREATE INDEX IF NOT EXISTS hosts_mac ON hosts (mac);
+CREATE INDEX IF NOT EXISTS hosts_config ON hosts (config_id);
+CREATE TABLE IF NOT EXISTS snapshots (
+    host_id INTEGER NOT NULL,
+    taken REAL NOT NULL,
+    config_id INTEGER NOT NULL,
+    PRIMARY KEY (host_id, taken)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS checks (
+    host_id INTEGER PRIMARY KEY,
+    checked REAL NOT NULL,
+    desired_hash BLOB NOT NULL,
+    config_id INTEGER NOT NULL,
+    drift TEXT NOT NULL
+);
+'''
+
+# A delta section lists a key of its base it does not have with this
+# stored text, which no JSON text is, and removedValue in memory. Values
+# are compared with the marker by identity, so '' stays a value.
+removedText = ''
+removedValue = object()
+
+# Values are kept as JSON so types survive, and hashed in a canonical form
+def canonicalJson(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+def sectionDigest(name, sectionValues):
+    return hashlib.sha256(canonicalJson([name, sectionValues]).encode('utf-8')).digest()
+
+def configDigest(sectionDigests):
+    return hashlib.sha256(b''.join(sorted(sectionDigests))).digest()
+
+# Content hash of a config, as the store reports it. Configs with the same
+# settings hash the same however they were built, so a desired state can be
+# hashed and looked up.
+def configHash(config):
+    return configDigest([sectionDigest(name, sectionValues) for name, sectionValues in config.items()]).hex()
+
+# Content hash of one section of a config
+def sectionHash(name, sectionValues):
+    return sectionDigest(name, sectionValues).hex()
+
+# MAC address in lower case with colons if value is one, else value as is
+def macKey(value):
+    if value and re.match(r'^[0-9A-Fa-f]{2}([:-]?[0-9A-Fa-f]{2}){5}$', value):
+        hexDigits = re.sub(r'[^0-9a-f]', '', value.lower())
+        return ':'.join(hexDigits[i:i + 2] for i in range(0, 12, 2))
+    return value
+
+
+class SnapshotStore(object):
+    # Snapshot store in one SQLite file. Several processes may write to it,
+    # each waiting up to busyTimeout seconds for the others.
+    def __init__(self, storePath, busyTimeout=30):
+        self.storePath = os.path.expanduser(storePath)
+        storeDir = os.path.dirname(self.storePath)
+        if storeDir and not os.path.isdir(storeDir):
+            os.makedirs(storeDir, 0o700, exist_ok=True)
+        self.db = sqlite3.connect(self.storePath, timeout=busyTimeout, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            tableCount = self.db.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0]
+            fileVersion = self.db.execute('PRAGMA user_version').fetchone()[0]
+            if tableCount and fileVersion != storeVersion:
+                raise ValueError('{} was written by another version of the snapshot store'.format(self.storePath))
+            for statement in storeSchema.split(';'):
+                if statement.strip():
+                    self.db.execute(statement)
+            self.db.execute('PRAGMA user_version = {}'.format(storeVersion))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            self.db.close()
+            raise
+        # Ids already looked up, settings and sections never change once stored
+        self.settingIds = {}
+        self.sectionIds = {}
+        # Section name -> (id, values) of the full section new ones are based on
+        self.baseSections = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    # Id of a (key, value) setting, storing it if new
+    def settingId(self, key, value):
+        settingKey = (key, removedText if value is removedValue else canonicalJson(value))
+        settingId = self.settingIds.get(settingKey)
+        if settingId is None:
+            self.db.execute('INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)', settingKey)
+            settingId = self.db.execute('SELECT id FROM settings WHERE key = ? AND value = ?', settingKey).fetchone()[0]
+            self.settingIds[settingKey] = settingId
+        return settingId
+
+    # Id of a section by content, storing it if new
+    def sectionId(self, name, sectionValues, digest):
+        sectionId = self.sectionIds.get(digest)
+        if sectionId is not None:
+            return sectionId
+        row = self.db.execute('SELECT id FROM sections WHERE hash = ?', (digest,)).fetchone()
+        if row:
+            sectionId = row[0]
+        else:
+            baseId, storedValues = self.sectionDelta(name, sectionValues)
+            sectionId = self.db.execute('INSERT INTO sections (hash, name, base_id) VALUES (?, ?, ?)', (digest, name, baseId)).lastrowid
+            self.db.executemany('INSERT OR IGNORE INTO section_settings (section_id, setting_id) VALUES (?, ?)',
+                                [(sectionId, self.settingId(key, value)) for key, value in storedValues.items()])
+            if baseId is None:
+                self.baseSections[name] = (sectionId, sectionValues)
+        self.sectionIds[digest] = sectionId
+        return sectionId
+
+    # Base section id and the settings to store for a new section: what
+    # differs from the latest full section of the same name, or everything
+    # with no base if more than half of it differs
+    def sectionDelta(self, name, sectionValues):
+        if name not in self.baseSections:
+            row = self.db.execute('SELECT id FROM sections WHERE name = ? AND base_id IS NULL ORDER BY id DESC LIMIT 1', (name,)).fetchone()
+            self.baseSections[name] = (row[0], self.sectionValues(row[0])) if row else None
+        if self.baseSections[name] is None:
+            return None, sectionValues
+        baseId, baseValues = self.baseSections[name]
+        deltaValues = dict((key, value) for key, value in sectionValues.items() if key not in baseValues or baseValues[key] != value)
+        deltaValues.update((key, removedValue) for key in baseValues if key not in sectionValues)
+        if len(deltaValues) * 2 > len(sectionValues):
+            return None, sectionValues
+        return baseId, deltaValues
+
+    # key -> value of a stored section, with its base applied
+    def sectionValues(self, sectionId):
+        return self.sectionsValues([sectionId])[sectionId]
+
+    # Section id -> key -> value for stored sections, with bases applied
+    def sectionsValues(self, sectionIds):
+        sectionBases = {}
+        for sectionId, baseId in self.db.execute(
+                'SELECT id, base_id FROM sections WHERE id IN ({})'.format(','.join('?' * len(sectionIds))), list(sectionIds)):
+            sectionBases[sectionId] = baseId
+        storedIds = set(sectionBases) | set(baseId for baseId in sectionBases.values() if baseId is not None)
+        storedValues = dict((sectionId, {}) for sectionId in storedIds)
+        for sectionId, key, value in self.db.execute(
+                'SELECT section_settings.section_id, settings.key, settings.value FROM section_settings '
+                'JOIN settings ON settings.id = section_settings.setting_id '
+                'WHERE section_settings.section_id IN ({})'.format(','.join('?' * len(storedIds))), list(storedIds)):
+            storedValues[sectionId][key] = removedValue if value == removedText else json.loads(value)
+        sectionsValues = {}
+        for sectionId, baseId in sectionBases.items():
+            values = dict(storedValues[baseId]) if baseId is not None else {}
+            for key, value in storedValues[sectionId].items():
+                if value is removedValue:
+                    values.pop(key, None)
+                else:
+                    values[key] = value
+            sectionsValues[sectionId] = values
+        return sectionsValues
+
+    # Id of a config by content, storing it and its new sections if new
+    def configId(self, config):
+        sectionDigests = dict((name, sectionDigest(name, sectionValues)) for name, sectionValues in config.items())
+        digest = configDigest(sectionDigests.values())
+        row = self.db.execute('SELECT id FROM configs WHERE hash = ?', (digest,)).fetchone()
+        if row:
+            return row[0], digest
+        configId = self.db.execute('INSERT INTO configs (hash) VALUES (?)', (digest,)).lastrowid
+        self.db.executemany('INSERT INTO config_sections (config_id, section_id) VALUES (?, ?)',
+                            [(configId, self.sectionId(name, sectionValues, sectionDigests[name])) for name, sectionValues in config.items()])
+        return configId, digest
+
+    # Record one snapshot inside an open transaction. The phone is found by
+    # MAC address, then by host name unless that holds another MAC address.
+    def addSnapshot(self, host, config, taken, mac):
+        mac = macKey(mac) if mac else None
+        configId, digest = self.configId(config)
+        row = None
+        if mac:
+            row = self.db.execute('SELECT id, config_id FROM hosts WHERE mac = ?', (mac,)).fetchone()
+        if row is None:
+            row = self.db.execute('SELECT id, config_id FROM hosts WHERE host = ? AND (mac IS NULL OR mac = ? OR ? IS NULL)',
+                                  (host, mac, mac)).fetchone()
+        # Another phone at this address has moved on or been replaced
+        self.db.execute('UPDATE hosts SET host = NULL WHERE host = ? AND id != ?', (host, row[0] if row else -1))
+        if row is None:
+            hostId = self.db.execute('INSERT INTO hosts (host, mac, config_id, first_seen, last_seen) VALUES (?, ?, ?, ?, ?)',
+                                     (host, mac, configId, taken, taken)).lastrowid
+            changed = True
+        else:
+            hostId, lastConfigId = row
+            changed = lastConfigId != configId
+            self.db.execute('UPDATE hosts SET host = ?, config_id = ?, last_seen = ?, mac = COALESCE(?, mac) WHERE id = ?',
+                            (host, configId, taken, mac, hostId))
+        if changed:
+            self.db.execute('INSERT OR REPLACE INTO snapshots (host_id, taken, config_id) VALUES (?, ?, ?)', (hostId, taken, configId))
+        return digest.hex(), changed
+
+    # Store the config read from a host, keyed by MAC address if known and
+    # host name otherwise. Returns the config hash and whether it differs from the
+    # host's last snapshot.
+    def storeSnapshot(self, host, config, taken=None, mac=None):
+        return self.storeSnapshots([(host, config, mac)], taken)[0]
+
+    # Store many (host, config, mac) snapshots in one transaction, as a
+    # nightly sweep does. Returns (config hash, changed) per snapshot.
+    def storeSnapshots(self, snapshots, taken=None):
+        taken = time.time() if taken is None else taken
+        results = []
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            for host, config, mac in snapshots:
+                results.append(self.addSnapshot(host, config, taken, mac))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            # Ids cached during the failed transaction were not stored
+            self.settingIds.clear()
+            self.sectionIds.clear()
+            self.baseSections.clear()
+            raise
+        return results
+
+    # Config stored under a config hash, None if unknown
+    def config(self, configHashHex):
+        row = self.db.execute('SELECT id FROM configs WHERE hash = ?', (bytes.fromhex(configHashHex),)).fetchone()
+        if row is None:
+            return None
+        return self.configById(row[0])
+
+    def configById(self, configId):
+        sectionNames = dict(self.db.execute(
+            'SELECT sections.id, sections.name FROM config_sections JOIN sections ON sections.id = config_sections.section_id '
+            'WHERE config_sections.config_id = ?', (configId,)))
+        sectionsValues = self.sectionsValues(list(sectionNames))
+        return dict((name, sectionsValues[sectionId]) for sectionId, name in sectionNames.items())
+
+    # Host record by host name or MAC address, None if unknown
+    def hostRecord(self, hostOrMac):
+        return self.db.execute(
+            'SELECT hosts.id, hosts.host, hosts.mac, hosts.config_id, configs.hash, hosts.first_seen, hosts.last_seen '
+            'FROM hosts JOIN configs ON configs.id = hosts.config_id WHERE host = ? OR mac = ? LIMIT 1',
+            (hostOrMac, macKey(hostOrMac))).fetchone()
+
+    # Latest config of a host, by host name or MAC address, None if unknown
+    def latestConfig(self, hostOrMac):
+        hostRow = self.hostRecord(hostOrMac)
+        if hostRow is None:
+            return None
+        return self.configById(hostRow[3])
+
+    # Latest config hash of a host, None if unknown
+    def latestHash(self, hostOrMac):
+        hostRow = self.hostRecord(hostOrMac)
+        if hostRow is None:
+            return None
+        return hostRow[4].hex()
+
+    # Config changes of a host, oldest first, as (taken, config hash)
+    def history(self, hostOrMac):
+        hostRow = self.hostRecord(hostOrMac)
+        if hostRow is None:
+            return []
+        return [(taken, digest.hex()) for taken, digest in self.db.execute(
+            'SELECT snapshots.taken, configs.hash FROM snapshots JOIN configs ON configs.id = snapshots.config_id '
+            'WHERE snapshots.host_id = ? ORDER BY snapshots.taken', (hostRow[0],))]
+
+    # Hosts whose latest config has the given config hash or section hash
+    def hostsWithHash(self, hashHex):
+        digest = bytes.fromhex(hashHex)
+        return [host for (host,) in self.db.execute(
+            'SELECT host FROM hosts WHERE host IS NOT NULL AND config_id = (SELECT id FROM configs WHERE hash = ?) '
+            'UNION SELECT hosts.host FROM sections '
+            'JOIN config_sections ON config_sections.section_id = sections.id '
+            'JOIN hosts ON hosts.config_id = config_sections.config_id AND hosts.host IS NOT NULL WHERE sections.hash = ? ORDER BY 1',
+            (digest, digest))]
+
+    # Hosts whose latest config has value for key in section: sections that
+    # store the setting, and delta sections that take it from their base
+    # without storing another value for the key
+    def hostsWithSetting(self, section, key, value):
+        return [host for (host,) in self.db.execute(
+            'WITH direct AS ('
+            '  SELECT sections.id, sections.base_id FROM settings '
+            '  JOIN section_settings ON section_settings.setting_id = settings.id '
+            '  JOIN sections ON sections.id = section_settings.section_id AND sections.name = ? '
+            '  WHERE settings.key = ? AND settings.value = ?), '
+            'matching AS ('
+            '  SELECT id FROM direct '
+            '  UNION SELECT sections.id FROM sections JOIN direct ON sections.base_id = direct.id AND direct.base_id IS NULL '
+            '  WHERE NOT EXISTS (SELECT 1 FROM section_settings JOIN settings ON settings.id = section_settings.setting_id '
+            '                    WHERE section_settings.section_id = sections.id AND settings.key = ?)) '
+            'SELECT DISTINCT hosts.host FROM matching '
+            'JOIN config_sections ON config_sections.section_id = matching.id '
+            'JOIN hosts ON hosts.config_id = config_sections.config_id AND hosts.host IS NOT NULL ORDER BY hosts.host',
+            (section, key, canonicalJson(value), key))]
+
+    # Record a drift check of a host, which must have a snapshot, against
+    # a desired state: the hashes of both and the differences found
+    def storeCheck(self, host, desiredHashHex, configHashHex, drift, checked=None):
+        checked = time.time() if checked is None else checked
+        self.db.execute(
+            'INSERT OR REPLACE INTO checks (host_id, checked, desired_hash, config_id, drift) '
+            'SELECT hosts.id, ?, ?, configs.id, ? FROM hosts, configs WHERE hosts.host = ? AND configs.hash = ?',
+            (checked, bytes.fromhex(desiredHashHex), canonicalJson(drift), host, bytes.fromhex(configHashHex)))
+
+    # Last drift check of a host as (checked, desired hash, config hash,
+    # drift), None if it was never checked
+    def lastCheck(self, hostOrMac):
+        hostRow = self.hostRecord(hostOrMac)
+        if hostRow is None:
+            return None
+        row = self.db.execute(
+            'SELECT checks.checked, checks.desired_hash, configs.hash, checks.drift FROM checks '
+            'JOIN configs ON configs.id = checks.config_id WHERE checks.host_id = ?', (hostRow[0],)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1].hex(), row[2].hex(), json.loads(row[3])
+
+    # Latest config hash -> number of hosts on it, most common first
+    def configCounts(self):
+        return [(digest.hex(), hostCount) for digest, hostCount in self.db.execute(
+            'SELECT configs.hash, COUNT(*) FROM hosts JOIN configs ON configs.id = hosts.config_id '
+            'WHERE hosts.host IS NOT NULL GROUP BY hosts.config_id ORDER BY 2 DESC')]
+
+    # Row counts and file size, for reporting
+    def stats(self):
+        storeStats = {}
+        for table in ('hosts', 'snapshots', 'configs', 'sections', 'settings', 'checks'):
+            storeStats[table] = self.db.execute('SELECT COUNT(*) FROM {}'.format(table)).fetchone()[0]
+        pageCount = self.db.execute('PRAGMA page_count').fetchone()[0]
+        pageSize = self.db.execute('PRAGMA page_size').fetchone()[0]
+        storeStats['bytes'] = pageCount * pageSize
+        return storeStats
+
+def main():
+    print('\n\tDo not run me.\n\tImport me.\n')
+
+# run main if not imported
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,516 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: check_drift
+
+short_description: This module compares the settings of a NEC phone with a desired state and returns only the differences.
+
+version_added: "0.0.5"
+
+description:
+    - This module reads the LAN port, PC port and VoIP settings of a NEC-SIP IP phone named in a desired-state document, the one taken by nec_phone_config, and compares them with it. Nothing is changed on the phone.
+    - Only settings that differ are returned, and nec_drift holds their desired values in the shape nec_phone_config takes, so a remediation task only sends what drifted.
+    - With snapshot_store the settings read are kept as a snapshot of the phone and each check is recorded. A later check of a phone whose last snapshot and desired state are both unchanged since its last check is answered from the store without asking the phone, unless it is older than recheck_after or it is sampled. Snapshots taken by get_config count, so a nightly get_config sweep marks the phones that changed for a live check.
+    - Secrets such as the SIP password are never shown by the phone, so they are not compared. Neither are the ports of SIP servers two to four, which the phone keeps under the server's item code.
+    - Run it over the fleet with forks set high; phones are checked in parallel and ones answered from the store cost no requests.
+
+notes:
+    - The phone's web UI has no documented call to read a single setting. Settings are read with index.cgi?get=<item code>, assumed to return the settings page holding the item, as the emulator in module_utils/nec_phone_emulator.py does; this has not been confirmed on a real phone. A phone that answers it with any other page shows no values, so every setting reads as unknown.
+
+options:
+    concurrency:
+        description: Pages read from the phone at the same time. Phones handle only a few connections at once, keep this low.
+        required: false
+        type: int
+        default: 2
+    connect_timeout:
+        description: Seconds to wait for a connection to the phone before retrying or failing.
+        required: false
+        type: float
+        default: 10
+    force_http:
+        description: This option forces the use of HTTP instead of HTTPS.
+        required: false
+        type: bool
+    host:
+        description: IPv4 or hostname of phone.
+        required: true
+        type: str
+    host_deadline:
+        description: Overall seconds allowed for all requests to the phone in this task. Reads still pending when it runs out are reported as failed. No limit if not given.
+        required: false
+        type: float
+    insecure_secondary:
+        description: Use HTTP if the HTTPS connection to the phone fails. The protocol that worked is remembered on the controller per phone, so later tasks go straight to it.
+        required: false
+        type: bool
+        default: false
+    lan_port:
+        description: Desired LAN port settings, as taken by nec_phone_config and set_lan_port.
+        required: false
+        type: dict
+        suboptions:
+            default_gateway:
+                description: The default gateway for the phone.
+                type: str
+            dhcp_mode:
+                description: This is the DHCP mode for the phone.
+                type: bool
+            dns_address:
+                description: This is the DNS address for the phone.
+                type: str
+            ip_address:
+                description: This is the IP address for the phone.
+                type: str
+            lldp_mode:
+                description: This option sets the LLDP mode on the phone.
+                type: bool
+            port_speed:
+                description: This option sets the LAN port speed and duplex on the phone.
+                type: str
+                choices: ['auto', '100full', '100half', '10full', '10half']
+            spare_default_gateway:
+                description: The spare default gateway for the phone.
+                type: str
+            spare_dns_address:
+                description: This is the spare DNS address for the phone.
+                type: str
+            spare_ip_address:
+                description: This is the spare IP address for the phone.
+                type: str
+            spare_ip_address_mode:
+                description: This option sets the spare IP address mode on the phone.
+                type: str
+                choices: ['disable', 'spare', 'backup']
+            spare_subnet_mask:
+                description: This is the spare subnet mask for the phone.
+                type: str
+            subnet_mask:
+                description: This is the subnet mask for the phone.
+                type: str
+            vlan_id:
+                description: This option sets the VLAN ID on the LAN port.
+                type: int
+            vlan_mode:
+                description: This option sets the VLAN mode on the LAN port.
+                type: bool
+            vlan_priority:
+                description: This option sets the VLAN priority on the LAN port.
+                type: int
+                choices: [0, 1, 2, 3, 4, 5, 6, 7]
+    metrics_file:
+        description: Record the latency, bytes, status codes and retries of every request to the phone and add them to this file on the controller. Written as Prometheus text if the name ends in .prom, otherwise as JSON. A .prom file keeps its running totals in a .json file beside it.
+        required: false
+        type: path
+    password:
+        description: Password to log into phone. Required unless session_id is given or session_cache finds a session.
+        required: false
+        type: str
+    pc_port:
+        description: Desired PC port settings, as taken by nec_phone_config and set_pc_port.
+        required: false
+        type: dict
+        suboptions:
+            eapol_forwarding:
+                description: This option enables or disables EAPOL forwarding on the PC port.
+                type: bool
+            port_available:
+                description: This option sets the PC port to available.
+                type: bool
+            port_security:
+                description: This option sets PC port security.
+                type: bool
+            port_speed:
+                description: This option sets the PC port speed and duplex on the phone.
+                type: str
+                choices: ['auto', '100full', '100half', '10full', '10half']
+            vlan_id:
+                description: This option sets the VLAN ID on the PC port.
+                type: int
+            vlan_mode:
+                description: This option sets the VLAN mode on the PC port.
+                type: bool
+            vlan_priority:
+                description: This option sets the VLAN priority on the PC port.
+                type: int
+                choices: [0, 1, 2, 3, 4, 5, 6, 7]
+    profile_file:
+        description: Run the task under cProfile and add its stats to this pstats file on the controller, for finding where time goes outside the phone. Read it with python -m pstats.
+        required: false
+        type: path
+    read_timeout:
+        description: Seconds to wait for the phone to answer a request before retrying or failing.
+        required: false
+        type: float
+        default: 30
+    recheck_after:
+        description: Seconds after which a phone answered from the store is checked on the phone again, however unchanged it is.
+        required: false
+        type: int
+        default: 86400
+    refresh:
+        description: Check the phone even if the store could answer.
+        required: false
+        type: bool
+        default: false
+    sample_rate:
+        description: Fraction of the phones that could be answered from the store to check on the phone anyway, from 0 to 1, to catch changes made since their last snapshot.
+        required: false
+        type: float
+        default: 0
+    session_cache:
+        description: Reuse a session cached on the controller by an earlier task against the same phone, and cache the session of a new logon for later tasks.
+        required: false
+        type: bool
+        default: true
+    session_id:
+        description: Logon session ID to use for API calls. If not provided, a new logon session will be created.
+        required: false
+        type: str
+    session_ttl:
+        description: Seconds a cached session may sit unused before a new logon is made.
+        required: false
+        type: int
+        default: 300
+    snapshot_store:
+        description: SQLite file on the controller, as used by get_config, to keep snapshots and the result of each check in and to answer unchanged phones from.
+        required: false
+        type: path
+    trace_file:
+        description: Add a span for the task and for each request to the phone to this Chrome trace file on the controller. Open it in chrome://tracing or Perfetto to see the timeline of a run.
+        required: false
+        type: path
+    username:
+        description: Username to log into phone. Required unless session_id is given or session_cache finds a session.
+        required: false
+        type: str
+    verify_certs:
+        description: This option verifies the SSL certificate on the phone.
+        required: false
+        type: bool
+    voip:
+        description: Desired VoIP settings, as taken by nec_phone_config and set_voip.
+        required: false
+        type: dict
+        suboptions:
+            encryption_auth_mode:
+                description: Enable or disable encryption mode.
+                type: bool
+            encryption_otp:
+                description: Set encryption OTP.
+                type: str
+            sip_access_mode:
+                description: SIP access mode to set.
+                type: str
+                choices: ['normal', 'remote']
+            sip_backup_login:
+                description: Enable/disable SIP backup login.
+                type: bool
+            sip_extension:
+                description: SIP extension to set.
+                type: str
+            sip_password:
+                description: SIP password to set.
+                type: str
+            sip_server_one:
+                description: SIP server one to set.
+                type: str
+            sip_server_two:
+                description: SIP server two to set.
+                type: str
+            sip_server_three:
+                description: SIP server three to set.
+                type: str
+            sip_server_four:
+                description: SIP server four to set.
+                type: str
+            sip_server_one_port:
+                description: SIP server one port to set.
+                type: str
+            sip_server_two_port:
+                description: SIP server two port to set. Not compared, the phone keeps it under the item code of sip_server_two.
+                type: str
+            sip_server_three_port:
+                description: SIP server three port to set. Not compared, the phone keeps it under the item code of sip_server_three.
+                type: str
+            sip_server_four_port:
+                description: SIP server four port to set. Not compared, the phone keeps it under the item code of sip_server_four.
+                type: str
+            sip_user_id:
+                description: SIP user ID to set.
+                type: str
+author:
+    - Raymond Rizzo (@zombat)
+'''
+
+EXAMPLES = r'''
+    - name: Compare phones with their desired state
+      community.necsipphonetool.check_drift:
+        username: 'ADMIN'
+        password: '6633222'
+        host: "{{ inventory_hostname }}"
+        lan_port: "{{ nec_desired.lan_port | default(omit) }}"
+        voip: "{{ nec_desired.voip | default(omit) }}"
+        snapshot_store: ~/.ansible/necsipphonetool/snapshots.db
+        sample_rate: 0.05
+      delegate_to: localhost
+
+    - name: Put back only what drifted
+      community.necsipphonetool.nec_phone_config:
+        username: 'ADMIN'
+        password: '6633222'
+        host: "{{ inventory_hostname }}"
+        lan_port: "{{ nec_drift.lan_port | default(omit) }}"
+        voip: "{{ nec_drift.voip | default(omit) }}"
+        defer_reboot: true
+      delegate_to: localhost
+      when: nec_drift | length > 0
+'''
+
+RETURN = r'''
+ansible_facts:
+    description: Desired values of the settings that drifted.
+    returned: when the phone was compared
+    type: complex
+    contains:
+        nec_drift:
+            description: Section -> option -> desired value, for the settings that differ. Empty if the phone matches.
+            type: dict
+            sample: {'lan_port': {'vlan_id': 20}}
+changed:
+    description: Always false, nothing is changed on the phone
+    type: bool
+    returned: always
+    sample: 'False'
+checked:
+    description: Where the comparison came from, phone if the phone was read or store if the last check still held.
+    type: str
+    returned: when the phone was compared
+    sample: 'store'
+compliant:
+    description: True if no compared setting differs.
+    type: bool
+    returned: when the phone was compared
+    sample: 'False'
+drift:
+    description: Section -> option -> desired and actual value, for the settings that differ. Actual is null for settings the phone did not show.
+    type: dict
+    returned: when the phone was compared
+    sample: {'lan_port': {'vlan_id': {'desired': 20, 'actual': 30}}}
+error_kind:
+    description: Class of the request failure after retries, one of timeout, refused, tls, http5xx, nosession, bad_credentials, connection, circuit_open or deadline.
+    type: str
+    returned: when the phone could not be logged on to
+    sample: 'timeout'
+failed_items:
+    description: Item code -> error kind for reads that failed after retries. Settings that could not be read are not compared, and the check is not recorded.
+    type: dict
+    returned: when the phone was read
+    sample: {'40b041b': 'timeout'}
+original_message:
+    description: The original name param that was passed in.
+    type: str
+    returned: always
+    sample: '10.4.0.4'
+snapshot:
+    description: Content hash of the phone's config the comparison was made against.
+    type: str
+    returned: when snapshot_store is given and the check was recorded or answered from the store
+    sample: 'f4709de02f90dd2630a9ba5d3906c9572d2caacb64486592e4b5c9205273f82c'
+snapshot_mac:
+    description: MAC address the snapshot was keyed by, null if the phone does not show one and the snapshot was keyed by host.
+    type: str
+    returned: when snapshot_store is given and the phone was read
+    sample: '00:60:b9:04:00:04'
+unchecked:
+    description: Section -> options that were given but are never shown by the phone, such as secrets and the ports of SIP servers two to four.
+    type: dict
+    returned: when the phone was compared
+    sample: {'voip': ['sip_password', 'sip_server_two_port']}
+'''
+
+import random
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+# import module snippets from community.necsipphonetool
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import *
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_snapshot_store import SnapshotStore, configHash
+
+# Sections of the desired-state document, in the order they are read
+configSections = ['lan_port', 'pc_port', 'voip']
+
+# define available arguments/parameters a user can pass to the module
+module_args = dict(
+    concurrency=dict(type='int', required=False, default=2),
+    connect_timeout=dict(type='float', required=False, default=10),
+    force_http=dict(type='bool', required=False, default=False),
+    host=dict(type='str', required=True),
+    host_deadline=dict(type='float', required=False),
+    insecure_secondary=dict(type='bool', required=False, default=False),
+    lan_port=dict(type='dict', required=False, options=sectionArgumentSpec('lan_port')),
+    metrics_file=dict(type='path', required=False),
+    password=dict(type='str', required=False, no_log=True),
+    pc_port=dict(type='dict', required=False, options=sectionArgumentSpec('pc_port')),
+    profile_file=dict(type='path', required=False),
+    read_timeout=dict(type='float', required=False, default=30),
+    recheck_after=dict(type='int', required=False, default=86400),
+    refresh=dict(type='bool', required=False, default=False),
+    sample_rate=dict(type='float', required=False, default=0),
+    session_cache=dict(type='bool', required=False, default=True),
+    session_id=dict(type='str', required=False),
+    session_ttl=dict(type='int', required=False, default=300),
+    snapshot_store=dict(type='path', required=False),
+    trace_file=dict(type='path', required=False),
+    username=dict(type='str', required=False, no_log=True),
+    verify_certs=dict(type='bool', required=False, default=False),
+    voip=dict(type='dict', required=False, options=sectionArgumentSpec('voip')),
+)
+
+# Desired values that can be compared, section -> option -> value, and
+# section -> options given that the phone never shows: secrets, and
+# settings whose item code shows another setting's value
+def desiredSettings(params):
+    desired = {}
+    unchecked = {}
+    for section in configSections:
+        for option, value in sorted((params[section] or {}).items()):
+            if value is None or value == '':
+                continue
+            if not readableItem(itemCodeRegistry[section][option]):
+                unchecked.setdefault(section, []).append(option)
+            else:
+                desired.setdefault(section, {})[option] = value
+    return desired, unchecked
+
+# Settings that differ from the desired values, section -> option ->
+# desired and actual value. Settings not read are left out.
+def settingsDrift(desired, settings):
+    drift = {}
+    for section, desiredValues in desired.items():
+        for option, value in desiredValues.items():
+            if option not in settings.get(section, {}):
+                continue
+            actual = settings[section][option]
+            if actual != value:
+                drift.setdefault(section, {})[option] = {'desired': value, 'actual': actual}
+    return drift
+
+# Last check of the host if it still holds: the store's latest snapshot and
+# the desired state are those it was made against and it is recent enough
+def heldCheck(snapshotStore, params, desiredHash):
+    lastCheck = snapshotStore.lastCheck(params['host'])
+    if lastCheck is None or params['refresh']:
+        return None
+    checked, checkedDesiredHash, checkedConfigHash, drift = lastCheck
+    if checkedDesiredHash != desiredHash or checkedConfigHash != snapshotStore.latestHash(params['host']):
+        return None
+    if time.time() - checked >= params['recheck_after'] or random.random() < params['sample_rate']:
+        return None
+    return checkedConfigHash, drift
+
+# Read the desired sections from the phone and compare them, or take the
+# last check from the snapshot store while it holds, and return the task
+# result
+def checkPhoneDrift(params):
+    result = dict(
+        changed=False,
+        original_message = params['host']
+    )
+
+    desired, unchecked = desiredSettings(params)
+    if not desired and not unchecked:
+        result['msg'] = 'Give the desired lan_port, pc_port or voip settings to compare'
+        return result
+    desiredHash = configHash(desired)
+
+    try:
+        snapshotStore = SnapshotStore(params['snapshot_store']) if params['snapshot_store'] else None
+    except ValueError as e:
+        # Snapshot store written by another version
+        result['msg'] = str(e)
+        return result
+    try:
+        heldResult = heldCheck(snapshotStore, params, desiredHash) if snapshotStore else None
+        if heldResult:
+            result['snapshot'], drift = heldResult
+            result['checked'] = 'store'
+        else:
+            drift = readPhoneDrift(params, desired, snapshotStore, desiredHash, result)
+            if drift is None:
+                return result
+            result['checked'] = 'phone'
+    finally:
+        if snapshotStore:
+            snapshotStore.close()
+
+    result['drift'] = drift
+    result['compliant'] = not drift
+    result['unchecked'] = unchecked
+    result['ansible_facts'] = {'nec_drift': dict(
+        (section, dict((option, values['desired']) for option, values in options.items())) for section, options in drift.items())}
+    return result
+
+# Compare the phone's settings with the desired values and record the
+# check in the store. Returns the drift, or None with result['msg'] set if
+# the phone could not be read.
+def readPhoneDrift(params, desired, snapshotStore, desiredHash, result):
+    verifyCerts = params['verify_certs']
+    hostName = configureHostTask(params, params['concurrency'])
+
+    drift = None
+    try:
+        sessionId, logOnPageText = openReadSession(hostName, params)
+        settings, rawItems, itemErrors, missingCodes = readSettings(
+            hostName, sessionId, sorted(desired), [], verifyCerts, False, params['concurrency'])
+        if params['session_cache']:
+            storeSession(hostName, sessionId)
+        # Settings whose read failed are not known, rather than drifted
+        for section, sectionValues in settings.items():
+            for option, registryItem in itemCodeRegistry[section].items():
+                if registryItem.itemCode.lower() in itemErrors:
+                    sectionValues.pop(option, None)
+        drift = settingsDrift(desired, settings)
+        result['failed_items'] = itemErrors
+        # Stored under the MAC address like get_config, merged into the last
+        # full snapshot as only the desired sections were read
+        if snapshotStore and not itemErrors:
+            macAddress = readPhoneMac(hostName, sessionId, verifyCerts, False, logOnPageText)
+            snapshotConfig = dict(snapshotStore.latestConfig(macAddress or params['host']) or {})
+            snapshotConfig.update(settings)
+            result['snapshot'] = snapshotStore.storeSnapshot(params['host'], snapshotConfig, mac=macAddress)[0]
+            result['snapshot_mac'] = macAddress
+            snapshotStore.storeCheck(params['host'], desiredHash, result['snapshot'], drift)
+    except PhoneRequestError as e:
+        result['error_kind'] = e.kind
+        result['msg'] = str(e)
+
+    if params['metrics_file']:
+        writeMetrics(params['metrics_file'], merge=True)
+
+    return drift
+
+def run_module():
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    # Only reads from the phone, so it runs in check mode too
+    result = runObservedTask(checkPhoneDrift, module.params)
+    if 'msg' in result:
+        module.fail_json(**result)
+
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: get_config
+
+short_description: This module reads settings of a NEC phone and returns them as facts.
+
+version_added: "0.0.5"
+
+description:
+    - This module reads the current values of settings on a NEC-SIP IP phone in one session, the counterpart of set_lan_port, set_pc_port and set_voip.
+    - Whole sections are read by name and returned with the option names and value types those modules take, so the facts can be compared with or fed back to them. Other settings are read by item code and returned as the phone shows them.
+    - Pages are read a few at a time and parsed as they arrive. Secrets such as the SIP password are never shown by the phone and are not read, nor are the ports of SIP servers two to four, which the phone keeps under the server's item code.
+    - The phone is not logged off afterwards, as logging off reboots it; with session_cache the session is kept for later tasks.
+    - With snapshot_store the settings read are also kept in a snapshot store on the controller, so the configs of a fleet can be compared and searched without asking the phones again.
+
+notes:
+    - The phone's web UI has no documented call to read a single setting. Settings are read with index.cgi?get=<item code>, assumed to return the settings page holding the item, as the emulator in module_utils/nec_phone_emulator.py does; this has not been confirmed on a real phone. A phone that answers it with any other page shows no values, so every setting reads as unknown.
+
+options:
+    concurrency:
+        description: Pages read from the phone at the same time. Phones handle only a few connections at once, keep this low.
+        required: false
+        type: int
+        default: 2
+    connect_timeout:
+        description: Seconds to wait for a connection to the phone before retrying or failing.
+        required: false
+        type: float
+        default: 10
+    force_http:
+        description: This option forces the use of HTTP instead of HTTPS.
+        required: false
+        type: bool
+    host:
+        description: IPv4 or hostname of phone.
+        required: true
+        type: str
+    host_deadline:
+        description: Overall seconds allowed for all requests to the phone in this task. Reads still pending when it runs out are reported as failed. No limit if not given.
+        required: false
+        type: float
+    insecure_secondary:
+        description: Use HTTP if the HTTPS connection to the phone fails. The protocol that worked is remembered on the controller per phone, so later tasks go straight to it.
+        required: false
+        type: bool
+        default: false
+    items:
+        description: Item codes to read, seven hex digits each, for settings outside the sections.
+        required: false
+        type: list
+        elements: str
+        default: []
+    metrics_file:
+        description: Record the latency, bytes, status codes and retries of every request to the phone and add them to this file on the controller. Written as Prometheus text if the name ends in .prom, otherwise as JSON. A .prom file keeps its running totals in a .json file beside it.
+        required: false
+        type: path
+    password:
+        description: Password to log into phone. Required unless session_id is given or session_cache finds a session.
+        required: false
+        type: str
+    profile_file:
+        description: Run the task under cProfile and add its stats to this pstats file on the controller, for finding where time goes outside the phone. Read it with python -m pstats.
+        required: false
+        type: path
+    read_timeout:
+        description: Seconds to wait for the phone to answer a request before retrying or failing.
+        required: false
+        type: float
+        default: 30
+    sections:
+        description: Sections to read every setting of, lan_port, pc_port or voip.
+        required: false
+        type: list
+        elements: str
+        default: []
+    snapshot_store:
+        description:
+            - SQLite file on the controller to add the settings read to as a snapshot of the phone, keyed by host. Nothing is added if any read failed.
+            - Settings and sections are stored once however many phones share them, and a phone's history only grows when its config changes.
+            - Phones are keyed by the MAC address they show, so a phone that moves to another address keeps its history. Phones that show none are keyed by host.
+        required: false
+        type: path
+    session_cache:
+        description: Reuse a session cached on the controller by an earlier task against the same phone, and cache the session of a new logon for later tasks.
+        required: false
+        type: bool
+        default: true
+    session_id:
+        description: Logon session ID to use for API calls. If not provided, a new logon session will be created.
+        required: false
+        type: str
+    session_ttl:
+        description: Seconds a cached session may sit unused before a new logon is made.
+        required: false
+        type: int
+        default: 300
+    trace_file:
+        description: Add a span for the task and for each request to the phone to this Chrome trace file on the controller. Open it in chrome://tracing or Perfetto to see the timeline of a run.
+        required: false
+        type: path
+    username:
+        description: Username to log into phone. Required unless session_id is given or session_cache finds a session.
+        required: false
+        type: str
+    verify_certs:
+        description: This option verifies the SSL certificate on the phone.
+        required: false
+        type: bool
+author:
+    - Raymond Rizzo (@zombat)
+'''
+
+EXAMPLES = r'''
+    - name: Read the LAN port and VoIP settings
+      community.necsipphonetool.get_config:
+        username: 'ADMIN'
+        password: '6633222'
+        host: "{{ inventory_hostname }}"
+        sections:
+          - lan_port
+          - voip
+      delegate_to: localhost
+
+    - name: Phones not on the voice VLAN
+      ansible.builtin.debug:
+        msg: "{{ inventory_hostname }} is on VLAN {{ nec_config.lan_port.vlan_id }}"
+      when: nec_config.lan_port.vlan_id != 20
+
+    - name: Read single items by code
+      community.necsipphonetool.get_config:
+        username: 'ADMIN'
+        password: '6633222'
+        host: "{{ inventory_hostname }}"
+        items:
+          - '44604f3'
+      delegate_to: localhost
+'''
+
+RETURN = r'''
+ansible_facts:
+    description: Settings read from the phone.
+    returned: when the phone was logged on to
+    type: complex
+    contains:
+        nec_config:
+            description: Section -> option -> value, with the option names and types of the set modules. Null for settings the phone did not show.
+            type: dict
+            sample: {'lan_port': {'lldp_mode': true, 'vlan_id': 20}}
+        nec_config_items:
+            description: Item code -> value as shown by the phone, for the item codes asked for. Null for items the phone did not show.
+            type: dict
+            sample: {'44604f3': '1'}
+changed:
+    description: Always false, nothing is changed on the phone
+    type: bool
+    returned: always
+    sample: 'False'
+error_kind:
+    description: Class of the request failure after retries, one of timeout, refused, tls, http5xx, nosession, bad_credentials, connection, circuit_open or deadline.
+    type: str
+    returned: when the phone could not be logged on to
+    sample: 'timeout'
+failed_items:
+    description: Item code -> error kind for reads that failed after retries.
+    type: dict
+    returned: always
+    sample: {'40b041b': 'timeout'}
+missing:
+    description: Item codes the phone did not show a value for.
+    type: list
+    returned: always
+    sample: ['40b041e']
+snapshot:
+    description: Content hash of the config stored in snapshot_store. Phones with the same settings have the same hash.
+    type: str
+    returned: when snapshot_store is given and every read succeeded
+    sample: 'f4709de02f90dd2630a9ba5d3906c9572d2caacb64486592e4b5c9205273f82c'
+snapshot_changed:
+    description: Whether the config differs from the phone's last snapshot, true for the first one.
+    type: bool
+    returned: when snapshot_store is given and every read succeeded
+    sample: false
+snapshot_mac:
+    description: MAC address the snapshot was keyed by, null if the phone does not show one and the snapshot was keyed by host.
+    type: str
+    returned: when snapshot_store is given and every read succeeded
+    sample: '00:60:b9:04:00:04'
+original_message:
+    description: The original name param that was passed in.
+    type: str
+    returned: always
+    sample: '10.4.0.4'
+'''
+
+import re
+
+from ansible.module_utils.basic import AnsibleModule
+# import module snippets from community.necsipphonetool
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import *
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_snapshot_store import SnapshotStore
+
+# define available arguments/parameters a user can pass to the module
+module_args = dict(
+    concurrency=dict(type='int', required=False, default=2),
+    connect_timeout=dict(type='float', required=False, default=10),
+    force_http=dict(type='bool', required=False, default=False),
+    host=dict(type='str', required=True),
+    host_deadline=dict(type='float', required=False),
+    insecure_secondary=dict(type='bool', required=False, default=False),
+    items=dict(type='list', elements='str', required=False, default=[]),
+    metrics_file=dict(type='path', required=False),
+    password=dict(type='str', required=False, no_log=True),
+    profile_file=dict(type='path', required=False),
+    read_timeout=dict(type='float', required=False, default=30),
+    sections=dict(type='list', elements='str', required=False, default=[], choices=sorted(itemCodeRegistry)),
+    session_cache=dict(type='bool', required=False, default=True),
+    session_id=dict(type='str', required=False),
+    session_ttl=dict(type='int', required=False, default=300),
+    snapshot_store=dict(type='path', required=False),
+    trace_file=dict(type='path', required=False),
+    username=dict(type='str', required=False, no_log=True),
+    verify_certs=dict(type='bool', required=False, default=False),
+)
+
+# Item codes are seven hex digits
+itemCodeFormat = re.compile(r'^[0-9a-fA-F]{7}$')
+
+# Read the requested sections and items over one session and return the
+# task result
+def readPhoneConfig(params):
+    result = dict(
+        changed=False,
+        original_message = params['host'],
+        failed_items = {},
+        missing = []
+    )
+
+    badItems = [itemCode for itemCode in params['items'] if not itemCodeFormat.match(itemCode)]
+    if badItems:
+        result['msg'] = 'Item codes must be seven hex digits: {}'.format(', '.join(badItems))
+        return result
+    if not params['sections'] and not params['items']:
+        result['msg'] = 'Give sections or items to read'
+        return result
+
+    verifyCerts = params['verify_certs']
+    hostName = configureHostTask(params, params['concurrency'])
+
+    try:
+        sessionId, logOnPageText = openReadSession(hostName, params)
+        settings, rawItems, itemErrors, missingCodes = readSettings(
+            hostName, sessionId, params['sections'], params['items'], verifyCerts, False, params['concurrency'])
+        if params['session_cache']:
+            storeSession(hostName, sessionId)
+        result['ansible_facts'] = {'nec_config': settings, 'nec_config_items': rawItems}
+        result['failed_items'] = itemErrors
+        result['missing'] = sorted(missingCodes)
+        # A partial read would look like a config change
+        if params['snapshot_store'] and not itemErrors:
+            snapshotConfig = dict(settings)
+            if rawItems:
+                snapshotConfig['items'] = rawItems
+            # Keyed by MAC address so a phone that changes address keeps its history
+            macAddress = readPhoneMac(hostName, sessionId, verifyCerts, False, logOnPageText)
+            with SnapshotStore(params['snapshot_store']) as snapshotStore:
+                result['snapshot'], result['snapshot_changed'] = snapshotStore.storeSnapshot(params['host'], snapshotConfig, mac=macAddress)
+            result['snapshot_mac'] = macAddress
+    except PhoneRequestError as e:
+        result['error_kind'] = e.kind
+        result['msg'] = str(e)
+    except ValueError as e:
+        # Snapshot store written by another version
+        result['msg'] = str(e)
+
+    if params['metrics_file']:
+        writeMetrics(params['metrics_file'], merge=True)
+
+    return result
+
+def run_module():
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    # Only reads from the phone, so it runs in check mode too
+    result = runObservedTask(readPhoneConfig, module.params)
+    if 'msg' in result:
+        module.fail_json(**result)
+
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
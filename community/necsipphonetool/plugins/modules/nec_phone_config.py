@@ -0,0 +1,425 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: nec_phone_config
+
+short_description: This module applies LAN port, PC port and VoIP settings to a NEC phone in one pass.
+
+version_added: "0.0.5"
+
+description:
+    - This module takes the desired LAN port, PC port and VoIP settings of a NEC-SIP IP phone as one document.
+    - All settings are written over a single logon session and the phone is logged off, and so rebooted, once at the end.
+    - Settings already at the desired value are not sent. If nothing changes the phone is not rebooted.
+    - Takes the place of a set_lan_port, set_pc_port and set_voip sequence, which reboots the phone three times.
+
+options:
+    connect_timeout:
+        description: Seconds to wait for a connection to the phone before retrying or failing.
+        required: false
+        type: float
+        default: 10
+    defer_reboot:
+        description: Leave the session open with the changes unsaved and queue the phone's reboot on the controller instead of logging off. Release queued reboots in waves with rolling_reboot before the phone's session times out.
+        required: false
+        type: bool
+        default: false
+    force_http:
+        description: This option forces the use of HTTP instead of HTTPS.
+        required: false
+        type: bool
+        default: false
+    host:
+        description: IPv4 or hostname of phone.
+        required: true
+        type: str
+    host_deadline:
+        description: Overall seconds allowed for all requests to the phone in this task. Writes still pending when it runs out are abandoned and reported. No limit if not given.
+        required: false
+        type: float
+    insecure_secondary:
+        description: Use HTTP if the HTTPS connection to the phone fails. The protocol that worked is remembered on the controller per phone, so later tasks go straight to it.
+        required: false
+        type: bool
+        default: false
+    keep_session:
+        description: This option keeps the session open after setting options. A logout or hard reset will be required at the end of your playbook.
+        required: false
+        type: bool
+        default: false
+    lan_port:
+        description: Desired LAN port settings, as taken by set_lan_port.
+        required: false
+        type: dict
+        suboptions:
+            default_gateway:
+                description: The default gateway for the phone.
+                type: str
+            dhcp_mode:
+                description: This is the DHCP mode for the phone.
+                type: bool
+            dns_address:
+                description: This is the DNS address for the phone.
+                type: str
+            ip_address:
+                description: This is the IP address for the phone.
+                type: str
+            lldp_mode:
+                description: This option sets the LLDP mode on the phone.
+                type: bool
+            port_speed:
+                description: This option sets the LAN port speed and duplex on the phone.
+                type: str
+                choices: ['auto', '100full', '100half', '10full', '10half']
+            spare_default_gateway:
+                description: The spare default gateway for the phone.
+                type: str
+            spare_dns_address:
+                description: This is the spare DNS address for the phone.
+                type: str
+            spare_ip_address:
+                description: This is the spare IP address for the phone.
+                type: str
+            spare_ip_address_mode:
+                description: This option sets the spare IP address mode on the phone.
+                type: str
+                choices: ['disable', 'spare', 'backup']
+            spare_subnet_mask:
+                description: This is the spare subnet mask for the phone.
+                type: str
+            subnet_mask:
+                description: This is the subnet mask for the phone.
+                type: str
+            vlan_id:
+                description: This option sets the VLAN ID on the LAN port.
+                type: int
+            vlan_mode:
+                description: This option sets the VLAN mode on the LAN port.
+                type: bool
+            vlan_priority:
+                description: This option sets the VLAN priority on the LAN port.
+                type: int
+                choices: [0, 1, 2, 3, 4, 5, 6, 7]
+    metrics_file:
+        description: Record the latency, bytes, status codes and retries of every request to the phone and add them to this file on the controller. Written as Prometheus text if the name ends in .prom, otherwise as JSON. A .prom file keeps its running totals in a .json file beside it.
+        required: false
+        type: path
+    password:
+        description: Password to log into phone.
+        required: true
+        type: str
+    pc_port:
+        description: Desired PC port settings, as taken by set_pc_port.
+        required: false
+        type: dict
+        suboptions:
+            eapol_forwarding:
+                description: This option enables or disables EAPOL forwarding on the PC port.
+                type: bool
+            port_available:
+                description: This option sets the PC port to available.
+                type: bool
+            port_security:
+                description: This option sets PC port security.
+                type: bool
+            port_speed:
+                description: This option sets the PC port speed and duplex on the phone.
+                type: str
+                choices: ['auto', '100full', '100half', '10full', '10half']
+            vlan_id:
+                description: This option sets the VLAN ID on the PC port.
+                type: int
+            vlan_mode:
+                description: This option sets the VLAN mode on the PC port.
+                type: bool
+            vlan_priority:
+                description: This option sets the VLAN priority on the PC port.
+                type: int
+                choices: [0, 1, 2, 3, 4, 5, 6, 7]
+    profile_file:
+        description: Run the task under cProfile and add its stats to this pstats file on the controller, for finding where time goes outside the phone. Read it with python -m pstats.
+        required: false
+        type: path
+    read_before_write:
+        description: Read the current value of each requested item first and only send the items that differ. If nothing differs the phone is not logged off, so it is not rebooted. Settings the phone does not show back, such as sip_password, encryption_otp and the ports of SIP servers two to four, are sent only along with another change unless write_unreadable is true. Settings are read as get_config reads them, see its notes.
+        required: false
+        type: bool
+        default: true
+    read_timeout:
+        description: Seconds to wait for the phone to answer a request before retrying or failing.
+        required: false
+        type: float
+        default: 30
+    session_cache:
+        description: Reuse a session cached on the controller by an earlier task against the same phone, and cache kept sessions for later tasks. Sessions are dropped on logoff or reset.
+        required: false
+        type: bool
+        default: true
+    session_id:
+        description: Logon session ID to use for API calls. If not provided, a new logon session will be created.
+        required: false
+        type: str
+    session_ttl:
+        description: Seconds a cached session may sit unused before a new logon is made.
+        required: false
+        type: int
+        default: 300
+    trace_file:
+        description: Add a span for the task and for each request to the phone to this Chrome trace file on the controller. Open it in chrome://tracing or Perfetto to see the timeline of a run.
+        required: false
+        type: path
+    username:
+        description: Username to log into phone.
+        required: true
+        type: str
+    verify_certs:
+        description: This option verifies the SSL certificate on the phone.
+        required: false
+        type: bool
+        default: false
+    voip:
+        description: Desired VoIP settings, as taken by set_voip.
+        required: false
+        type: dict
+        suboptions:
+            encryption_auth_mode:
+                description: Enable or disable encryption mode.
+                type: bool
+            encryption_otp:
+                description: Set encryption OTP.
+                type: str
+            sip_access_mode:
+                description: SIP access mode to set.
+                type: str
+                choices: ['normal', 'remote']
+            sip_backup_login:
+                description: Enable/disable SIP backup login.
+                type: bool
+            sip_extension:
+                description: SIP extension to set.
+                type: str
+            sip_password:
+                description: SIP password to set.
+                type: str
+            sip_server_one:
+                description: SIP server one to set.
+                type: str
+            sip_server_two:
+                description: SIP server two to set.
+                type: str
+            sip_server_three:
+                description: SIP server three to set.
+                type: str
+            sip_server_four:
+                description: SIP server four to set.
+                type: str
+            sip_server_one_port:
+                description: SIP server one port to set.
+                type: str
+            sip_server_two_port:
+                description: SIP server two port to set. The phone keeps it under the item code of sip_server_two, so when both are set the task warns that it cannot check the phone kept both, and as it cannot be read back it is sent only along with another change unless write_unreadable is true.
+                type: str
+            sip_server_three_port:
+                description: SIP server three port to set. The phone keeps it under the item code of sip_server_three, so when both are set the task warns that it cannot check the phone kept both, and as it cannot be read back it is sent only along with another change unless write_unreadable is true.
+                type: str
+            sip_server_four_port:
+                description: SIP server four port to set. The phone keeps it under the item code of sip_server_four, so when both are set the task warns that it cannot check the phone kept both, and as it cannot be read back it is sent only along with another change unless write_unreadable is true.
+                type: str
+            sip_user_id:
+                description: SIP user ID to set.
+                type: str
+    write_unreadable:
+        description: With read_before_write, also send the settings the phone does not show back when nothing else changed. They cannot be compared, so this saves and reboots the phone on every run. Needed to change only such a setting, for example a new sip_password.
+        required: false
+        type: bool
+        default: false
+author:
+    - Raymond Rizzo (@zombat)
+'''
+
+EXAMPLES = r'''
+    - name: Provision phone in one pass
+      community.necsipphonetool.nec_phone_config:
+        username: 'ADMIN'
+        password: '6633222'
+        host: "10.4.0.4"
+        force_http: True
+        lan_port:
+          vlan_id: 222
+          vlan_mode: True
+          vlan_priority: 5
+          lldp_mode: False
+        pc_port:
+          vlan_id: 333
+          vlan_mode: True
+          port_security: False
+        voip:
+          sip_user_id: '2001'
+          sip_password: '{{ sip_password }}'
+          sip_server_one: '10.0.0.10'
+          sip_server_one_port: '5060'
+'''
+
+RETURN = r'''
+changed:
+    description: True if any setting was written to the phone. In check mode, true if any setting would be written.
+    type: bool
+    returned: always
+    sample: 'True/False'
+failed:
+    description: True if the module failed
+    type: bool
+    returned: always
+    sample: 'True/False'
+abandoned:
+    description: Labels of items not sent because host_deadline ran out.
+    type: list
+    returned: when a session was available
+    sample: '["PC port: VLAN ID"]'
+error_kind:
+    description: Class of the request failure after retries, one of timeout, refused, tls, http5xx, nosession, bad_credentials, connection, circuit_open or deadline.
+    type: str
+    returned: when a request to the phone failed
+    sample: 'timeout'
+items:
+    description: Per-item write results in the order they were sent, with item code, label, value, HTTP status, success and elapsed seconds. In check mode, the items that would be sent, marked check_mode, after reading the phone as read_before_write asks.
+    type: list
+    returned: when a session was available
+    sample: '[{"item": "41d044f", "label": "LAN port: VLAN ID", "value": "222", "ok": true, "status_code": 200, "elapsed": 0.08}]'
+message:
+    description: The output messages that the module generates.
+    type: list
+    returned: always
+    sample: '["LAN port: VLAN ID set to 222", "PC port: VLAN ID set to 333"]'
+rebooted:
+    description: True if the phone was logged off, which saves the settings and reboots it.
+    type: bool
+    returned: always
+    sample: 'True/False'
+sections:
+    description: Per-section summary with whether the section changed and the labels of the settings set, already set, failed and abandoned.
+    type: dict
+    returned: when a session was available
+    sample: '{"lan_port": {"changed": true, "set": ["VLAN ID"], "unchanged": ["VLAN mode"], "failed": [], "abandoned": []}}'
+reboot_deferred:
+    description: True if the phone's reboot was queued for rolling_reboot instead of done now.
+    type: bool
+    returned: when defer_reboot is true and something changed
+    sample: 'True/False'
+session_id:
+    description: The session ID used for API calls.
+    type: str
+    returned: if keep_session is true
+unchanged:
+    description: Labels of requested items that already had the requested value and were not sent.
+    type: list
+    returned: when read_before_write is true and a session was available
+    sample: '["LAN port: VLAN mode"]'
+unverified:
+    description: Labels of requested settings the phone does not show back that were not sent, because nothing else changed and write_unreadable is false.
+    type: list
+    returned: when read_before_write is true and a session was available
+    sample: '["VoIP: SIP password"]'
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+# import module snippets from community.necsipphonetool
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import *
+
+# Sections of the desired-state document, in the order they are read
+configSections = ['lan_port', 'pc_port', 'voip']
+
+# define available arguments/parameters a user can pass to the module
+module_args = dict(
+    connect_timeout=dict(type='float', required=False, default=10),
+    defer_reboot=dict(type='bool', required=False, default=False),
+    force_http=dict(type='bool', required=False, default=False),
+    host=dict(type='str', required=True),
+    host_deadline=dict(type='float', required=False),
+    insecure_secondary=dict(type='bool', required=False, default=False),
+    keep_session=dict(type='bool', required=False, default=False),
+    lan_port=dict(type='dict', required=False, options=sectionArgumentSpec('lan_port')),
+    metrics_file=dict(type='path', required=False),
+    password=dict(type='str', required=False, no_log=True),
+    pc_port=dict(type='dict', required=False, options=sectionArgumentSpec('pc_port')),
+    profile_file=dict(type='path', required=False),
+    read_before_write=dict(type='bool', required=False, default=True),
+    read_timeout=dict(type='float', required=False, default=30),
+    session_cache=dict(type='bool', required=False, default=True),
+    session_id=dict(type='str', required=False),
+    session_ttl=dict(type='int', required=False, default=300),
+    trace_file=dict(type='path', required=False),
+    username=dict(type='str', required=False, no_log=True),
+    verify_certs=dict(type='bool', required=False, default=False),
+    voip=dict(type='dict', required=False, options=sectionArgumentSpec('voip')),
+    write_unreadable=dict(type='bool', required=False, default=False),
+)
+
+# Write items for every section given, labelled with their section, and
+# write item key -> section for the summary
+def configWriteItems(params):
+    writeItems = []
+    itemSections = {}
+    for section in configSections:
+        for writeItem in writeItemsFromOptions(section, params[section] or {}):
+            writeItem = writeItem._replace(label='{}: {}'.format(sectionTitles[section], writeItem.label))
+            itemSections[(writeItem.itemCode, writeItem.paramTwoKey)] = section
+            writeItems.append(writeItem)
+    return writeItems, itemSections
+
+# Per-section lists of settings set, already set, failed and abandoned
+def sectionSummary(params, itemSections, writePlan, itemResults, unchangedItems):
+    summary = {}
+    for section in configSections:
+        if params[section]:
+            summary[section] = {'changed': False, 'set': [], 'unchanged': [], 'failed': [], 'abandoned': []}
+    def optionLabel(writeItem):
+        return writeItem.label.split(': ', 1)[-1]
+    for writeItem in unchangedItems:
+        summary[itemSections[(writeItem.itemCode, writeItem.paramTwoKey)]]['unchanged'].append(optionLabel(writeItem))
+    for writeItem, itemResult in zip(writePlan, itemResults):
+        sectionResult = summary[itemSections[(writeItem.itemCode, writeItem.paramTwoKey)]]
+        if itemResult.get('abandoned'):
+            sectionResult['abandoned'].append(optionLabel(writeItem))
+        elif itemResult['ok']:
+            sectionResult['set'].append(optionLabel(writeItem))
+            sectionResult['changed'] = True
+        else:
+            sectionResult['failed'].append(optionLabel(writeItem))
+    return summary
+
+# Apply the desired LAN port, PC port and VoIP settings to one phone over a
+# single session with one logoff, and return the task result
+def applyPhoneConfig(params):
+    # All sections go into one write plan for one session
+    writeItems, itemSections = configWriteItems(params)
+    result, writePlan, unchangedItems = runModuleWriteTask(params, writeItems)
+    if 'msg' not in result:
+        result['sections'] = sectionSummary(params, itemSections, writePlan, result['items'], unchangedItems)
+    return result
+
+def run_module():
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    result = runObservedTask(applyPhoneConfig, dict(module.params, check_mode=module.check_mode))
+    for warning in result.pop('warnings', []):
+        module.warn(warning)
+    if 'msg' in result:
+        module.fail_json(**result)
+
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
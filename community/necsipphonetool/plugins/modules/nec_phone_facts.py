@@ -0,0 +1,266 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: nec_phone_facts
+
+short_description: This module gathers the model and firmware of a NEC phone as facts.
+
+version_added: "0.0.5"
+
+description:
+    - This module finds the terminal type and firmware version of a NEC-SIP IP phone from its web UI and returns them as facts.
+    - Results are cached on the controller per phone, so later plays branch on model without probing each phone again.
+    - The logon form names the terminal type. The firmware version is only shown behind the logon, so it is read only when username and password are given. The phone is not logged off afterwards, as logging off reboots it; with session_cache the session is kept for later tasks.
+
+options:
+    connect_timeout:
+        description: Seconds to wait for a connection to the phone before retrying or failing.
+        required: false
+        type: float
+        default: 10
+    fingerprint_ttl:
+        description: Seconds a cached model and firmware are used before the phone is probed again.
+        required: false
+        type: int
+        default: 86400
+    force_http:
+        description: This option forces the use of HTTP instead of HTTPS.
+        required: false
+        type: bool
+    host:
+        description: IPv4 or hostname of phone.
+        required: true
+        type: str
+    insecure_secondary:
+        description: Use HTTP if the HTTPS connection to the phone fails. The protocol that worked is remembered on the controller per phone, so later tasks go straight to it.
+        required: false
+        type: bool
+        default: false
+    metrics_file:
+        description: Record the latency, bytes, status codes and retries of every request to the phone and add them to this file on the controller. Written as Prometheus text if the name ends in .prom, otherwise as JSON. A .prom file keeps its running totals in a .json file beside it.
+        required: false
+        type: path
+    password:
+        description: Password to log into phone, to read the firmware version.
+        required: false
+        type: str
+    profile_file:
+        description: Run the task under cProfile and add its stats to this pstats file on the controller, for finding where time goes outside the phone. Read it with python -m pstats.
+        required: false
+        type: path
+    read_timeout:
+        description: Seconds to wait for the phone to answer a request before retrying or failing.
+        required: false
+        type: float
+        default: 30
+    refresh:
+        description: Probe the phone even if a cached result is still fresh.
+        required: false
+        type: bool
+        default: false
+    session_cache:
+        description: Reuse a session cached on the controller by an earlier task against the same phone, and cache the session of a new logon for later tasks.
+        required: false
+        type: bool
+        default: true
+    session_ttl:
+        description: Seconds a cached session may sit unused before a new logon is made.
+        required: false
+        type: int
+        default: 300
+    trace_file:
+        description: Add a span for the task and for each request to the phone to this Chrome trace file on the controller. Open it in chrome://tracing or Perfetto to see the timeline of a run.
+        required: false
+        type: path
+    username:
+        description: Username to log into phone, to read the firmware version.
+        required: false
+        type: str
+    verify_certs:
+        description: This option verifies the SSL certificate on the phone.
+        required: false
+        type: bool
+author:
+    - Raymond Rizzo (@zombat)
+'''
+
+EXAMPLES = r'''
+    - name: Gather model and firmware
+      community.necsipphonetool.nec_phone_facts:
+        host: "{{ inventory_hostname }}"
+        username: 'ADMIN'
+        password: '6633222'
+      delegate_to: localhost
+
+    - name: Only on DT900 series phones
+      community.necsipphonetool.set_voip:
+        username: 'ADMIN'
+        password: '6633222'
+        host: "{{ inventory_hostname }}"
+        sip_server_one: '10.0.0.10'
+      delegate_to: localhost
+      when: nec_model_family == 'DT900'
+'''
+
+RETURN = r'''
+ansible_facts:
+    description: Facts about the phone.
+    returned: when the phone answered or a cached result was used
+    type: complex
+    contains:
+        nec_firmware:
+            description: Firmware version, null if it was not read.
+            type: str
+            sample: '5.2.3.0'
+        nec_fingerprint_age:
+            description: Seconds since the model and firmware were read from the phone.
+            type: float
+            sample: 12.5
+        nec_fingerprint_source:
+            description: Where the facts came from, cache or phone.
+            type: str
+            sample: 'cache'
+        nec_model:
+            description: Terminal type shown by the phone.
+            type: str
+            sample: 'DT820'
+        nec_model_family:
+            description: Model family, one of DT700, DT800 or DT900, null if not known.
+            type: str
+            sample: 'DT800'
+changed:
+    description: Always false, nothing is changed on the phone
+    type: bool
+    returned: always
+    sample: 'False'
+error_kind:
+    description: Class of the failure (timeout, refused, tls, http5xx, nosession, bad_credentials, connection, circuit_open or deadline)
+    type: str
+    returned: when a request to the phone failed
+    sample: 'timeout'
+original_message:
+    description: The original name param that was passed in.
+    type: str
+    returned: always
+    sample: '10.4.0.4'
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+# import module snippets from community.necsipphonetool
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import *
+
+# define available arguments/parameters a user can pass to the module
+module_args = dict(
+    connect_timeout=dict(type='float', required=False, default=10),
+    fingerprint_ttl=dict(type='int', required=False, default=86400),
+    force_http=dict(type='bool', required=False, default=False),
+    host=dict(type='str', required=True),
+    insecure_secondary=dict(type='bool', required=False, default=False),
+    metrics_file=dict(type='path', required=False),
+    password=dict(type='str', required=False, no_log=True),
+    profile_file=dict(type='path', required=False),
+    read_timeout=dict(type='float', required=False, default=30),
+    refresh=dict(type='bool', required=False, default=False),
+    session_cache=dict(type='bool', required=False, default=True),
+    session_ttl=dict(type='int', required=False, default=300),
+    trace_file=dict(type='path', required=False),
+    username=dict(type='str', required=False, no_log=True),
+    verify_certs=dict(type='bool', required=False, default=False),
+)
+
+# Facts for a fingerprint read now or taken from the cache
+def fingerprintFacts(fingerprint, source):
+    return {
+        'nec_firmware': fingerprint['firmware'],
+        'nec_fingerprint_age': round(time.time() - fingerprint['learned'], 1),
+        'nec_fingerprint_source': source,
+        'nec_model': fingerprint['model'],
+        'nec_model_family': fingerprint['family'],
+    }
+
+# Find the phone's model and firmware, from the cache or the phone, and
+# return the task result
+def gatherPhoneFacts(params):
+    result = dict(
+        changed=False,
+        original_message = params['host']
+    )
+
+    hostName = params['host']
+    sessionCache = params['session_cache']
+    verifyCerts = params['verify_certs']
+
+    if not params['refresh']:
+        fingerprint = cachedFingerprint(hostName, params['fingerprint_ttl'])
+        # A cached result without firmware is not enough once credentials are given
+        if fingerprint and (fingerprint['firmware'] or not params['username']):
+            result['ansible_facts'] = fingerprintFacts(fingerprint, 'cache')
+            return result
+
+    if params['force_http']:
+        hostName = 'http://' + hostName
+    else:
+        hostName = 'https://' + hostName
+    configureProtocolFallback(params['insecure_secondary'] and not params['force_http'], True)
+    configureTimeouts(params['connect_timeout'], params['read_timeout'])
+    if params['metrics_file']:
+        configureMetrics(True)
+
+    try:
+        phoneInfo = fingerprintPhone(hostName, verifyCerts, False)
+        if phoneInfo is None:
+            result['msg'] = '{} did not answer with a NEC web UI'.format(params['host'])
+            return result
+        if not phoneInfo['firmware'] and params['username'] and params['password']:
+            sessionId = ''
+            if sessionCache:
+                sessionId = getCachedSession(hostName, verifyCerts, params['session_ttl'], False)
+            if sessionId:
+                sessionInfo = fingerprintPhone(hostName, verifyCerts, False, sessionId)
+            else:
+                logOnResult = logOnPhoneResult(hostName, params['username'], params['password'], verifyCerts, False)
+                sessionId = requireSession(hostName, logOnResult.response, logOnResult.sessionId)
+                sessionInfo = identifyPhonePage(logOnResult.pageText)
+                if not sessionInfo or not sessionInfo['firmware']:
+                    # Logon page cut short before the firmware version
+                    sessionInfo = fingerprintPhone(hostName, verifyCerts, False, sessionId)
+            if sessionCache:
+                storeSession(hostName, sessionId)
+            if sessionInfo:
+                phoneInfo['model'] = sessionInfo['model'] or phoneInfo['model']
+                phoneInfo['firmware'] = sessionInfo['firmware']
+        result['ansible_facts'] = fingerprintFacts(storeFingerprint(hostName, phoneInfo), 'phone')
+    except PhoneRequestError as e:
+        # Classified failure after retries, or the phone's circuit is open
+        result['error_kind'] = e.kind
+        result['msg'] = str(e)
+    finally:
+        if params['metrics_file']:
+            writeMetrics(params['metrics_file'], merge=True)
+
+    return result
+
+def run_module():
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    # Only reads from the phone, so it runs in check mode too
+    result = runObservedTask(gatherPhoneFacts, module.params)
+    if 'msg' in result:
+        module.fail_json(**result)
+
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
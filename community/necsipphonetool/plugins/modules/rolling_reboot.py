@@ -0,0 +1,252 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: rolling_reboot
+
+short_description: This module releases deferred NEC phone reboots in waves.
+
+version_added: "0.0.5"
+
+description:
+    - This module reboots the phones whose reboots were deferred with the defer_reboot option of the other modules.
+    - Phones are rebooted in waves, a number at a time or per subnet. Each wave waits until its phones have gone down and answer index.cgi again before the next wave starts.
+    - Run it once on the controller at the end of a play, for example with run_once, so PoE switches, DHCP and the SIP registrar see one wave of phones come back at a time.
+
+options:
+    connect_timeout:
+        description: Seconds to wait for a connection to a phone when sending its reboot.
+        required: false
+        type: float
+        default: 10
+    down_timeout:
+        description: Seconds to wait for a phone to stop answering after its reboot is sent. Until then it is probed every second. A phone never seen going down is put in not_ready, as it may not have saved its changes.
+        required: false
+        type: float
+        default: 15
+    halt_on_not_ready:
+        description: Stop after a wave in which a phone could not be rebooted or did not come back. The remaining reboots stay queued.
+        required: false
+        type: bool
+        default: true
+    hosts:
+        description: Phones to release the reboots of, as given in host to the other modules. All queued reboots if not given.
+        required: false
+        type: list
+        elements: str
+    insecure_secondary:
+        description: Fall back to http:// if a phone does not answer on https://.
+        required: false
+        type: bool
+        default: false
+    metrics_file:
+        description: Record the latency, bytes, status codes and retries of every request to the phone and add them to this file on the controller. Written as Prometheus text if the name ends in .prom, otherwise as JSON. A .prom file keeps its running totals in a .json file beside it.
+        required: false
+        type: path
+    poll_interval:
+        description: Seconds between readiness probes of a rebooting phone.
+        required: false
+        type: float
+        default: 5
+    profile_file:
+        description: Run the task under cProfile and add its stats to this pstats file on the controller, for finding where time goes outside the phone. Read it with python -m pstats.
+        required: false
+        type: path
+    read_timeout:
+        description: Seconds to wait for a phone to answer its reboot request.
+        required: false
+        type: float
+        default: 30
+    ready_timeout:
+        description: Seconds to wait for a rebooted phone to answer index.cgi again.
+        required: false
+        type: float
+        default: 300
+    subnet_prefix:
+        description: Prefix length of the subnets phones are grouped by when wave_by is subnet.
+        required: false
+        type: int
+        default: 24
+    trace_file:
+        description: Add a span for the task and for each request to the phone to this Chrome trace file on the controller. Open it in chrome://tracing or Perfetto to see the timeline of a run.
+        required: false
+        type: path
+    verify_certs:
+        description: This option verifies the SSL certificate on the phone.
+        required: false
+        type: bool
+    wave_by:
+        description: Form waves of wave_size phones, or group phones per subnet first and split each subnet into waves of wave_size.
+        required: false
+        type: str
+        choices: ['size', 'subnet']
+        default: size
+    wave_size:
+        description: Phones rebooted together in one wave. 0 puts a whole subnet, or every phone, in one wave.
+        required: false
+        type: int
+        default: 10
+author:
+    - Raymond Rizzo (@zombat)
+'''
+
+EXAMPLES = r'''
+    - name: Provision phones without rebooting them yet
+      community.necsipphonetool.nec_phone_config:
+        username: 'ADMIN'
+        password: '6633222'
+        host: "{{ inventory_hostname }}"
+        defer_reboot: True
+        lan_port:
+          vlan_id: 222
+      delegate_to: localhost
+
+    - name: Reboot them one subnet at a time, 25 phones per wave
+      community.necsipphonetool.rolling_reboot:
+        wave_by: subnet
+        wave_size: 25
+      delegate_to: localhost
+      run_once: True
+'''
+
+RETURN = r'''
+changed:
+    description: True if any phone was rebooted. In check mode, true if any reboot is queued.
+    type: bool
+    returned: always
+    sample: 'True/False'
+failed:
+    description: True if a phone could not be rebooted or did not come back
+    type: bool
+    returned: always
+    sample: 'True/False'
+message:
+    description: One line per wave with its phones and timing.
+    type: list
+    returned: always
+    sample: '["Wave 1 (10.4.0.0/24): 25 of 25 phones ready in 96.1s"]'
+not_ready:
+    description: Phones that could not be rebooted, were not seen going down within down_timeout, or did not answer again within ready_timeout. A phone whose queued session had expired, so its changes were lost, is listed here and its reboot is no longer queued.
+    type: list
+    returned: always
+    sample: '["10.4.0.17"]'
+rebooted:
+    description: Phones that were rebooted and answered again.
+    type: list
+    returned: always
+    sample: '["10.4.0.4", "10.4.0.5"]'
+remaining:
+    description: Phones whose reboots are still queued, for example after a halted run.
+    type: list
+    returned: always
+    sample: '[]'
+waves:
+    description: Per-wave results with the group, phones, ready, not ready and failed phones, wave seconds and the slowest phone's seconds to come back.
+    type: list
+    returned: always
+    sample: '[{"wave": 1, "group": "10.4.0.0/24", "hosts": ["10.4.0.4"], "ready": ["10.4.0.4"], "not_ready": [], "failed": [], "errors": {}, "seconds": 96.1, "slowest_ready_seconds": 95.8}]'
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+# import module snippets from community.necsipphonetool
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import *
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_rolling_reboot import rebootWaves, rollingReboot
+
+# define available arguments/parameters a user can pass to the module
+module_args = dict(
+    connect_timeout=dict(type='float', required=False, default=10),
+    down_timeout=dict(type='float', required=False, default=15),
+    halt_on_not_ready=dict(type='bool', required=False, default=True),
+    hosts=dict(type='list', elements='str', required=False),
+    insecure_secondary=dict(type='bool', required=False, default=False),
+    metrics_file=dict(type='path', required=False),
+    poll_interval=dict(type='float', required=False, default=5),
+    profile_file=dict(type='path', required=False),
+    read_timeout=dict(type='float', required=False, default=30),
+    ready_timeout=dict(type='float', required=False, default=300),
+    subnet_prefix=dict(type='int', required=False, default=24),
+    trace_file=dict(type='path', required=False),
+    verify_certs=dict(type='bool', required=False, default=False),
+    wave_by=dict(type='str', required=False, default='size', choices=['size', 'subnet']),
+    wave_size=dict(type='int', required=False, default=10),
+)
+
+# Release queued reboots wave by wave and return the task result
+def releaseReboots(params):
+    result = dict(
+        changed=False,
+        failed=False,
+        message = [],
+        not_ready = [],
+        rebooted = [],
+        remaining = [],
+        waves = []
+    )
+
+    configureProtocolFallback(params['insecure_secondary'])
+    configureTimeouts(params['connect_timeout'], params['read_timeout'])
+    if params['metrics_file']:
+        configureMetrics(True)
+
+    queuedReboots = pendingReboots()
+    if params['hosts']:
+        queuedReboots = dict((host, queuedReboots[host]) for host in params['hosts'] if host in queuedReboots)
+
+    if params.get('check_mode'):
+        # Report the waves the queued reboots would go out in
+        for waveNumber, (group, waveHosts) in enumerate(rebootWaves(list(queuedReboots), params['wave_size'], params['wave_by'], params['subnet_prefix']), 1):
+            groupText = ' ({})'.format(group) if group else ''
+            result['message'].append('Wave {}{}: would reboot {} phones'.format(waveNumber, groupText, len(waveHosts)))
+        result['remaining'] = sorted(queuedReboots)
+        result['changed'] = bool(queuedReboots)
+        if not queuedReboots:
+            result['message'].append('No reboots queued')
+        return result
+
+    def reportWave(waveResult):
+        groupText = ' ({})'.format(waveResult['group']) if waveResult['group'] else ''
+        result['message'].append('Wave {}{}: {} of {} phones ready in {}s'.format(
+            waveResult['wave'], groupText, len(waveResult['ready']), len(waveResult['hosts']), waveResult['seconds']))
+
+    result['waves'] = rollingReboot(
+        queuedReboots, params['wave_size'], params['wave_by'], params['subnet_prefix'], params['ready_timeout'],
+        params['poll_interval'], params['down_timeout'], params['verify_certs'], False, params['halt_on_not_ready'], reportWave)
+    for waveResult in result['waves']:
+        result['rebooted'].extend(waveResult['ready'])
+        result['not_ready'].extend(waveResult['not_ready'] + waveResult['failed'])
+        if waveResult.get('halted'):
+            result['message'].append('Halted after wave {}, remaining reboots stay queued'.format(waveResult['wave']))
+    result['remaining'] = sorted(host for host in pendingReboots() if host in queuedReboots)
+    result['changed'] = any(waveResult['ready'] or waveResult['not_ready'] for waveResult in result['waves'])
+    if result['not_ready']:
+        result['msg'] = 'Phones not ready after reboot: {}'.format(', '.join(result['not_ready']))
+    if not queuedReboots:
+        result['message'].append('No reboots queued')
+
+    if params['metrics_file']:
+        writeMetrics(params['metrics_file'], merge=True)
+
+    return result
+
+def run_module():
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    result = runObservedTask(releaseReboots, dict(module.params, check_mode=module.check_mode))
+    if 'msg' in result:
+        module.fail_json(**result)
+
+    module.exit_json(**result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
@@ -16,26 +16,74 @@ version_added: "0.0.1"
 description: This module sets the factory values on a NEC-SIP IP phone.
 
 options:
+    connect_timeout:
+        description: Seconds to wait for a connection to the phone before retrying or failing.
+        required: false
+        type: float
+        default: 10
+    defer_reboot:
+        description: Leave the session open with the changes unsaved and queue the phone's reboot on the controller instead of logging off. Release queued reboots in waves with rolling_reboot before the phone's session times out.
+        required: false
+        type: bool
+        default: false
     force_http:
         description: This option forces the use of HTTP instead of HTTPS.
         required: false
         type: bool
+        default: false
     host:
         description: IPv4 or hostname of phone.
         required: true
         type: str
+    host_deadline:
+        description: Overall seconds allowed for all requests to the phone in this task. Writes still pending when it runs out are abandoned and reported. No limit if not given.
+        required: false
+        type: float
+    insecure_secondary:
+        description: Use HTTP if the HTTPS connection to the phone fails. The protocol that worked is remembered on the controller per phone, so later tasks go straight to it.
+        required: false
+        type: bool
+        default: false
     keep_session:
         description: This option keeps the session open after setting options. A logout or hard reset will be required at the end of your playbook.
         required: false
         type: bool
+        default: false
+    metrics_file:
+        description: Record the latency, bytes, status codes and retries of every request to the phone and add them to this file on the controller. Written as Prometheus text if the name ends in .prom, otherwise as JSON. A .prom file keeps its running totals in a .json file beside it.
+        required: false
+        type: path
     password:
         description: Password to log into phone.
         required: true
         type: str
+    profile_file:
+        description: Run the task under cProfile and add its stats to this pstats file on the controller, for finding where time goes outside the phone. Read it with python -m pstats.
+        required: false
+        type: path
+    read_timeout:
+        description: Seconds to wait for the phone to answer a request before retrying or failing.
+        required: false
+        type: float
+        default: 30
+    session_cache:
+        description: Reuse a session cached on the controller by an earlier task against the same phone, and cache kept sessions for later tasks. Sessions are dropped on logoff or reset.
+        required: false
+        type: bool
+        default: true
     session_id:
         description: Logon session ID to use for API calls. If not provided, a new logon session will be created.
         required: false
         type: str
+    session_ttl:
+        description: Seconds a cached session may sit unused before a new logon is made.
+        required: false
+        type: int
+        default: 300
+    trace_file:
+        description: Add a span for the task and for each request to the phone to this Chrome trace file on the controller. Open it in chrome://tracing or Perfetto to see the timeline of a run.
+        required: false
+        type: path
     username:
         description: Username to log into phone.
         required: true
@@ -44,6 +92,7 @@ options:
         description: This option verifies the SSL certificate on the phone.
         required: false
         type: bool
+        default: false
 author:
     - Raymond Rizzo (@zombat)
 '''
@@ -86,81 +135,128 @@ from ansible.module_utils.basic import AnsibleModule
 from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import *
 import re
 
-def run_module():
-    # define available arguments/parameters a user can pass to the module
-    module_args = dict(
-        force_http=dict(type='bool', required=False, Default=False),
-        host=dict(type='str', required=True),
-        keep_session=dict(type='bool', required=False, Default=False),
-        password=dict(type='str', required=False, Default='6633222', no_log=True),
-        session_id=dict(type='str', required=False),
-        username=dict(type='str', required=False, Default='admin', no_log=True),
-        verify_certs=dict(type='bool', required=False, Default=False),
-    )
-
-    module = AnsibleModule(
-        argument_spec=module_args,
-        supports_check_mode=True
-    )
+# define available arguments/parameters a user can pass to the module
+module_args = dict(
+    connect_timeout=dict(type='float', required=False, default=10),
+    defer_reboot=dict(type='bool', required=False, default=False),
+    force_http=dict(type='bool', required=False, default=False),
+    host=dict(type='str', required=True),
+    host_deadline=dict(type='float', required=False),
+    insecure_secondary=dict(type='bool', required=False, default=False),
+    keep_session=dict(type='bool', required=False, default=False),
+    metrics_file=dict(type='path', required=False),
+    password=dict(type='str', required=False, no_log=True),
+    profile_file=dict(type='path', required=False),
+    read_timeout=dict(type='float', required=False, default=30),
+    session_cache=dict(type='bool', required=False, default=True),
+    session_id=dict(type='str', required=False),
+    session_ttl=dict(type='int', required=False, default=300),
+    trace_file=dict(type='path', required=False),
+    username=dict(type='str', required=False, no_log=True),
+    verify_certs=dict(type='bool', required=False, default=False),
+)
 
-    if module.check_mode:
-        module.exit_json(**result)
+# Reset one phone to factory values and return the task result
+def setFactoryValues(params):
+    result = dict(
+        changed=False,
+        failed=True,
+        original_message = '',
+        message = 'Nothing happened.',
+        )
 
-    result['original_message'] = module.params['host']
-    result['message'] = 'goodbye'
+    result['original_message'] = params['host']
 
     # Set variables from module arguments
-    forceHttp = module.params['force_http']
-    hostName = module.params['host']
-    keepSession = module.params['keep_session']
-    password = module.params['password']
-    sessionId = module.params['session_id']
-    userName = module.params['username']
-    verifyCerts = module.params['verify_certs']
+    connectTimeout = params['connect_timeout']
+    deferReboot = params['defer_reboot']
+    forceHttp = params['force_http']
+    hostName = params['host']
+    hostDeadline = params['host_deadline']
+    insecureSecondary = params['insecure_secondary']
+    keepSession = params['keep_session']
+    password = params['password']
+    readTimeout = params['read_timeout']
+    sessionCache = params['session_cache']
+    sessionId = params['session_id']
+    sessionTtl = params['session_ttl']
+    userName = params['username']
+    verifyCerts = params['verify_certs']
 
     if forceHttp:
         hostName = 'http://' + hostName
     else:
         hostName = 'https://' + hostName
+    # Remember per phone whether HTTPS works so later tasks skip the failed handshake
+    configureProtocolFallback(insecureSecondary and not forceHttp, True)
+    # Bound each request and the task as a whole
+    configureTimeouts(connectTimeout, readTimeout)
+    if params['metrics_file']:
+        configureMetrics(True)
+    setHostDeadline(hostName, hostDeadline)
 
-    result = dict(
-        changed=False,
-        failed=True,
-        original_message = '',
-        message = 'Nothing happened.',
-        )
+    if params.get('check_mode'):
+        # A reset always changes the phone, so nothing needs to be read
+        result.update(changed=True, failed=False, message='Phone would be reset to factory defaults.')
+        return result
+
+    try:
+        if not sessionId and sessionCache:
+            # Reuse a session left open by an earlier task against this phone
+            sessionId = getCachedSession(hostName, verifyCerts, sessionTtl, False)
+            if sessionId:
+                result['failed'] = False
+        if not sessionId:
+            logonResponse, sessionId = logOnPhone(hostName, userName, password, True, verifyCerts, False)
+            requireSession(hostName, logonResponse, sessionId)
+            if logonResponse.status_code != 200:
+                result['failed'] = True
+            else:
+                 result['failed'] = False
+        if sessionId:        
+            # Clear configuration on phone
+            clearConfigResponse = passSingleParameter(hostName, sessionId, 'data_clear', passParameterCodes['data_clear'], False, verifyCerts, False)
+            result['clearConfigResponse'] = clearConfigResponse.text
+            if clearConfigResponse.status_code != 200: # or re.search('error', clearConfigResponse.text, re.IGNORECASE):
+                result['failed'] = True
+            else:
+                 result['failed'] = False
+            if deferReboot and not keepSession:
+                # Keep the session for rolling_reboot to send the hard reset
+                queueReboot(hostName, sessionId, 'hard_reset')
+                if sessionCache:
+                    storeSession(hostName, sessionId)
+                result['reboot_deferred'] = True
+            elif not keepSession:
+                # Hard reset phone
+                hardResetResponse = passSingleParameter(hostName, sessionId, 'hard_reset', passParameterCodes['hard_reset'], False, verifyCerts, False)
+                if hardResetResponse.status_code != 200:
+                    result['failed'] = True
+            else:
+                result['session_id'] = sessionId
+                if sessionCache:
+                    storeSession(hostName, sessionId)
+            result['changed'] = True
+            result['message'] = 'Phone reset to factory defaults.'
+    except PhoneRequestError as e:
+        # Classified failure after retries, or the phone's circuit is open
+        result['error_kind'] = e.kind
+        result['msg'] = str(e)
 
+    if params['metrics_file']:
+        writeMetrics(params['metrics_file'], merge=True)
+
+    return result
+
+def run_module():
     module = AnsibleModule(
         argument_spec=module_args,
         supports_check_mode=True
     )
 
-    if module.check_mode:
-        module.exit_json(**result)
-
-    if not sessionId:
-        logonResponse, sessionId = logOnPhone(hostName, userName, password, True, verifyCerts, False)
-        if logonResponse.status_code != 200 or not sessionId:
-            result['failed'] = True
-        else:
-             result['failed'] = False
-    if sessionId:        
-        # Clear configuration on phone
-        clearConfigResponse = passSingleParameter(hostName, sessionId, 'data_clear', '4110430', '0', verifyCerts, False)
-        result['clearConfigResponse'] = clearConfigResponse.text
-        if clearConfigResponse.status_code != 200: # or re.search('error', clearConfigResponse.text, re.IGNORECASE):
-            result['failed'] = True
-        else:
-             result['failed'] = False
-        if not keepSession:
-            # Hard reset phone
-            hardResetResponse = passSingleParameter(hostName, sessionId, 'hard_reset', '4040408', '0', verifyCerts, False)
-            if hardResetResponse.status_code != 200:
-                result['failed'] = True
-        else:
-            result['session_id'] = sessionId
-        result['changed'] = True
-        result['message'] = 'Phone reset to factory defaults.'
+    result = runObservedTask(setFactoryValues, dict(module.params, check_mode=module.check_mode))
+    if 'msg' in result:
+        module.fail_json(**result)
 
     module.exit_json(**result)
 
@@ -168,4 +264,4 @@ def main():
     run_module()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
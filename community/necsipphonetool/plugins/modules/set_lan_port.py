@@ -20,6 +20,11 @@ options:
         description: The default gateway for the phone.
         required: false
         type: str
+    defer_reboot:
+        description: Leave the session open with the changes unsaved and queue the phone's reboot on the controller instead of logging off. Release queued reboots in waves with rolling_reboot before the phone's session times out.
+        required: false
+        type: bool
+        default: false
     dhcp_mode:
         description: This is the DHCP mode for the phone.
         required: false
@@ -28,10 +33,16 @@ options:
         description: This is the DNS address for the phone.
         required: false
         type: str
+    connect_timeout:
+        description: Seconds to wait for a connection to the phone before retrying or failing.
+        required: false
+        type: float
+        default: 10
     force_http:
         description: This option forces the use of HTTP instead of HTTPS.
         required: false
         type: bool
+        default: false
     host:
         description: IPv4 or hostname of phone.
         required: true
@@ -40,14 +51,28 @@ options:
         description: This is the IP address for the phone.
         required: false
         type: str
+    host_deadline:
+        description: Overall seconds allowed for all requests to the phone in this task. Writes still pending when it runs out are abandoned and reported. No limit if not given.
+        required: false
+        type: float
+    insecure_secondary:
+        description: Use HTTP if the HTTPS connection to the phone fails. The protocol that worked is remembered on the controller per phone, so later tasks go straight to it.
+        required: false
+        type: bool
+        default: false
     keep_session:
         description: This option keeps the session open after setting options. A logout or hard reset will be required at the end of your playbook.
         required: false
         type: bool
+        default: false
     lldp_mode:
         description: This option sets the LLDP mode on the phone.
         required: false
         type: bool
+    metrics_file:
+        description: Record the latency, bytes, status codes and retries of every request to the phone and add them to this file on the controller. Written as Prometheus text if the name ends in .prom, otherwise as JSON. A .prom file keeps its running totals in a .json file beside it.
+        required: false
+        type: path
     password:
         description: Password to log into phone.
         required: true
@@ -56,10 +81,34 @@ options:
         description: This option sets the LAN port speed and duplex on the phone (auto, 10half, 10full, 100half, 100full).
         required: false
         type: str
+    profile_file:
+        description: Run the task under cProfile and add its stats to this pstats file on the controller, for finding where time goes outside the phone. Read it with python -m pstats.
+        required: false
+        type: path
+    read_before_write:
+        description: Read the current value of each requested item first and only send the items that differ. If nothing differs the phone is not logged off, so it is not rebooted. Settings are read as get_config reads them, see its notes.
+        required: false
+        type: bool
+        default: true
+    read_timeout:
+        description: Seconds to wait for the phone to answer a request before retrying or failing.
+        required: false
+        type: float
+        default: 30
+    session_cache:
+        description: Reuse a session cached on the controller by an earlier task against the same phone, and cache kept sessions for later tasks. Sessions are dropped on logoff or reset.
+        required: false
+        type: bool
+        default: true
     session_id:
         description: Logon session ID to use for API calls. If not provided, a new logon session will be created.
         required: false
         type: str
+    session_ttl:
+        description: Seconds a cached session may sit unused before a new logon is made.
+        required: false
+        type: int
+        default: 300
     spare_default_gateway:
         description: The spare default gateway for the phone.
         required: false
@@ -84,6 +133,10 @@ options:
         description: This is the subnet mask for the phone.
         required: false
         type: str
+    trace_file:
+        description: Add a span for the task and for each request to the phone to this Chrome trace file on the controller. Open it in chrome://tracing or Perfetto to see the timeline of a run.
+        required: false
+        type: path
     username:
         description: Username to log into phone.
         required: true
@@ -92,6 +145,7 @@ options:
         description: This option verifies the SSL certificate on the phone.
         required: false
         type: bool
+        default: false
     vlan_id:
         description: This option sets the VLAN ID on the LAN port.
         required: false
@@ -145,11 +199,41 @@ failed:
     type: bool
     returned: always
     sample: 'True/False'
+abandoned:
+    description: Labels of items not sent because host_deadline ran out.
+    type: list
+    returned: when a session was available
+    sample: '["VLAN ID"]'
+error_kind:
+    description: Class of the request failure after retries, one of timeout, refused, tls, http5xx, nosession, bad_credentials, connection, circuit_open or deadline.
+    type: str
+    returned: when a request to the phone failed
+    sample: 'timeout'
+items:
+    description: Per-item write results in the order they were sent, with item code, label, value, HTTP status, success and elapsed seconds. In check mode, the items that would be sent, marked check_mode, after reading the phone as read_before_write asks.
+    type: list
+    returned: when a session was available
+    sample: '[{"item": "41d044f", "label": "VLAN ID", "value": "222", "ok": true, "status_code": 200, "elapsed": 0.08}]'
+unchanged:
+    description: Labels of requested items that already had the requested value and were not sent.
+    type: list
+    returned: when read_before_write is true and a session was available
+    sample: '["VLAN ID", "VLAN mode"]'
 message:
     description: The output messages that the module generates.
     type: list
     returned: always
     sample: '["Message 1", "Message 2"]'
+rebooted:
+    description: True if the phone was logged off, which saves the settings and reboots it.
+    type: bool
+    returned: always
+    sample: 'True/False'
+reboot_deferred:
+    description: True if the phone's reboot was queued for rolling_reboot instead of done now.
+    type: bool
+    returned: when defer_reboot is true and something changed
+    sample: 'True/False'
 session_id:
     description: The session ID used for API calls.
     type: str
@@ -160,267 +244,56 @@ from ansible.module_utils.basic import AnsibleModule
 # import module snippets from community.necsipphonetool
 from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import *
 
-def run_module():
-    # define available arguments/parameters a user can pass to the module
-    module_args = dict(
-        default_gateway=dict(type='str', required=False),
-        dhcp_mode=dict(type='bool', required=False),
-        dns_address=dict(type='str', required=False),
-        force_http=dict(type='bool', required=False, Default=False),
-        host=dict(type='str', required=True),
-        ip_address=dict(type='str', required=False),
-        keep_session=dict(type='bool', required=False, Default=False),
-        lldp_mode=dict(type='bool', required=False, Default=False),
-        password=dict(type='str', required=False, Default='6633222', no_log=True),
-        port_speed=dict(type='str', required=False, choices=['auto', '10half', '10full', '100half', '100full']),
-        session_id=dict(type='str', required=False),
-        spare_default_gateway=dict(type='str', required=False),
-        spare_dns_address=dict(type='str', required=False),
-        spare_ip_address_mode=dict(type='str', required=False),
-        spare_ip_address=dict(type='str', required=False),
-        spare_subnet_mask=dict(type='str', required=False),
-        subnet_mask=dict(type='str', required=False),
-        username=dict(type='str', required=False, Default='admin', no_log=True),
-        verify_certs=dict(type='bool', required=False, Default=False),
-        vlan_id=dict(type='int', required=False),
-        vlan_mode=dict(type='bool', required=False, Default=False),
-        vlan_priority=dict(type='int', required=False, choices=[0, 1, 2, 3, 4, 5, 6, 7])
-    )
+# define available arguments/parameters a user can pass to the module
+module_args = dict(
+    default_gateway=dict(type='str', required=False),
+    dhcp_mode=dict(type='bool', required=False),
+    dns_address=dict(type='str', required=False),
+    connect_timeout=dict(type='float', required=False, default=10),
+    defer_reboot=dict(type='bool', required=False, default=False),
+    force_http=dict(type='bool', required=False, default=False),
+    host=dict(type='str', required=True),
+    ip_address=dict(type='str', required=False),
+    host_deadline=dict(type='float', required=False),
+    insecure_secondary=dict(type='bool', required=False, default=False),
+    keep_session=dict(type='bool', required=False, default=False),
+    lldp_mode=dict(type='bool', required=False),
+    metrics_file=dict(type='path', required=False),
+    password=dict(type='str', required=False, no_log=True),
+    port_speed=dict(type='str', required=False, choices=['auto', '10half', '10full', '100half', '100full']),
+    profile_file=dict(type='path', required=False),
+    read_before_write=dict(type='bool', required=False, default=True),
+    read_timeout=dict(type='float', required=False, default=30),
+    session_cache=dict(type='bool', required=False, default=True),
+    session_id=dict(type='str', required=False),
+    session_ttl=dict(type='int', required=False, default=300),
+    spare_default_gateway=dict(type='str', required=False),
+    spare_dns_address=dict(type='str', required=False),
+    spare_ip_address_mode=dict(type='str', required=False),
+    spare_ip_address=dict(type='str', required=False),
+    spare_subnet_mask=dict(type='str', required=False),
+    subnet_mask=dict(type='str', required=False),
+    trace_file=dict(type='path', required=False),
+    username=dict(type='str', required=False, no_log=True),
+    verify_certs=dict(type='bool', required=False, default=False),
+    vlan_id=dict(type='int', required=False),
+    vlan_mode=dict(type='bool', required=False),
+    vlan_priority=dict(type='int', required=False, choices=[0, 1, 2, 3, 4, 5, 6, 7])
+)
 
-    result = dict(
-        changed=False,
-        failed=True,
-        original_message = '',
-        message = []
-    )
-
-    module = AnsibleModule(
-        argument_spec=module_args,
-        supports_check_mode=True
-    )
-
-    if module.check_mode:
-        module.exit_json(**result)
-
-    result['original_message'] = module.params['host']
-
-    # Set variables from module arguments
-    defaultGateway = module.params['default_gateway']
-    dhcpMode = module.params['dhcp_mode']
-    dnsAddress = module.params['dns_address']
-    forceHttp = module.params['force_http']
-    hostName = module.params['host']
-    ipAddress = module.params['ip_address']
-    keepSession = module.params['keep_session']
-    lldpMode = module.params['lldp_mode']
-    password = module.params['password']
-    portSpeed = module.params['port_speed']
-    sessionId = module.params['session_id']
-    spareDefaultGateway = module.params['spare_default_gateway']
-    spareDnsAddress = module.params['spare_dns_address']
-    spareIpAddressMode = module.params['spare_ip_address_mode']
-    spareIpAddress = module.params['spare_ip_address']
-    spareSubnetMask = module.params['spare_subnet_mask']
-    subnetMask = module.params['subnet_mask']
-    userName = module.params['username']
-    verifyCerts = module.params['verify_certs']
-    vlanId = module.params['vlan_id']
-    vlanMode = module.params['vlan_mode']
-    vlanPriority = module.params['vlan_priority']
-
-    if forceHttp:
-        hostName = 'http://' + hostName
-    else:
-        hostName = 'https://' + hostName
+# Apply the requested LAN port settings to one phone and return the task result
+def setLanPort(params):
+    return runModuleWriteTask(params, writeItemsFromOptions('lan_port', params))[0]
 
+def run_module():
     module = AnsibleModule(
         argument_spec=module_args,
         supports_check_mode=True
     )
 
-    if module.check_mode:
-        module.exit_json(**result)
-
-    if not sessionId:
-        logonResponse, sessionId = logOnPhone(hostName, userName, password, False, verifyCerts, False)
-        if logonResponse.status_code != 200 or not sessionId:
-            result['failed'] = True
-        else:
-             result['failed'] = False
-    if sessionId:
-        # Set default gateway
-        if defaultGateway:
-            defaultGatewayResponse = setTwoParameters(hostName, sessionId, '4020403', defaultGateway, 'type', 'ip', False, verifyCerts, False)
-            if defaultGatewayResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set default gateway')
-            else:
-                result['failed'] = False
-                result['message'].append('Default gateway set to ' + defaultGateway)
-        # Set DHCP mode
-        if dhcpMode is not None:
-            if dhcpMode == True:
-                dhcpMode = '1'
-            else:
-                dhcpMode = '0'
-            dhcpModeResponse = setSingleItem(hostName, sessionId, '4020401', dhcpMode, False, verifyCerts, False)
-            if dhcpModeResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('DHCP mode not set')
-            else:
-                result['failed'] = False
-                result['message'].append('DHCP mode set to ' + dhcpMode)
-        # Set DNS address
-        if dnsAddress:
-            dnsAddressResponse = setTwoParameters(hostName, sessionId, '4020405', dnsAddress, 'type', 'ip', False, verifyCerts, False)
-            if dnsAddressResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('DNS address not set')
-            else:
-                result['failed'] = False
-                result['message'].append('DNS address set to ' + dnsAddress)
-        # Set LLDP mode
-        if lldpMode is not None:
-            if lldpMode == True:
-                lldpMode = '1'
-            else:
-                lldpMode = '0'
-            lldpModeResponse = setSingleItem(hostName, sessionId, '44604f3', lldpMode, False, verifyCerts, False)
-            if lldpModeResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('LLDP mode not set')
-            else:
-                result['failed'] = False
-                result['message'].append('LLDP mode set to ' + lldpMode)
-        # Set IP address
-        if ipAddress:
-            ipAddressResponse = setTwoParameters(hostName, sessionId, '4020402', ipAddress, 'type', 'ip', False, verifyCerts, False)
-            if ipAddressResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('IP address not set')
-            else:
-                result['failed'] = False
-                result['message'].append('IP address set to ' + ipAddress)
-        # Set port speed
-        if portSpeed:
-            if portSpeed == '10half':
-                portSpeed = '4'
-            elif portSpeed == '10full':
-                portSpeed = '3'
-            elif portSpeed == '100half':
-                portSpeed = '2'
-            elif portSpeed == '100full':
-                portSpeed = '1'
-            else:
-                portSpeed = '0'
-            portSpeedResponse = setSingleItem(hostName, sessionId, '41d044d', portSpeed, False, verifyCerts, False)
-            if portSpeedResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Port speed not set')
-            else:
-                result['failed'] = False
-                result['message'].append('Port speed set to ' + portSpeed)
-        # Set subnet mask
-        if subnetMask:
-            subnetMaskResponse = setTwoParameters(hostName, sessionId, '4020404', subnetMask, 'type', 'ip', False, verifyCerts, False)
-            if subnetMaskResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Subnet mask not set')
-            else:
-                result['failed'] = False
-                result['message'].append('Subnet mask set to ' + subnetMask)
-        # Set VLAN ID
-        if vlanId:
-            vlanId = str(vlanId)
-            vlanIdResponse = setSingleItem(hostName, sessionId, '41d044f', vlanId, False, verifyCerts, False)
-            if vlanIdResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('VLAN ID not set')
-            else:
-                result['failed'] = False
-                result['message'].append('VLAN ID set to ' + vlanId)
-        # Set VLAN mode
-        if vlanMode is not None:
-            if vlanMode == True:
-                vlanMode = '1'
-            else:
-                vlanMode = '0'
-            vlanModeResponse = setSingleItem(hostName, sessionId, '41d044e', vlanMode, False, verifyCerts, False)
-            if vlanModeResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('VLAN mode not set')
-            else:
-                result['failed'] = False
-                result['message'].append('VLAN mode set to ' + vlanMode)
-        # Set VLAN priority
-        if vlanPriority:
-            vlanPriority = str(vlanPriority)
-            vlanPriorityResponse = setSingleItem(hostName, sessionId, '41d0450', vlanPriority, False, verifyCerts, False)
-            if vlanPriorityResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('VLAN priority not set')
-            else:
-                result['failed'] = False
-                result['message'].append('VLAN priority set to ' + vlanPriority)
-        # Set spare default gateway
-        if spareDefaultGateway:
-            spareDefaultGatewayResponse = setTwoParameters(hostName, sessionId, '4442002', spareDefaultGateway, 'type', 'ip', False, verifyCerts, False)
-            if spareDefaultGatewayResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Spare default gateway not set')
-            else:
-                result['failed'] = False
-                result['message'].append('Spare default gateway set to ' + spareDefaultGateway)
-        # Set spare DNS address
-        if spareDnsAddress:
-            spareDnsAddressResponse = setTwoParameters(hostName, sessionId, '4442004', spareDnsAddress, 'type', 'ip', False, verifyCerts, False)
-            if spareDnsAddressResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Spare DNS address not set')
-            else:
-                result['failed'] = False
-                result['message'].append('Spare DNS address set to ' + spareDnsAddress)
-        # Set spare IP address
-        if spareIpAddress:
-            spareIpAddressResponse = setTwoParameters(hostName, sessionId, '4442001', spareIpAddress, 'type', 'ip', False, verifyCerts, False)
-            if spareIpAddressResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Spare IP address not set')
-            else:
-                result['failed'] = False
-                result['message'].append('Spare IP address set to ' + spareIpAddress)
-        # Set spare ip address mode
-        if spareIpAddressMode:
-            if spareIpAddressMode == 'spare':
-                spareIpAddressMode = '1'
-            elif spareIpAddressMode == 'backup':
-                spareIpAddressMode = '2'
-            else:
-                spareIpAddressMode = '0'
-            spareIpAddressModeResponse = setSingleItem(hostName, sessionId, '44304f2', spareIpAddressMode, False, verifyCerts, False)
-            if spareIpAddressModeResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Spare IP address mode not set')
-            else:
-                result['failed'] = False
-                result['message'].append('Spare IP address mode set to ' + spareIpAddressMode)
-        # Set spare subnet mask
-        if spareSubnetMask:
-            spareSubnetMaskResponse = setTwoParameters(hostName, sessionId, '4442003', spareSubnetMask, 'type', 'ip', False, verifyCerts, False)
-            if spareSubnetMaskResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Spare subnet mask not set')
-            else:
-                result['failed'] = False
-                result['message'].append('Spare subnet mask set to ' + spareSubnetMask)
-        if not keepSession:
-            # Log off phone and reboot
-            logOffResponse = logOffPhone(hostName, sessionId, False, verifyCerts, False)
-            if logOffResponse.status_code != 200:
-                result['failed'] = True
-        else:
-            result['session_id'] = sessionId
-        result['changed'] = True
+    result = runObservedTask(setLanPort, dict(module.params, check_mode=module.check_mode))
+    if 'msg' in result:
+        module.fail_json(**result)
 
     module.exit_json(**result)
 
@@ -428,4 +301,4 @@ def main():
     run_module()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
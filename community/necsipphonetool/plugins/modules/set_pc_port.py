@@ -16,22 +16,47 @@ version_added: "0.0.3"
 description: This module sets pc port settings on a NEC-SIP IP phone.
 
 options:
+    defer_reboot:
+        description: Leave the session open with the changes unsaved and queue the phone's reboot on the controller instead of logging off. Release queued reboots in waves with rolling_reboot before the phone's session times out.
+        required: false
+        type: bool
+        default: false
     eapol_forwarding:
         description: This option enables or disables EAPOL forwarding on the PC port.
         required: false
         type: bool
+    connect_timeout:
+        description: Seconds to wait for a connection to the phone before retrying or failing.
+        required: false
+        type: float
+        default: 10
     force_http:
         description: This option forces the use of HTTP instead of HTTPS.
         required: false
         type: bool
+        default: false
     host:
         description: IPv4 or hostname of phone.
         required: true
         type: str
+    host_deadline:
+        description: Overall seconds allowed for all requests to the phone in this task. Writes still pending when it runs out are abandoned and reported. No limit if not given.
+        required: false
+        type: float
+    insecure_secondary:
+        description: Use HTTP if the HTTPS connection to the phone fails. The protocol that worked is remembered on the controller per phone, so later tasks go straight to it.
+        required: false
+        type: bool
+        default: false
     keep_session:
         description: This option keeps the session open after setting options. A logout or hard reset will be required at the end of your playbook.
         required: false
         type: bool
+        default: false
+    metrics_file:
+        description: Record the latency, bytes, status codes and retries of every request to the phone and add them to this file on the controller. Written as Prometheus text if the name ends in .prom, otherwise as JSON. A .prom file keeps its running totals in a .json file beside it.
+        required: false
+        type: path
     password:
         description: Password to log into phone.
         required: true
@@ -48,10 +73,38 @@ options:
         description: This option sets the LAN port speed and duplex on the phone (auto, 10half, 10full, 100half, 100full).
         required: false
         type: str
+    profile_file:
+        description: Run the task under cProfile and add its stats to this pstats file on the controller, for finding where time goes outside the phone. Read it with python -m pstats.
+        required: false
+        type: path
+    read_before_write:
+        description: Read the current value of each requested item first and only send the items that differ. If nothing differs the phone is not logged off, so it is not rebooted. Settings are read as get_config reads them, see its notes.
+        required: false
+        type: bool
+        default: true
+    read_timeout:
+        description: Seconds to wait for the phone to answer a request before retrying or failing.
+        required: false
+        type: float
+        default: 30
+    session_cache:
+        description: Reuse a session cached on the controller by an earlier task against the same phone, and cache kept sessions for later tasks. Sessions are dropped on logoff or reset.
+        required: false
+        type: bool
+        default: true
     session_id:
         description: Logon session ID to use for API calls. If not provided, a new logon session will be created.
         required: false
         type: str
+    session_ttl:
+        description: Seconds a cached session may sit unused before a new logon is made.
+        required: false
+        type: int
+        default: 300
+    trace_file:
+        description: Add a span for the task and for each request to the phone to this Chrome trace file on the controller. Open it in chrome://tracing or Perfetto to see the timeline of a run.
+        required: false
+        type: path
     username:
         description: Username to log into phone.
         required: true
@@ -60,6 +113,7 @@ options:
         description: This option verifies the SSL certificate on the phone.
         required: false
         type: bool
+        default: false
     vlan_id:
         description: This option sets the VLAN ID on the LAN port.
         required: false
@@ -105,11 +159,41 @@ failed:
     type: bool
     returned: always
     sample: 'True/False'
+abandoned:
+    description: Labels of items not sent because host_deadline ran out.
+    type: list
+    returned: when a session was available
+    sample: '["VLAN ID"]'
+error_kind:
+    description: Class of the request failure after retries, one of timeout, refused, tls, http5xx, nosession, bad_credentials, connection, circuit_open or deadline.
+    type: str
+    returned: when a request to the phone failed
+    sample: 'timeout'
+items:
+    description: Per-item write results in the order they were sent, with item code, label, value, HTTP status, success and elapsed seconds. In check mode, the items that would be sent, marked check_mode, after reading the phone as read_before_write asks.
+    type: list
+    returned: when a session was available
+    sample: '[{"item": "41d044f", "label": "VLAN ID", "value": "222", "ok": true, "status_code": 200, "elapsed": 0.08}]'
+unchanged:
+    description: Labels of requested items that already had the requested value and were not sent.
+    type: list
+    returned: when read_before_write is true and a session was available
+    sample: '["VLAN ID", "VLAN mode"]'
 message:
     description: The output messages that the module generates.
     type: list
     returned: always
     sample: '["Message 1", "Message 2"]'
+rebooted:
+    description: True if the phone was logged off, which saves the settings and reboots it.
+    type: bool
+    returned: always
+    sample: 'True/False'
+reboot_deferred:
+    description: True if the phone's reboot was queued for rolling_reboot instead of done now.
+    type: bool
+    returned: when defer_reboot is true and something changed
+    sample: 'True/False'
 session_id:
     description: The session ID used for API calls.
     type: str
@@ -120,181 +204,53 @@ from ansible.module_utils.basic import AnsibleModule
 # import module snippets from community.necsipphonetool
 from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import *
 
-def run_module():
-    # define available arguments/parameters a user can pass to the module
-    module_args = dict(
-        eapol_forwarding=dict(type='bool', required=False),
-        force_http=dict(type='bool', required=False, Default=False),
-        host=dict(type='str', required=True),
-        keep_session=dict(type='bool', required=False, Default=False),
-        password=dict(type='str', required=False, Default='6633222', no_log=True),
-        port_available=dict(type='bool', required=False),
-        port_security=dict(type='bool', required=False),
-        port_speed=dict(type='str', required=False, choices=['auto', '10half', '10full', '100half', '100full']),
-        session_id=dict(type='str', required=False),
-        username=dict(type='str', required=False, Default='admin', no_log=True),
-        verify_certs=dict(type='bool', required=False, Default=False),
-        vlan_id=dict(type='int', required=False),
-        vlan_mode=dict(type='bool', required=False),
-        vlan_priority=dict(type='int', required=False, choices=[0, 1, 2, 3, 4, 5, 6, 7])
-    )
-
-    result = dict(
-        changed=False,
-        failed=True,
-        original_message = '',
-        message = []
-        )
+# define available arguments/parameters a user can pass to the module
+module_args = dict(
+    connect_timeout=dict(type='float', required=False, default=10),
+    defer_reboot=dict(type='bool', required=False, default=False),
+    eapol_forwarding=dict(type='bool', required=False),
+    force_http=dict(type='bool', required=False, default=False),
+    host=dict(type='str', required=True),
+    host_deadline=dict(type='float', required=False),
+    insecure_secondary=dict(type='bool', required=False, default=False),
+    keep_session=dict(type='bool', required=False, default=False),
+    metrics_file=dict(type='path', required=False),
+    password=dict(type='str', required=False, no_log=True),
+    port_available=dict(type='bool', required=False),
+    port_security=dict(type='bool', required=False),
+    port_speed=dict(type='str', required=False, choices=['auto', '10half', '10full', '100half', '100full']),
+    profile_file=dict(type='path', required=False),
+    read_before_write=dict(type='bool', required=False, default=True),
+    read_timeout=dict(type='float', required=False, default=30),
+    session_cache=dict(type='bool', required=False, default=True),
+    session_id=dict(type='str', required=False),
+    session_ttl=dict(type='int', required=False, default=300),
+    trace_file=dict(type='path', required=False),
+    username=dict(type='str', required=False, no_log=True),
+    verify_certs=dict(type='bool', required=False, default=False),
+    vlan_id=dict(type='int', required=False),
+    vlan_mode=dict(type='bool', required=False),
+    vlan_priority=dict(type='int', required=False, choices=[0, 1, 2, 3, 4, 5, 6, 7])
+)
 
-    module = AnsibleModule(
-        argument_spec=module_args,
-        supports_check_mode=True
-    )
-
-    if module.check_mode:
-        module.exit_json(**result)
-
-    result['original_message'] = module.params['host']
-    
-    # Set variables from module arguments
-    eapol_forwarding = module.params['eapol_forwarding']
-    forceHttp = module.params['force_http']
-    hostName = module.params['host']
-    keepSession = module.params['keep_session']
-    password = module.params['password']
-    portAvailable = module.params['port_available']
-    portSecurity = module.params['port_security']
-    portSpeed = module.params['port_speed']
-    sessionId = module.params['session_id']
-    userName = module.params['username']
-    verifyCerts = module.params['verify_certs']
-    vlanId = module.params['vlan_id']
-    vlanMode = module.params['vlan_mode']
-    vlanPriority = module.params['vlan_priority']
-
-    if forceHttp:
-        hostName = 'http://' + hostName
-    else:
-        hostName = 'https://' + hostName
+# Apply the requested PC port settings to one phone and return the task result
+def setPcPort(params):
+    return runModuleWriteTask(params, writeItemsFromOptions('pc_port', params))[0]
 
+def run_module():
     module = AnsibleModule(
         argument_spec=module_args,
         supports_check_mode=True
     )
 
-    if module.check_mode:
-        module.exit_json(**result)
+    result = runObservedTask(setPcPort, dict(module.params, check_mode=module.check_mode))
+    if 'msg' in result:
+        module.fail_json(**result)
 
-    if not sessionId:
-        logonResponse, sessionId = logOnPhone(hostName, userName, password, True, verifyCerts, False)
-        if logonResponse.status_code != 200 or not sessionId:
-            result['failed'] = True
-        else:
-             result['failed'] = False
-    if sessionId:
-        # Set EAPOL forwarding
-        if eapol_forwarding is not None:
-            if eapol_forwarding == True:
-                eapolForwarding = '1'
-            else:
-                eapolForwarding = '0'
-            setEapolForwardingResponse = setSingleItem(hostName, sessionId, '41e0456', eapol_forwarding, False, verifyCerts, False)
-            if setEapolForwardingResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set EAPOL forwarding')
-            else:
-                result['changed'] = True
-                result['message'].append('EAPOL forwarding set to ' + eapolForwarding)
-        # Set port available    
-        if portAvailable is not None:
-            if portAvailable == False:
-                portAvailable = '1'
-            else:
-                portAvailable = '0'
-            setPortAvailableResponse = setSingleItem(hostName, sessionId, '41e0455', portAvailable, False, verifyCerts, False)
-            if setPortAvailableResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set port available')
-            else:
-                result['changed'] = True
-                result['message'].append('Port available set to ' + portAvailable)
-        # Set port security
-        if portSecurity is not None:
-            if portSecurity == True:
-                portSecurity = '1'
-            else:
-                portSecurity = '0'
-            setPortSecurityResponse = setSingleItem(hostName, sessionId, '41e0415', portSecurity, False, verifyCerts, False)
-            if setPortSecurityResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set port security')
-            else:
-                result['changed'] = True
-                result['message'].append('Port security set to ' + portSecurity)
-        # Set port speed
-        if portSpeed:
-            if portSpeed == '10half':
-                portSpeed = '4'
-            elif portSpeed == '10full':
-                portSpeed = '3'
-            elif portSpeed == '100half':
-                portSpeed = '2'
-            elif portSpeed == '100full':
-                portSpeed = '1'
-            else:
-                portSpeed = '0'
-            portSpeedResponse = setSingleItem(hostName, sessionId, '41e0451', portSpeed, False, verifyCerts, False)
-            if portSpeedResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Port speed not set')
-            else:
-                result['failed'] = False
-                result['message'].append('Port speed set to ' + portSpeed)
-        # Set VLAN ID
-        if vlanId:
-            vlanId = str(vlanId)
-            vlanIdResponse = setSingleItem(hostName, sessionId, '41e0453', vlanId, False, verifyCerts, False)
-            if vlanIdResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('VLAN ID not set')
-            else:
-                result['failed'] = False
-                result['message'].append('VLAN ID set to ' + vlanId)
-        # Set VLAN mode
-        if vlanMode is not None:
-            if vlanMode == True:
-                vlanMode = '1'
-            else:
-                vlanMode = '0'
-            vlanModeResponse = setSingleItem(hostName, sessionId, '41e0452', vlanMode, False, verifyCerts, False)
-            if vlanModeResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('VLAN mode not set')
-            else:
-                result['failed'] = False
-                result['message'].append('VLAN mode set to ' + vlanMode)
-        # Set VLAN priority
-        if vlanPriority:
-            vlanPriority = str(vlanPriority)
-            vlanPriorityResponse = setSingleItem(hostName, sessionId, '41e0454', vlanPriority, False, verifyCerts, False)
-            if vlanPriorityResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('VLAN priority not set')
-            else:
-                result['failed'] = False
-                result['message'].append('VLAN priority set to ' + vlanPriority)
-        if not keepSession:
-            # Log off phone and reboot
-            logOffResponse = logOffPhone(hostName, sessionId, False, verifyCerts, False)
-            if logOffResponse.status_code != 200:
-                result['failed'] = True
-        else:
-            result['session_id'] = sessionId
-        result['changed'] = True
     module.exit_json(**result)
 
 def main():
     run_module()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
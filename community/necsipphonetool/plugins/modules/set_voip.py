@@ -17,6 +17,16 @@ version_added: "0.0.4"
 description: This module sets pc port settings on a NEC-SIP IP phone.
 
 options:
+    connect_timeout:
+        description: Seconds to wait for a connection to the phone before retrying or failing.
+        required: false
+        type: float
+        default: 10
+    defer_reboot:
+        description: Leave the session open with the changes unsaved and queue the phone's reboot on the controller instead of logging off. Release queued reboots in waves with rolling_reboot before the phone's session times out.
+        required: false
+        type: bool
+        default: false
     encryption_auth_mode:
         description: Enable or disable encryption mode.
         required: false
@@ -29,22 +39,61 @@ options:
         description: This option forces the use of HTTP instead of HTTPS.
         required: false
         type: bool
+        default: false
     host:
         description: IPv4 or hostname of phone.
         required: true
         type: str
+    host_deadline:
+        description: Overall seconds allowed for all requests to the phone in this task. Writes still pending when it runs out are abandoned and reported. No limit if not given.
+        required: false
+        type: float
+    insecure_secondary:
+        description: Use HTTP if the HTTPS connection to the phone fails. The protocol that worked is remembered on the controller per phone, so later tasks go straight to it.
+        required: false
+        type: bool
+        default: false
     keep_session:
         description: This option keeps the session open after setting options. A logout or hard reset will be required at the end of your playbook.
         required: false
         type: bool
+        default: false
+    metrics_file:
+        description: Record the latency, bytes, status codes and retries of every request to the phone and add them to this file on the controller. Written as Prometheus text if the name ends in .prom, otherwise as JSON. A .prom file keeps its running totals in a .json file beside it.
+        required: false
+        type: path
     password:
         description: Password to log into phone.
         required: true
         type: str
+    profile_file:
+        description: Run the task under cProfile and add its stats to this pstats file on the controller, for finding where time goes outside the phone. Read it with python -m pstats.
+        required: false
+        type: path
+    read_before_write:
+        description: Read the current value of each requested item first and only send the items that differ. If nothing differs the phone is not logged off, so it is not rebooted. Settings the phone does not show back, such as sip_password, encryption_otp and the ports of SIP servers two to four, are sent only along with another change unless write_unreadable is true. Settings are read as get_config reads them, see its notes.
+        required: false
+        type: bool
+        default: true
+    read_timeout:
+        description: Seconds to wait for the phone to answer a request before retrying or failing.
+        required: false
+        type: float
+        default: 30
+    session_cache:
+        description: Reuse a session cached on the controller by an earlier task against the same phone, and cache kept sessions for later tasks. Sessions are dropped on logoff or reset.
+        required: false
+        type: bool
+        default: true
     session_id:
         description: Logon session ID to use for API calls. If not provided, a new logon session will be created.
         required: false
         type: str
+    session_ttl:
+        description: Seconds a cached session may sit unused before a new logon is made.
+        required: false
+        type: int
+        default: 300
     sip_user_id:
         description: SIP user ID to set.
         required: false
@@ -86,17 +135,21 @@ options:
         required: false
         type: str
     sip_server_two_port:
-        description: SIP server two port to set.
+        description: SIP server two port to set. The phone keeps it under the item code of sip_server_two, so when both are set the task warns that it cannot check the phone kept both, and as it cannot be read back it is sent only along with another change unless write_unreadable is true.
         required: false
         type: str
     sip_server_three_port:
-        description: SIP server three port to set.
+        description: SIP server three port to set. The phone keeps it under the item code of sip_server_three, so when both are set the task warns that it cannot check the phone kept both, and as it cannot be read back it is sent only along with another change unless write_unreadable is true.
         required: false
         type: str
     sip_server_four_port:
-        description: SIP server four port to set.
+        description: SIP server four port to set. The phone keeps it under the item code of sip_server_four, so when both are set the task warns that it cannot check the phone kept both, and as it cannot be read back it is sent only along with another change unless write_unreadable is true.
         required: false
         type: str
+    trace_file:
+        description: Add a span for the task and for each request to the phone to this Chrome trace file on the controller. Open it in chrome://tracing or Perfetto to see the timeline of a run.
+        required: false
+        type: path
     username:
         description: Username to log into phone.
         required: true
@@ -105,6 +158,12 @@ options:
         description: This option verifies the SSL certificate on the phone.
         required: false
         type: bool
+        default: false
+    write_unreadable:
+        description: With read_before_write, also send the settings the phone does not show back when nothing else changed. They cannot be compared, so this saves and reboots the phone on every run. Needed to change only such a setting, for example a new sip_password.
+        required: false
+        type: bool
+        default: false
 author:
     - Raymond Rizzo (@zombat)
 '''
@@ -138,11 +197,46 @@ failed:
     type: bool
     returned: always
     sample: 'True/False'
+abandoned:
+    description: Labels of items not sent because host_deadline ran out.
+    type: list
+    returned: when a session was available
+    sample: '["VLAN ID"]'
+error_kind:
+    description: Class of the request failure after retries, one of timeout, refused, tls, http5xx, nosession, bad_credentials, connection, circuit_open or deadline.
+    type: str
+    returned: when a request to the phone failed
+    sample: 'timeout'
+items:
+    description: Per-item write results in the order they were sent, with item code, label, value, HTTP status, success and elapsed seconds. In check mode, the items that would be sent, marked check_mode, after reading the phone as read_before_write asks.
+    type: list
+    returned: when a session was available
+    sample: '[{"item": "41d044f", "label": "VLAN ID", "value": "222", "ok": true, "status_code": 200, "elapsed": 0.08}]'
+unchanged:
+    description: Labels of requested items that already had the requested value and were not sent.
+    type: list
+    returned: when read_before_write is true and a session was available
+    sample: '["VLAN ID", "VLAN mode"]'
+unverified:
+    description: Labels of requested settings the phone does not show back that were not sent, because nothing else changed and write_unreadable is false.
+    type: list
+    returned: when read_before_write is true and a session was available
+    sample: '["SIP password"]'
 message:
     description: The output messages that the module generates.
     type: list
     returned: always
     sample: '["Message 1", "Message 2"]'
+rebooted:
+    description: True if the phone was logged off, which saves the settings and reboots it.
+    type: bool
+    returned: always
+    sample: 'True/False'
+reboot_deferred:
+    description: True if the phone's reboot was queued for rolling_reboot instead of done now.
+    type: bool
+    returned: when defer_reboot is true and something changed
+    sample: 'True/False'
 session_id:
     description: The session ID used for API calls.
     type: str
@@ -153,253 +247,64 @@ from ansible.module_utils.basic import AnsibleModule
 # import module snippets from community.necsipphonetool
 from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import *
 
-def run_module():
-    # define available arguments/parameters a user can pass to the module
-    module_args = dict(
-        encryption_auth_mode=dict(type='bool', required=False),
-        encryption_otp=dict(type='str', required=False),
-        force_http=dict(type='bool', required=False, Default=False),
-        host=dict(type='str', required=True),
-        keep_session=dict(type='bool', required=False, Default=False),
-        password=dict(type='str', required=False, Default='6633222', no_log=True),
-        session_id=dict(type='str', required=False),
-        sip_user_id=dict(type='str', required=False),
-        sip_password=dict(type='str', required=False, no_log=True),
-        sip_extension=dict(type='str', required=False),
-        sip_backup_login=dict(type='bool', required=False),
-        sip_server_one=dict(type='str', required=False),
-        sip_server_two=dict(type='str', required=False),
-        sip_server_three=dict(type='str', required=False),
-        sip_server_four=dict(type='str', required=False),
-        sip_access_mode=dict(type='str', required=False, choices=['normal', 'remote']),
-        sip_server_one_port=dict(type='str', required=False),
-        sip_server_two_port=dict(type='str', required=False),
-        sip_server_three_port=dict(type='str', required=False),
-        sip_server_four_port=dict(type='str', required=False),
-        username=dict(type='str', required=False, Default='admin', no_log=True),
-        verify_certs=dict(type='bool', required=False, Default=False),
-    )
+# define available arguments/parameters a user can pass to the module
+module_args = dict(
+    connect_timeout=dict(type='float', required=False, default=10),
+    defer_reboot=dict(type='bool', required=False, default=False),
+    encryption_auth_mode=dict(type='bool', required=False),
+    encryption_otp=dict(type='str', required=False, no_log=True),
+    force_http=dict(type='bool', required=False, default=False),
+    host=dict(type='str', required=True),
+    host_deadline=dict(type='float', required=False),
+    insecure_secondary=dict(type='bool', required=False, default=False),
+    keep_session=dict(type='bool', required=False, default=False),
+    metrics_file=dict(type='path', required=False),
+    password=dict(type='str', required=False, no_log=True),
+    profile_file=dict(type='path', required=False),
+    read_before_write=dict(type='bool', required=False, default=True),
+    read_timeout=dict(type='float', required=False, default=30),
+    session_cache=dict(type='bool', required=False, default=True),
+    session_id=dict(type='str', required=False),
+    session_ttl=dict(type='int', required=False, default=300),
+    sip_user_id=dict(type='str', required=False),
+    sip_password=dict(type='str', required=False, no_log=True),
+    sip_extension=dict(type='str', required=False),
+    sip_backup_login=dict(type='bool', required=False),
+    sip_server_one=dict(type='str', required=False),
+    sip_server_two=dict(type='str', required=False),
+    sip_server_three=dict(type='str', required=False),
+    sip_server_four=dict(type='str', required=False),
+    sip_access_mode=dict(type='str', required=False, choices=['normal', 'remote']),
+    sip_server_one_port=dict(type='str', required=False),
+    sip_server_two_port=dict(type='str', required=False),
+    sip_server_three_port=dict(type='str', required=False),
+    sip_server_four_port=dict(type='str', required=False),
+    trace_file=dict(type='path', required=False),
+    username=dict(type='str', required=False, no_log=True),
+    verify_certs=dict(type='bool', required=False, default=False),
+    write_unreadable=dict(type='bool', required=False, default=False)
+)
 
-    result = dict(
-        changed=False,
-        failed=True,
-        original_message = '',
-        message = []
-        )
-
-    module = AnsibleModule(
-        argument_spec=module_args,
-        supports_check_mode=True
-    )
-
-    if module.check_mode:
-        module.exit_json(**result)
-
-    result['original_message'] = module.params['host']
-    
-    # Set variables from module arguments
-    encryption_auth_mode = module.params['encryption_auth_mode']
-    encryption_otp = module.params['encryption_otp']
-    forceHttp = module.params['force_http']
-    hostName = module.params['host']
-    keepSession = module.params['keep_session']
-    password = module.params['password']
-    sessionId = module.params['session_id']
-    sipUserId = module.params['sip_user_id']
-    sipPassword = module.params['sip_password']
-    sipExtension = module.params['sip_extension']
-    sipBackupLogin = module.params['sip_backup_login']
-    sipServerOne = module.params['sip_server_one']
-    sipServerTwo = module.params['sip_server_two']
-    sipServerThree = module.params['sip_server_three']
-    sipServerFour = module.params['sip_server_four']
-    sipAccessMode = module.params['sip_access_mode']
-    sipServerOnePort = module.params['sip_server_one_port']
-    sipServerTwoPort = module.params['sip_server_two_port']
-    sipServerThreePort = module.params['sip_server_three_port']
-    sipServerFourPort = module.params['sip_server_four_port']
-    userName = module.params['username']
-    verifyCerts = module.params['verify_certs']
-
-    if forceHttp:
-        hostName = 'http://' + hostName
-    else:
-        hostName = 'https://' + hostName
+# Apply the requested VoIP settings to one phone and return the task result
+def setVoip(params):
+    return runModuleWriteTask(params, writeItemsFromOptions('voip', params))[0]
 
+def run_module():
     module = AnsibleModule(
         argument_spec=module_args,
         supports_check_mode=True
     )
 
-    if module.check_mode:
-        module.exit_json(**result)
+    result = runObservedTask(setVoip, dict(module.params, check_mode=module.check_mode))
+    for warning in result.pop('warnings', []):
+        module.warn(warning)
+    if 'msg' in result:
+        module.fail_json(**result)
 
-    if not sessionId:
-        logonResponse, sessionId = logOnPhone(hostName, userName, password, True, verifyCerts, False)
-        if logonResponse.status_code != 200 or not sessionId:
-            result['failed'] = True
-        else:
-             result['failed'] = False
-    if sessionId:
-        # Set encryption auth mode
-        if encryption_auth_mode is not None:
-            if encryptionAuthMode == True:
-                encryptionAuthMode = '1'
-            else:
-                encryptionAuthMode = '0'
-            encryptionAuthModeResponse = setSingleItem(hostName, sessionId, '40d0427', encryptionAuthMode, False, verifyCerts, False)
-            if encryptionAuthModeResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set encryption auth mode')
-            else:
-                result['failed'] = False
-                result['message'].append('Encryption auth mode set successfully')
-        # Set encryption OTP
-        if encryption_otp:
-            encryptionOtpResponse = setSingleItem(hostName, sessionId, '40d0428', encryption_otp, False, verifyCerts, False)
-            if encryptionOtpResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set encryption OTP')
-            else:
-                result['failed'] = False
-                result['message'].append('Encryption OTP set successfully')
-        # Set SIP user ID
-        if sipUserId:
-            sipUserIdResponse = setSingleItem(hostName, sessionId, '40a0418', sipUserId, False, verifyCerts, False)
-            if sipUserIdResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set SIP user ID')
-            else:
-                result['failed'] = False
-                result['message'].append('SIP user ID set successfully')
-        # Set SIP password
-        if sipPassword:
-            sipPasswordResponse = setSingleItem(hostName, sessionId, '40a0419', sipPassword, False, verifyCerts, False)
-            if sipPasswordResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set SIP password')
-            else:
-                result['failed'] = False
-                result['message'].append('SIP password set successfully')
-        # Set SIP extension
-        if sipExtension:
-            sipExtensionResponse = setSingleItem(hostName, sessionId, '40a041a', sipExtension, False, verifyCerts, False)
-            if sipExtensionResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set SIP extension')
-            else:
-                result['failed'] = False
-                result['message'].append('SIP extension set successfully')
-        # Set SIP backup login
-        if sipBackupLogin is not None:
-            if sipBackupLogin == True:
-                sipBackupLogin = '1'
-            else:
-                sipBackupLogin = '0'
-            sipBackupLoginResponse = setSingleItem(hostName, sessionId, '40a04ca', sipBackupLogin, False, verifyCerts, False)
-            if sipBackupLoginResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set SIP backup login')
-            else:
-                result['failed'] = False
-                result['message'].append('SIP backup login set successfully')
-        # Set SIP server one
-        if sipServerOne:
-            sipServerOneResponse = setTwoParameters(hostName, sessionId, '40b041b', sipServerOne, 'type', 'ip', False, verifyCerts, False)
-            if sipServerOneResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set SIP server one')
-            else:
-                result['failed'] = False
-                result['message'].append('SIP server one set successfully')
-        # Set SIP server two
-        if sipServerTwo:
-            sipServerTwoResponse = setTwoParameters(hostName, sessionId, '40b041c', sipServerTwo, 'type', 'ip', False, verifyCerts, False)
-            if sipServerTwoResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set SIP server two')
-            else:
-                result['failed'] = False
-                result['message'].append('SIP server two set successfully')
-        # Set SIP server three
-        if sipServerThree:
-            sipServerThreeResponse = setTwoParameters(hostName, sessionId, '40b041d', sipServerThree, 'type', 'ip', False, verifyCerts, False)
-            if sipServerThreeResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set SIP server three')
-            else:
-                result['failed'] = False
-                result['message'].append('SIP server three set successfully')
-        # Set SIP server four
-        if sipServerFour:
-            sipServerFourResponse = setTwoParameters(hostName, sessionId, '40b041e', sipServerFour, 'type', 'ip', False, verifyCerts, False)
-            if sipServerFourResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set SIP server four')
-            else:
-                result['failed'] = False
-                result['message'].append('SIP server four set successfully')
-        # Set SIP server one port
-        if sipServerOnePort:
-            sipServerOnePortResponse = setTwoParameters(hostName, sessionId, '40c0423', sipServerOnePort, 'port', 'int', False, verifyCerts, False)
-            if sipServerOnePortResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set SIP server one port')
-            else:
-                result['failed'] = False
-                result['message'].append('SIP server one port set successfully')
-        # Set SIP server two port
-        if sipServerTwoPort:
-            sipServerTwoPortResponse = setTwoParameters(hostName, sessionId, '40b041c', sipServerTwoPort, 'port', 'int', False, verifyCerts, False)
-            if sipServerTwoPortResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set SIP server two port')
-            else:
-                result['failed'] = False
-                result['message'].append('SIP server two port set successfully')
-        # Set SIP server three port
-        if sipServerThreePort:
-            sipServerThreePortResponse = setTwoParameters(hostName, sessionId, '40b041d', sipServerThreePort, 'port', 'int', False, verifyCerts, False)
-            if sipServerThreePortResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set SIP server three port')
-            else:
-                result['failed'] = False
-                result['message'].append('SIP server three port set successfully')
-        # Set SIP server four port
-        if sipServerFourPort:
-            sipServerFourPortResponse = setTwoParameters(hostName, sessionId, '40b041e', sipServerFourPort, 'port', 'int', False, verifyCerts, False)
-            if sipServerFourPortResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set SIP server four port')
-            else:
-                result['failed'] = False
-                result['message'].append('SIP server four port set successfully')
-        # Set SIP access mode
-        if sipAccessMode:
-            if sipAccessMode == 'normal':
-                sipAccessMode = '0'
-            elif sipAccessMode == 'remote':
-                sipAccessMode = '1'
-            sipAccessModeResponse = setSingleItem(hostName, sessionId, '4030406', sipAccessMode, False, verifyCerts, False)
-            if sipAccessModeResponse.status_code != 200:
-                result['failed'] = True
-                result['message'].append('Failed to set SIP access mode')
-            else:
-                result['failed'] = False
-                result['message'].append('SIP access mode set successfully')
-        if not keepSession:
-            # Log off phone and reboot
-            logOffResponse = logOffPhone(hostName, sessionId, False, verifyCerts, False)
-            if logOffResponse.status_code != 200:
-                result['failed'] = True
-        else:
-            result['session_id'] = sessionId
-        result['changed'] = True
     module.exit_json(**result)
 
 def main():
     run_module()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,64 @@
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible.module_utils.common.arg_spec import ArgumentSpecValidator
+from ansible.module_utils.common.parameters import remove_values
+from ansible.plugins.action import ActionBase
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import runObservedTask
+
+
+# Values of the no_log options set in params, suboptions included, so the
+# result can be masked as AnsibleModule would
+def noLogValues(argumentSpec, params):
+    values = set()
+    for name, spec in argumentSpec.items():
+        value = params.get(name)
+        if value in (None, ''):
+            continue
+        if spec.get('no_log'):
+            values.add(str(value))
+        elif spec.get('options') and isinstance(value, dict):
+            values.update(noLogValues(spec['options'], value))
+    return values
+
+
+class NecModuleAction(ActionBase):
+    # Runs a necsipphonetool module in the controller process. The modules only
+    # make HTTP requests to the phones, so with a local connection there is no
+    # need to package them with AnsiballZ and start a new interpreter for every
+    # task. Each task still runs in its own forked worker, so what carries over
+    # between tasks for the same phone is the on-disk session and protocol
+    # caches. Tasks with any other connection run the module as usual.
+    #
+    # Subclasses set moduleArgs to the module's argument spec and runTask to
+    # staticmethod(<module function taking params and returning the result>),
+    # the function run_module runs. A failed task sets msg in its result.
+    # runTask gets the task's check mode as params['check_mode'], as it does
+    # from run_module.
+    moduleArgs = None
+    runTask = None
+
+    TRANSFERS_FILES = False
+
+    def run(self, tmp=None, task_vars=None):
+        result = super(NecModuleAction, self).run(tmp, task_vars)
+        del tmp
+
+        if self._connection.transport != 'local':
+            result.update(self._execute_module(task_vars=task_vars))
+            return result
+
+        # Core has already applied module_defaults to the task args
+        validation = ArgumentSpecValidator(self.moduleArgs).validate(self._task.args)
+        if validation.error_messages:
+            result.update(failed=True, msg='; '.join(validation.error_messages))
+            return result
+
+        taskResult = runObservedTask(self.runTask, dict(validation.validated_parameters, check_mode=self._task.check_mode))
+        if 'msg' in taskResult:
+            taskResult['failed'] = True
+        # Mask no_log values such as passwords, as AnsibleModule would
+        result.update(remove_values(taskResult, noLogValues(self.moduleArgs, validation.validated_parameters)))
+        return result
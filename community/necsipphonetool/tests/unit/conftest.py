@@ -0,0 +1,88 @@
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+
+# Shared fixtures for the unit tests. They run under ansible-test units, or
+# under plain pytest from a checkout, where the collection is linked into a
+# temporary ansible_collections tree first. Tests that talk to a phone use
+# the emulator in module_utils, one emulated phone per test.
+
+import itertools
+import os
+import tempfile
+
+import pytest
+
+collectionRoot = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if os.path.basename(os.path.dirname(os.path.dirname(collectionRoot))) != 'ansible_collections':
+    from ansible.plugins.loader import init_plugin_loader
+    collectionsPath = tempfile.mkdtemp(prefix='necsipphonetool_tests_')
+    os.makedirs(os.path.join(collectionsPath, 'ansible_collections', 'community'))
+    os.symlink(collectionRoot, os.path.join(collectionsPath, 'ansible_collections', 'community', 'necsipphonetool'))
+    init_plugin_loader([collectionsPath])
+
+from ansible.module_utils.common.arg_spec import ArgumentSpecValidator
+from ansible_collections.community.necsipphonetool.plugins.module_utils import nec_phone_tool
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_emulator import PhoneEmulator
+
+# Emulated phones get addresses from 127.1.0.1 up, one per test
+phoneNumbers = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def emulator():
+    with PhoneEmulator(bindAddress='0.0.0.0', httpPort=0) as phoneEmulator:
+        yield phoneEmulator
+
+
+# Hands out host:port of phones no other test has used, as the modules'
+# host option
+@pytest.fixture
+def newPhoneAddress(emulator):
+    def nextPhoneAddress():
+        phoneNumber = next(phoneNumbers)
+        return '127.1.{}.{}:{}'.format(phoneNumber // 256, phoneNumber % 256, emulator.httpPort)
+    return nextPhoneAddress
+
+
+# host:port of the test's phone
+@pytest.fixture
+def phoneAddress(newPhoneAddress):
+    return newPhoneAddress()
+
+
+# The emulator's state for the phone at phoneAddress
+@pytest.fixture
+def emulatedPhone(emulator, phoneAddress):
+    return emulator.phone(phoneAddress.split(':')[0])
+
+
+# Controller-side caches in a temporary directory and no state left over
+# from other tests: circuits, deadlines, pooled sessions and metrics
+@pytest.fixture(autouse=True)
+def controllerState(tmp_path, monkeypatch):
+    systemSettings = nec_phone_tool.phoneVariables['system']
+    for cacheFile in ('fingerprintCacheFile', 'pendingRebootFile', 'protocolCacheFile', 'sessionCacheFile'):
+        monkeypatch.setitem(systemSettings, cacheFile, str(tmp_path / (cacheFile + '.json')))
+    monkeypatch.setitem(systemSettings, 'retryBackoff', 0.01)
+    monkeypatch.setitem(systemSettings, 'retryBackoffMax', 0.05)
+    monkeypatch.setitem(systemSettings, 'insecureSecondary', False)
+    monkeypatch.setitem(systemSettings, 'metrics', False)
+    monkeypatch.setitem(systemSettings, 'trace', False)
+    yield
+    nec_phone_tool.circuitStates.clear()
+    nec_phone_tool.hostDeadlines.clear()
+    nec_phone_tool.protocolCache.clear()
+    nec_phone_tool.resetMetrics()
+    nec_phone_tool.closePhoneSessions()
+
+
+# Task params for a module as AnsibleModule would validate them: defaults
+# filled in from its argument spec, plus check_mode as run_module adds it
+@pytest.fixture
+def taskParams():
+    def validatedParams(moduleArgs, checkMode=False, **options):
+        validation = ArgumentSpecValidator(moduleArgs).validate(options)
+        assert not validation.error_messages
+        return dict(validation.validated_parameters, check_mode=checkMode)
+    return validatedParams
@@ -0,0 +1,110 @@
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+
+import os
+
+import pytest
+
+from ansible.errors import AnsibleParserError
+from ansible.inventory.data import InventoryData
+from ansible.parsing.dataloader import DataLoader
+from ansible.plugins.loader import inventory_loader
+
+pluginName = 'community.necsipphonetool.inventory_from_ipan'
+
+exportHeader = 'IP Address,Extension,Terminal Type,Firmware Version\n'
+
+
+def exportRows(count):
+    return ['10.4.{}.{},{},{},5.2.3.0\n'.format(number // 200, number % 200 + 1, 2000 + number, 'DT800' if number % 2 else 'DT900')
+            for number in range(count)]
+
+
+@pytest.fixture
+def ipanConfig(tmp_path):
+    exportFile = tmp_path / 'export.csv'
+    exportFile.write_text(exportHeader + ''.join(exportRows(50)))
+    configFile = tmp_path / 'phones.ipan.yml'
+    configFile.write_text('''plugin: {}
+ipan_csv_file: {}
+name_column: Extension
+group_columns:
+  - Terminal Type
+hostvar_columns:
+  - Firmware Version
+cache: true
+cache_plugin: ansible.builtin.jsonfile
+cache_connection: {}
+'''.format(pluginName, exportFile, tmp_path / 'cache'))
+    return str(configFile), exportFile
+
+
+# Parse the config into a new inventory as InventoryManager does, writing
+# the cache afterwards. Returns the inventory and the plugin used.
+def parseInventory(configFile):
+    inventory = InventoryData()
+    inventoryPlugin = inventory_loader.get(pluginName)
+    assert inventoryPlugin.verify_file(configFile)
+    inventoryPlugin.parse(inventory, DataLoader(), configFile)
+    inventoryPlugin.update_cache_if_changed()
+    return inventory, inventoryPlugin
+
+
+@pytest.fixture
+def populateCalls(monkeypatch):
+    inventoryModule = type(inventory_loader.get(pluginName))
+    populate = inventoryModule._populate
+    calls = []
+    def recordPopulate(self, buildTable, previousTable=None):
+        counts, table = populate(self, buildTable, previousTable)
+        calls.append(counts)
+        return counts, table
+    monkeypatch.setattr(inventoryModule, '_populate', recordPopulate)
+    return calls
+
+
+def testExportIsParsedIntoHostsGroupsAndCounts(ipanConfig, populateCalls):
+    configFile, exportFile = ipanConfig
+    exportFile.write_text(exportHeader + ''.join(exportRows(3)) + ',2100,DT800,5.2.3.0\n' + exportRows(1)[0])
+    inventory = parseInventory(configFile)[0]
+    assert populateCalls == [{'rows': 5, 'hosts': 3, 'skipped': 1, 'duplicates': 1, 'reused': 0}]
+    assert sorted(inventory.groups['terminal_type_DT800'].get_hosts(), key=str)[0].name == '2001'
+    hostVars = inventory.get_host('2000').vars
+    assert (hostVars['ansible_host'], hostVars['ipan_firmware_version']) == ('10.4.0.1', '5.2.3.0')
+    assert 'ipan_terminal_type' not in hostVars
+    assert inventory.groups['nec_phones'].vars['ipan_row_count'] == 5
+
+
+def testUnchangedExportIsTakenFromTheCache(ipanConfig, populateCalls):
+    configFile, exportFile = ipanConfig
+    firstInventory = parseInventory(configFile)[0]
+    secondInventory = parseInventory(configFile)[0]
+    assert len(populateCalls) == 1
+    assert sorted(secondInventory.hosts) == sorted(firstInventory.hosts)
+    assert secondInventory.get_host('2007').vars == firstInventory.get_host('2007').vars
+
+    # A touched export is hashed once and its new mtime kept
+    exportStat = os.stat(str(exportFile))
+    os.utime(str(exportFile), ns=(exportStat.st_atime_ns, exportStat.st_mtime_ns + 10 ** 9))
+    inventoryPlugin = parseInventory(configFile)[1]
+    assert len(populateCalls) == 1
+    assert inventoryPlugin._cache[inventoryPlugin.cache_key]['fingerprint']['mtime'] == exportStat.st_mtime_ns + 10 ** 9
+
+
+def testOnlyChangedRowsAreParsedAgain(ipanConfig, populateCalls):
+    configFile, exportFile = ipanConfig
+    parseInventory(configFile)
+    rows = exportRows(50)
+    rows[10] = rows[10].replace('5.2.3.0', '5.2.4.0')
+    exportFile.write_text(exportHeader + ''.join(rows))
+    inventory = parseInventory(configFile)[0]
+    assert populateCalls[1]['rows'] == 50
+    assert populateCalls[1]['reused'] == 49
+    assert inventory.get_host('2010').vars['ipan_firmware_version'] == '5.2.4.0'
+
+
+def testMissingColumnsAreReported(ipanConfig):
+    configFile, exportFile = ipanConfig
+    exportFile.write_text('Address,Extension\n10.4.0.1,2000\n')
+    with pytest.raises(AnsibleParserError, match='IP Address'):
+        parseInventory(configFile)
@@ -0,0 +1,70 @@
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+
+import socket
+
+from ansible_collections.community.necsipphonetool.plugins.module_utils import nec_phone_tool
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_async import (
+    logOffPhoneAsync,
+    logOnPhoneAsync,
+    runFleetSync,
+    setSingleItemAsync,
+)
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import PhoneRequestError, circuitStates, metricsSnapshot
+
+
+# A local port nothing listens on
+def closedPort():
+    with socket.socket() as probeSocket:
+        probeSocket.bind(('127.0.0.1', 0))
+        return probeSocket.getsockname()[1]
+
+
+async def setVlanId(client, hostName):
+    logOnResponse, sessionId = await logOnPhoneAsync(client, hostName, 'ADMIN', '6633222')
+    await setSingleItemAsync(client, hostName, sessionId, '41d044f', '20')
+    return sessionId
+
+
+def testFleetCallsAreObservedAsTheSyncCallsAre(emulator, newPhoneAddress, monkeypatch):
+    monkeypatch.setitem(nec_phone_tool.phoneVariables['system'], 'metrics', True)
+    phoneAddresses = [newPhoneAddress() for i in range(3)]
+    results = runFleetSync(['http://' + phoneAddress for phoneAddress in phoneAddresses], setVlanId)
+    for phoneAddress, sessionId in zip(phoneAddresses, results):
+        assert sessionId == emulator.phone(phoneAddress.split(':')[0]).sessionId
+        assert emulator.phone(phoneAddress.split(':')[0]).items == {'41d044f': '20'}
+    series = [(metricSeries['host'], metricSeries['operation'], metricSeries['count']) for metricSeries in metricsSnapshot()['series']]
+    assert sorted(series) == sorted((phoneAddress, operation, 1) for phoneAddress in phoneAddresses for operation in ('logon', 'write'))
+
+
+def testUnreachablePhoneIsRetriedUntilItsCircuitOpens():
+    hostName = 'http://127.0.0.1:{}'.format(closedPort())
+    result = runFleetSync([hostName], setVlanId)[0]
+    assert isinstance(result, PhoneRequestError)
+    assert result.kind == 'refused'
+    assert result.attempts == nec_phone_tool.phoneVariables['system']['circuitFailureThreshold']
+    assert runFleetSync([hostName], setVlanId)[0].kind == 'circuit_open'
+
+
+def testRebootRequestIsSentOnceAndDoesNotTripTheCircuit(phoneAddress, emulatedPhone):
+    hostName = 'http://' + phoneAddress
+    async def logOffRebootingPhone(client, hostName):
+        logOnResponse, sessionId = await logOnPhoneAsync(client, hostName, 'ADMIN', '6633222')
+        emulatedPhone.reboot(60)
+        return await logOffPhoneAsync(client, hostName, sessionId)
+    try:
+        logOffResponse = runFleetSync([hostName], logOffRebootingPhone)[0]
+    finally:
+        emulatedPhone.rebootUntil = 0.0
+    assert logOffResponse.status_code == 200
+    assert logOffResponse.rebootDropped in ('connection', 'timeout')
+    assert logOffResponse.attempts == 1
+    assert phoneAddress not in circuitStates
+
+
+def testSingleGetIsNotRetried():
+    hostName = 'http://127.0.0.1:{}'.format(closedPort())
+    async def probe(client, hostName):
+        return await client.get(hostName, '')
+    assert isinstance(runFleetSync([hostName], probe)[0], ConnectionRefusedError)
+    assert circuitStates == {}
@@ -0,0 +1,198 @@
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+
+import pytest
+
+from ansible_collections.community.necsipphonetool.plugins.module_utils import nec_phone_emulator
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import (
+    PhoneRequestError,
+    buildWritePlan,
+    cachedFingerprint,
+    checkCircuit,
+    circuitStates,
+    decodeBool,
+    decodeInt,
+    diffWritePlan,
+    encodeSetting,
+    fingerprintPhone,
+    getSingleItem,
+    identifyPhonePage,
+    itemCodeRegistry,
+    logOffPhone,
+    logOnPhoneResult,
+    passParameterCodes,
+    passSingleParameter,
+    phoneVariables,
+    readPhoneMac,
+    readPlanValues,
+    readableItem,
+    sharedCodeConflicts,
+    storeFingerprint,
+    valueDecoders,
+)
+
+# A value of each option type and its decoded form read back
+sampleValues = {
+    'bool': [True, False],
+    'bool_inverted': [True, False],
+    'int': [0, 222],
+    'ip': ['10.4.0.1'],
+    'port': ['5060'],
+    'port_speed': ['auto', '100full', '10half'],
+    'secret': ['s3cret'],
+    'sip_access_mode': ['normal', 'remote'],
+    'spare_ip_mode': ['disable', 'spare', 'backup'],
+    'str': ['2001'],
+}
+
+
+def logOn(phoneAddress):
+    hostName = 'http://' + phoneAddress
+    return hostName, logOnPhoneResult(hostName, 'ADMIN', '6633222', False).sessionId
+
+
+def testEveryRegistryEncoderDecodesBack():
+    for section, options in itemCodeRegistry.items():
+        for option, registryItem in options.items():
+            for value in sampleValues[registryItem.valueType]:
+                assert valueDecoders[registryItem.valueType](registryItem.encode(value)) == value, (section, option, value)
+
+
+def testDecodersGiveNoneForValuesTheyDoNotKnow():
+    assert decodeBool('') is None
+    assert decodeInt('') is None
+    assert valueDecoders['port_speed']('9') is None
+
+
+def testPortAvailableIsStoredInverted():
+    assert encodeSetting('pc_port', 'port_available', True).value == '0'
+    assert encodeSetting('pc_port', 'port_available', False).value == '1'
+
+
+def testPortsOfLaterSipServersShareTheServersCode():
+    voip = itemCodeRegistry['voip']
+    for server in ('two', 'three', 'four'):
+        serverItem = voip['sip_server_' + server]
+        portItem = voip['sip_server_{}_port'.format(server)]
+        assert portItem.itemCode == serverItem.itemCode
+        assert portItem.sharedCode and not serverItem.sharedCode
+        assert readableItem(serverItem) and not readableItem(portItem)
+    assert not voip['sip_server_one_port'].sharedCode
+    assert not readableItem(voip['sip_password'])
+
+
+def testWritePlanKeepsTheLastWriteOfAnItemInCodeOrder():
+    writePlan = buildWritePlan([
+        encodeSetting('lan_port', 'vlan_mode', True),
+        encodeSetting('lan_port', 'vlan_id', 10),
+        encodeSetting('lan_port', 'dhcp_mode', False),
+        encodeSetting('lan_port', 'vlan_id', 20),
+    ])
+    assert [(writeItem.itemCode, writeItem.value) for writeItem in writePlan] == [
+        ('4020401', '0'), ('41d044e', '1'), ('41d044f', '20')]
+
+
+def testServerAndItsPortAreBothPlannedAndReportedAsAConflict():
+    writePlan = buildWritePlan([
+        encodeSetting('voip', 'sip_server_two', '10.0.0.2'),
+        encodeSetting('voip', 'sip_server_two_port', '5070'),
+        encodeSetting('voip', 'sip_server_one', '10.0.0.1'),
+    ])
+    assert len(writePlan) == 3
+    assert sharedCodeConflicts(writePlan) == [['SIP server two', 'SIP server two port']]
+    assert sharedCodeConflicts(buildWritePlan([encodeSetting('voip', 'sip_server_two', '10.0.0.2')])) == []
+
+
+def testDiffSendsChangedAndUnreadItems():
+    vlanId = encodeSetting('lan_port', 'vlan_id', 20)
+    vlanMode = encodeSetting('lan_port', 'vlan_mode', True)
+    dhcpMode = encodeSetting('lan_port', 'dhcp_mode', False)
+    currentValues = {('41d044f', None): '20', ('41d044e', None): '0', ('4020401', None): None}
+    changedItems, unchangedItems, unverifiedItems = diffWritePlan([dhcpMode, vlanMode, vlanId], currentValues)
+    assert changedItems == [dhcpMode, vlanMode]
+    assert unchangedItems == [vlanId]
+    assert unverifiedItems == []
+
+
+def testUnreadableItemsGoOnlyWithAChangeOrWhenAskedFor():
+    vlanId = encodeSetting('lan_port', 'vlan_id', 20)
+    sipPassword = encodeSetting('voip', 'sip_password', 's3cret')
+    writePlan = [vlanId, sipPassword]
+    assert diffWritePlan(writePlan, {('41d044f', None): '20'}) == ([], [vlanId], [sipPassword])
+    assert diffWritePlan(writePlan, {('41d044f', None): '20'}, writeUnreadable=True) == ([sipPassword], [vlanId], [])
+    assert diffWritePlan(writePlan, {('41d044f', None): '10'}) == ([vlanId, sipPassword], [], [])
+
+
+def testReadPlanValuesReadsOnlyWhatThePhoneShowsBack(phoneAddress, emulatedPhone):
+    emulatedPhone.items.update({'41d044f': '20', '40b041c': '10.0.0.2'})
+    hostName, sessionId = logOn(phoneAddress)
+    writePlan = buildWritePlan([
+        encodeSetting('lan_port', 'vlan_id', 20),
+        encodeSetting('lan_port', 'vlan_mode', True),
+        encodeSetting('voip', 'sip_server_two', '10.0.0.2'),
+        encodeSetting('voip', 'sip_server_two_port', '5070'),
+        encodeSetting('voip', 'sip_password', 's3cret'),
+    ])
+    assert readPlanValues(hostName, sessionId, writePlan, False) == {
+        ('40b041c', 'type'): '10.0.0.2',
+        ('41d044e', None): '',
+        ('41d044f', None): '20',
+    }
+    assert emulatedPhone.counters['reads'] == 3
+
+
+def testLogOnKeepsThePageAfterTheSessionLink(phoneAddress, monkeypatch):
+    # Some firmware shows the phone's details below the menu links
+    monkeypatch.setattr(nec_phone_emulator, 'logOnPage', '''<html><head><title>{model} Web Setting</title></head><body>
+<a href="index.cgi?session={sessionId}">Menu</a>''' + '<p>menu entry</p>' * 200 + '''
+<p>Terminal Type: {model}</p><p>Firmware Version: {firmware}</p><p>MAC Address: {mac}</p>
+</body></html>''')
+    hostName = 'http://' + phoneAddress
+    logOnResult = logOnPhoneResult(hostName, 'ADMIN', '6633222', False)
+    assert logOnResult.outcome == 'ok'
+    phoneInfo = identifyPhonePage(logOnResult.pageText)
+    assert phoneInfo['firmware'] == '5.2.3.0'
+    assert phoneInfo['mac'].startswith('00:60:b9:')
+    assert readPhoneMac(hostName, logOnResult.sessionId, False, None, logOnResult.pageText) == phoneInfo['mac']
+
+
+def testWrongCredentialsAreReportedAsSuch(phoneAddress):
+    assert logOnPhoneResult('http://' + phoneAddress, 'ADMIN', 'wrong', False).outcome == 'bad_credentials'
+
+
+def testRebootRequestsAreSentOnceAndDoNotTripTheCircuit(phoneAddress, emulatedPhone):
+    hostName, sessionId = logOn(phoneAddress)
+    # The phone goes down before it answers, as it may on a logoff
+    emulatedPhone.reboot(60)
+    try:
+        for attempt in range(phoneVariables['system']['circuitFailureThreshold'] + 1):
+            logOffResponse = logOffPhone(hostName, sessionId, False, False)
+            assert logOffResponse.status_code == 200
+            assert logOffResponse.rebootDropped == 'connection'
+            assert logOffResponse.attempts == 1
+            resetResponse = passSingleParameter(hostName, sessionId, 'hard_reset', passParameterCodes['hard_reset'], False, False)
+            assert resetResponse.rebootDropped == 'connection'
+        assert phoneAddress not in circuitStates
+        checkCircuit(phoneAddress)
+        # Other requests are retried and do count
+        with pytest.raises(PhoneRequestError) as requestError:
+            getSingleItem(hostName, sessionId, '41d044f', False)
+        assert requestError.value.kind == 'connection'
+        with pytest.raises(PhoneRequestError) as requestError:
+            checkCircuit(phoneAddress)
+        assert requestError.value.kind == 'circuit_open'
+    finally:
+        emulatedPhone.rebootUntil = 0.0
+
+
+def testFingerprintIsCachedPerPhone(phoneAddress):
+    hostName = 'http://' + phoneAddress
+    assert cachedFingerprint(hostName) is None
+    phoneInfo = fingerprintPhone(hostName, False)
+    assert phoneInfo['model'] == 'DT800'
+    # The logon form shows the model but not the firmware
+    assert phoneInfo['firmware'] is None
+    fingerprint = storeFingerprint(hostName, dict(phoneInfo, firmware='5.2.3.0'))
+    assert fingerprint['family'] == 'DT800'
+    assert cachedFingerprint('https://' + phoneAddress)['firmware'] == '5.2.3.0'
+    assert cachedFingerprint(hostName, maxAge=-1) is None
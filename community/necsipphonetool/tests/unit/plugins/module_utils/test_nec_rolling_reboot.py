@@ -0,0 +1,68 @@
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_phone_tool import logOnPhoneResult, pendingReboots, queueReboot
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_rolling_reboot import rebootWaves, rollingReboot
+
+# Short waits: the emulated phones are down for a second after a reboot
+waitTimes = {'readyTimeout': 10, 'pollInterval': 1, 'downTimeout': 3}
+
+
+def queueLoggedOnReboot(emulator, phoneAddress):
+    hostName = 'http://' + phoneAddress
+    sessionId = logOnPhoneResult(hostName, 'ADMIN', '6633222', False).sessionId
+    queueReboot(hostName, sessionId)
+    return emulator.phone(phoneAddress.split(':')[0])
+
+
+def testWavesAreRunsOfSizeInHostOrder():
+    hosts = ['10.4.0.{}'.format(number) for number in (5, 1, 4, 2, 3)]
+    assert rebootWaves(hosts, 2) == [
+        (None, ['10.4.0.1', '10.4.0.2']), (None, ['10.4.0.3', '10.4.0.4']), (None, ['10.4.0.5'])]
+    assert rebootWaves(hosts, 0) == [(None, sorted(hosts))]
+
+
+def testSubnetWavesKeepEachSubnetApart():
+    hosts = ['10.4.1.7', '10.4.0.2', 'phone.example.com', '10.4.0.3:8080', '10.4.1.8']
+    assert rebootWaves(hosts, 0, 'subnet') == [
+        ('10.4.0.0/24', ['10.4.0.2', '10.4.0.3:8080']),
+        ('10.4.1.0/24', ['10.4.1.7', '10.4.1.8']),
+        (None, ['phone.example.com']),
+    ]
+    assert rebootWaves(hosts, 1, 'subnet', 16)[:2] == [('10.4.0.0/16', ['10.4.0.2']), ('10.4.0.0/16', ['10.4.0.3:8080'])]
+
+
+def testWaveReportsReadyExpiredAndNotSeenDownPhones(emulator, newPhoneAddress, monkeypatch):
+    monkeypatch.setattr(emulator, 'rebootDelay', 1.5)
+    readyAddress, expiredAddress, resetAddress = newPhoneAddress(), newPhoneAddress(), newPhoneAddress()
+    readyPhone = queueLoggedOnReboot(emulator, readyAddress)
+    # The session ended before the release, its writes were never saved
+    queueLoggedOnReboot(emulator, expiredAddress).sessionId = None
+    # A reset without a session only gets the logon form, the phone stays up
+    queueReboot('http://' + resetAddress, None, 'hard_reset')
+
+    waveResults = rollingReboot(pendingReboots(), waveSize=0, **waitTimes)
+    assert len(waveResults) == 1
+    waveResult = waveResults[0]
+    assert waveResult['ready'] == [readyAddress]
+    assert waveResult['failed'] == [expiredAddress]
+    assert waveResult['not_ready'] == [resetAddress]
+    assert 'expired' in waveResult['errors'][expiredAddress]
+    assert 'not seen going down' in waveResult['errors'][resetAddress]
+    assert readyPhone.counters['reboots'] == 1
+    assert emulator.phone(expiredAddress.split(':')[0]).counters['reboots'] == 0
+    assert pendingReboots() == {}
+
+
+def testAWaveThatDidNotComeBackHaltsTheRun(emulator, newPhoneAddress, monkeypatch):
+    monkeypatch.setattr(emulator, 'rebootDelay', 1.5)
+    firstAddress, secondAddress = sorted([newPhoneAddress(), newPhoneAddress()])
+    queueLoggedOnReboot(emulator, firstAddress).sessionId = None
+    secondPhone = queueLoggedOnReboot(emulator, secondAddress)
+    reportedWaves = []
+
+    waveResults = rollingReboot(pendingReboots(), waveSize=1, report=reportedWaves.append, **waitTimes)
+    assert waveResults == reportedWaves
+    assert len(waveResults) == 1 and waveResults[0]['halted']
+    assert secondPhone.counters['reboots'] == 0
+    assert list(pendingReboots()) == [secondAddress]
@@ -0,0 +1,91 @@
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+
+import pytest
+
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_snapshot_store import SnapshotStore, configHash
+
+
+def siteConfig(address, **lanPort):
+    lanPortValues = {
+        'default_gateway': '10.4.0.1', 'dhcp_mode': False, 'dns_address': '10.4.0.2', 'ip_address': address,
+        'lldp_mode': True, 'port_speed': 'auto', 'subnet_mask': '255.255.255.0', 'vlan_id': 20, 'vlan_mode': True,
+        'vlan_priority': 5,
+    }
+    lanPortValues.update(lanPort)
+    return {'lan_port': lanPortValues, 'voip': {'sip_server_one': '10.4.0.10', 'sip_extension': address.rsplit('.', 1)[1]}}
+
+
+@pytest.fixture
+def snapshotStore(tmp_path):
+    with SnapshotStore(str(tmp_path / 'snapshots.db')) as store:
+        yield store
+
+
+def testSameConfigIsStoredOnceAndUnchangedSnapshotsAddNoHistory(snapshotStore):
+    config = siteConfig('10.4.0.21')
+    assert snapshotStore.storeSnapshot('phone1', config, taken=1) == (configHash(config), True)
+    assert snapshotStore.storeSnapshot('phone1', config, taken=2) == (configHash(config), False)
+    snapshotStore.storeSnapshot('phone2', config, taken=2)
+    assert snapshotStore.stats()['configs'] == 1
+    assert snapshotStore.history('phone1') == [(1, configHash(config))]
+    assert snapshotStore.hostsWithHash(configHash(config)) == ['phone1', 'phone2']
+
+
+def testSectionsAreStoredAsDeltasOfABaseAndReadBackWhole(snapshotStore):
+    firstConfig = siteConfig('10.4.0.21')
+    secondConfig = siteConfig('10.4.0.22', vlan_id=30)
+    snapshotStore.storeSnapshots([('phone1', firstConfig, None), ('phone2', secondConfig, None)])
+    deltaSections = snapshotStore.db.execute("SELECT COUNT(*) FROM sections WHERE name = 'lan_port' AND base_id IS NOT NULL").fetchone()[0]
+    assert deltaSections == 1
+    assert snapshotStore.latestConfig('phone2') == secondConfig
+    assert snapshotStore.config(configHash(firstConfig)) == firstConfig
+
+
+def testKeysMissingFromADeltaAreRemovedAndEmptyValuesKept(snapshotStore):
+    baseConfig = siteConfig('10.4.0.21')
+    removedConfig = siteConfig('10.4.0.22')
+    del removedConfig['lan_port']['vlan_priority']
+    emptyConfig = siteConfig('10.4.0.23', vlan_priority='')
+    snapshotStore.storeSnapshots([('phone1', baseConfig, None), ('phone2', removedConfig, None), ('phone3', emptyConfig, None)])
+    assert snapshotStore.latestConfig('phone2') == removedConfig
+    assert snapshotStore.latestConfig('phone3') == emptyConfig
+    assert configHash(removedConfig) != configHash(emptyConfig)
+    # Reading through a fresh connection does not rely on cached sections
+    snapshotStore.close()
+    with SnapshotStore(snapshotStore.storePath) as reopenedStore:
+        assert reopenedStore.latestConfig('phone2') == removedConfig
+        assert 'vlan_priority' not in reopenedStore.latestConfig('phone2')['lan_port']
+
+
+def testSettingLookupFollowsDeltasToTheirBase(snapshotStore):
+    snapshotStore.storeSnapshots([
+        ('phone1', siteConfig('10.4.0.21'), None),
+        ('phone2', siteConfig('10.4.0.22'), None),
+        ('phone3', siteConfig('10.4.0.23', vlan_id=30), None),
+    ])
+    assert snapshotStore.hostsWithSetting('lan_port', 'vlan_id', 20) == ['phone1', 'phone2']
+    assert snapshotStore.hostsWithSetting('lan_port', 'vlan_id', 30) == ['phone3']
+    assert snapshotStore.hostsWithSetting('lan_port', 'port_speed', 'auto') == ['phone1', 'phone2', 'phone3']
+
+
+def testAPhoneKeepsItsHistoryAcrossAddressesByMac(snapshotStore):
+    snapshotStore.storeSnapshot('10.4.0.21', siteConfig('10.4.0.21'), taken=1, mac='00-60-B9-00-00-21')
+    snapshotStore.storeSnapshot('10.4.0.99', siteConfig('10.4.0.99'), taken=2, mac='00:60:b9:00:00:21')
+    assert snapshotStore.hostRecord('10.4.0.21') is None
+    assert snapshotStore.hostRecord('00:60:b9:00:00:21')[1] == '10.4.0.99'
+    assert len(snapshotStore.history('10.4.0.99')) == 2
+    # A new phone at the old address starts its own history
+    snapshotStore.storeSnapshot('10.4.0.99', siteConfig('10.4.0.99'), taken=3, mac='00:60:b9:00:00:77')
+    assert snapshotStore.stats()['hosts'] == 2
+    assert snapshotStore.hostRecord('00:60:b9:00:00:21')[1] is None
+    assert len(snapshotStore.history('00:60:b9:00:00:77')) == 1
+
+
+def testStoreFromAnotherVersionIsRefused(tmp_path):
+    storePath = str(tmp_path / 'snapshots.db')
+    SnapshotStore(storePath).close()
+    with SnapshotStore(storePath) as snapshotStore:
+        snapshotStore.db.execute('PRAGMA user_version = 1')
+    with pytest.raises(ValueError):
+        SnapshotStore(storePath)
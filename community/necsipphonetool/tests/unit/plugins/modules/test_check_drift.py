@@ -0,0 +1,50 @@
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+
+from ansible_collections.community.necsipphonetool.plugins.module_utils.nec_snapshot_store import SnapshotStore
+from ansible_collections.community.necsipphonetool.plugins.modules import check_drift, get_config
+
+
+def driftParams(taskParams, phoneAddress, snapshotStore, **options):
+    return taskParams(check_drift.module_args, host=phoneAddress, username='ADMIN', password='6633222', force_http=True,
+                      snapshot_store=snapshotStore, **options)
+
+
+def testDriftIsReportedAndTheCheckHeldInTheStore(taskParams, phoneAddress, emulatedPhone, tmp_path):
+    emulatedPhone.items.update({'41d044e': '1', '41d044f': '10'})
+    params = driftParams(taskParams, phoneAddress, str(tmp_path / 'drift.db'), lan_port={'vlan_id': 20, 'vlan_mode': True},
+                         voip={'sip_password': 's3cret'})
+    result = check_drift.checkPhoneDrift(params)
+    assert result['checked'] == 'phone'
+    assert result['drift'] == {'lan_port': {'vlan_id': {'desired': 20, 'actual': 10}}}
+    assert result['unchecked'] == {'voip': ['sip_password']}
+    assert result['ansible_facts'] == {'nec_drift': {'lan_port': {'vlan_id': 20}}}
+
+    reads = emulatedPhone.counters['reads']
+    result = check_drift.checkPhoneDrift(params)
+    assert result['checked'] == 'store'
+    assert result['drift'] == {'lan_port': {'vlan_id': {'desired': 20, 'actual': 10}}}
+    assert emulatedPhone.counters['reads'] == reads
+
+
+def testCheckAndGetConfigShareOneHistoryByMac(taskParams, phoneAddress, emulatedPhone, tmp_path):
+    storePath = str(tmp_path / 'drift.db')
+    configResult = get_config.readPhoneConfig(taskParams(
+        get_config.module_args, host=phoneAddress, username='ADMIN', password='6633222', force_http=True,
+        sections=['lan_port', 'voip'], snapshot_store=storePath))
+    assert configResult['snapshot_mac'] == emulatedPhone.mac
+
+    emulatedPhone.items['41d044f'] = '20'
+    driftResult = check_drift.checkPhoneDrift(driftParams(taskParams, phoneAddress, storePath, lan_port={'vlan_id': 20}))
+    assert driftResult['snapshot_mac'] == emulatedPhone.mac
+    assert driftResult['compliant']
+
+    with SnapshotStore(storePath) as snapshotStore:
+        assert snapshotStore.stats()['hosts'] == 1
+        assert snapshotStore.hostRecord(phoneAddress)[2] == emulatedPhone.mac
+        assert len(snapshotStore.history(emulatedPhone.mac)) == 2
+        # Only lan_port was read for the check, voip is kept from get_config
+        latestConfig = snapshotStore.latestConfig(emulatedPhone.mac)
+        assert latestConfig['lan_port']['vlan_id'] == 20
+        assert 'voip' in latestConfig
+        assert snapshotStore.lastCheck(emulatedPhone.mac)[3] == {}
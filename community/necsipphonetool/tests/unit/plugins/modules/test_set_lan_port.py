@@ -0,0 +1,57 @@
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+
+from ansible_collections.community.necsipphonetool.plugins.modules import set_lan_port
+
+
+def lanPortParams(taskParams, phoneAddress, checkMode=False, **options):
+    return taskParams(set_lan_port.module_args, checkMode, host=phoneAddress, username='ADMIN', password='6633222',
+                      force_http=True, **options)
+
+
+def testSettingsAlreadySetAreNotSentAndDoNotReboot(taskParams, phoneAddress, emulatedPhone):
+    params = lanPortParams(taskParams, phoneAddress, vlan_id=20, vlan_mode=True)
+    result = set_lan_port.setLanPort(params)
+    assert result['changed'] and result['rebooted']
+    assert emulatedPhone.items == {'41d044e': '1', '41d044f': '20'}
+
+    writes = emulatedPhone.counters['writes']
+    result = set_lan_port.setLanPort(params)
+    assert not result['changed'] and not result['rebooted']
+    assert sorted(result['unchanged']) == ['VLAN ID', 'VLAN mode']
+    assert emulatedPhone.counters['writes'] == writes
+    assert emulatedPhone.counters['reboots'] == 1
+
+
+def testOnlyTheChangedSettingIsSent(taskParams, phoneAddress, emulatedPhone):
+    emulatedPhone.items.update({'41d044e': '1', '41d044f': '10'})
+    result = set_lan_port.setLanPort(lanPortParams(taskParams, phoneAddress, vlan_id=20, vlan_mode=True))
+    assert [itemResult['label'] for itemResult in result['items']] == ['VLAN ID']
+    assert result['message'] == ['VLAN ID set to 20']
+
+
+def testCheckModeReportsWhatWouldChangeWithoutWriting(taskParams, phoneAddress, emulatedPhone):
+    emulatedPhone.items['41d044e'] = '1'
+    result = set_lan_port.setLanPort(lanPortParams(taskParams, phoneAddress, True, vlan_id=20, vlan_mode=True))
+    assert result['changed'] and not result['failed'] and not result['rebooted']
+    assert result['message'] == ['Would set VLAN ID to 20']
+    assert result['unchanged'] == ['VLAN mode']
+    assert emulatedPhone.counters['writes'] == 0
+    assert emulatedPhone.counters['reboots'] == 0
+
+    emulatedPhone.items['41d044f'] = '20'
+    result = set_lan_port.setLanPort(lanPortParams(taskParams, phoneAddress, True, vlan_id=20, vlan_mode=True))
+    assert not result['changed'] and result['items'] == []
+
+
+def testDeferredRebootLeavesTheWritesUnsaved(taskParams, phoneAddress, emulatedPhone):
+    result = set_lan_port.setLanPort(lanPortParams(taskParams, phoneAddress, defer_reboot=True, vlan_id=20))
+    assert result['changed'] and result['reboot_deferred'] and not result['rebooted']
+    assert emulatedPhone.counters['reboots'] == 0
+    assert emulatedPhone.sessionId is not None
+
+
+def testMissingCredentialsFailBeforeAnyRequest(taskParams, phoneAddress, emulatedPhone):
+    result = set_lan_port.setLanPort(taskParams(set_lan_port.module_args, host=phoneAddress, force_http=True, vlan_id=20))
+    assert result['error_kind'] == 'bad_credentials'
+    assert emulatedPhone.counters['requests'] == 0
@@ -0,0 +1,40 @@
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+
+from ansible_collections.community.necsipphonetool.plugins.modules import set_voip
+
+
+def voipParams(taskParams, phoneAddress, **options):
+    return taskParams(set_voip.module_args, host=phoneAddress, username='ADMIN', password='6633222', force_http=True, **options)
+
+
+def testServerAndItsPortAreBothSentWithAWarning(taskParams, phoneAddress, emulatedPhone):
+    result = set_voip.setVoip(voipParams(taskParams, phoneAddress, sip_server_two='10.0.0.2', sip_server_two_port='5070'))
+    assert 'msg' not in result
+    assert result['changed'] and not result['failed']
+    assert result['warnings'] == ['SIP server two and SIP server two port are written to the same item code on the phone, check that it kept both']
+    assert sorted(itemResult['label'] for itemResult in result['items']) == ['SIP server two', 'SIP server two port']
+
+
+def testSecretAloneIsNotSentUnlessAskedFor(taskParams, phoneAddress, emulatedPhone):
+    result = set_voip.setVoip(voipParams(taskParams, phoneAddress, sip_password='s3cret'))
+    assert not result['changed'] and not result['rebooted']
+    assert result['unverified'] == ['SIP password']
+    assert emulatedPhone.counters['writes'] == 0
+
+    result = set_voip.setVoip(voipParams(taskParams, phoneAddress, sip_password='s3cret', write_unreadable=True))
+    assert result['changed'] and result['rebooted']
+    assert result['items'][0]['value'] == '********'
+    assert emulatedPhone.items['40a0419'] == 's3cret'
+
+
+def testSecretGoesAlongWithAReadableChange(taskParams, phoneAddress, emulatedPhone):
+    result = set_voip.setVoip(voipParams(taskParams, phoneAddress, sip_password='s3cret', sip_extension='2001'))
+    assert sorted(itemResult['label'] for itemResult in result['items']) == ['SIP extension', 'SIP password']
+    assert result['unverified'] == []
+    assert emulatedPhone.counters['reboots'] == 1
+
+
+def testSecretsAreNoLog():
+    for option in ('encryption_otp', 'password', 'sip_password', 'username'):
+        assert set_voip.module_args[option].get('no_log'), option
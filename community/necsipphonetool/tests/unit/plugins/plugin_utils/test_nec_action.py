@@ -0,0 +1,19 @@
+# Copyright: (c) 2022, Raymond Rizzo <ray@raymondrizzo.com>
+#  MIT license (see COPYING or https://opensource.org/licenses/MIT)
+
+from ansible_collections.community.necsipphonetool.plugins.modules import nec_phone_config
+from ansible_collections.community.necsipphonetool.plugins.plugin_utils.nec_action import noLogValues
+
+
+def testNoLogValuesIncludeSuboptions():
+    params = {
+        'host': '10.4.0.21', 'username': 'ADMIN', 'password': '6633222',
+        'voip': {'sip_extension': '2001', 'sip_password': 's3cret', 'encryption_otp': None},
+        'lan_port': {'vlan_id': 20},
+        'pc_port': None,
+    }
+    assert noLogValues(nec_phone_config.module_args, params) == {'ADMIN', '6633222', 's3cret'}
+
+
+def testEmptyNoLogValuesAreNotMasked():
+    assert noLogValues(nec_phone_config.module_args, {'username': '', 'password': None, 'voip': {'sip_password': ''}}) == set()